@@ -0,0 +1,104 @@
+##
+##  See COPYING file distributed along with the ncanda-data-integration package
+##  for the copyright and license terms
+##
+
+"""
+Concurrent export of REDCap records in batches
+
+Each batch is exported by one of a bounded number of workers. A batch that
+cannot reach REDCap or comes back empty is retried on its own, with
+exponential backoff; any other error is raised. The exported batches are
+concatenated once, in the order of the record list.
+"""
+
+import time
+import concurrent.futures
+import pandas
+import requests
+
+# Errors of an export that are worth retrying
+CONNECTION_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+
+
+def batch(iterable, n=1):
+    """
+    For batch processing of records
+
+    :param iterable:
+    :param n: batch size
+    :return: generator
+    """
+    l = len(iterable)
+    for ndx in range(0, l, n):
+        yield iterable[ndx : min(ndx + n, l)]
+
+
+def export_in_batches(
+    export_batch,
+    records,
+    batch_size=100,
+    max_workers=4,
+    max_tries=3,
+    backoff=5,
+    executor=None,
+    verbose=False,
+):
+    """
+    Call export_batch(record_batch) for each batch of records - it returns a
+    data frame, or None if the export failed.
+
+    Returns the concatenated data frame and the list of batches that still
+    failed (or were empty) after max_tries attempts; waits backoff, 2*backoff,
+    ... seconds between the attempts of a batch. Only connection errors and
+    timeouts raised by export_batch are retried.
+
+    The batches are exported by executor if given (so that callers can keep
+    per-thread connections across calls), otherwise by max_workers threads.
+    """
+
+    def export_with_retries(record_batch):
+        for attempt in range(1, max_tries + 1):
+            try:
+                df = export_batch(record_batch)
+            except CONNECTION_ERRORS as e:
+                df = None
+                if verbose:
+                    print("Batch export raised", repr(e))
+
+            if df is not None and not df.empty:
+                return df
+
+            if attempt < max_tries:
+                delay = backoff * 2 ** (attempt - 1)
+                if verbose:
+                    print(
+                        "No REDCap data records found for batch starting with {} "
+                        "(attempt {}/{}), retrying in {}s".format(
+                            record_batch[0], attempt, max_tries, delay
+                        )
+                    )
+                time.sleep(delay)
+
+        return None
+
+    record_batches = list(batch(records, n=batch_size))
+    if executor:
+        results = list(executor.map(export_with_retries, record_batches))
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(export_with_retries, record_batches))
+
+    frames = [df for df in results if df is not None]
+    failed_batches = [
+        record_batch
+        for (record_batch, df) in zip(record_batches, results)
+        if df is None
+    ]
+
+    if frames:
+        exported = pandas.concat(frames)
+    else:
+        exported = pandas.DataFrame()
+
+    return exported, failed_batches
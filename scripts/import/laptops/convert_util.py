@@ -2,9 +2,22 @@ import sys
 import hashlib
 from sibispy import sibislogger as slog
 
+
+# Raised by the converter functions instead of exiting - the command line
+# wrappers post the issue and exit, harvester posts it and moves on
+class ConversionError(Exception):
+    def __init__(self, issue_label, issue_title, **kwargs):
+        Exception.__init__(self, issue_title)
+        self.issue_label = issue_label
+        self.issue_title = issue_title
+        self.kwargs = kwargs
+
+
 # have to post issues that way so that github is not overwhelmed with calls 
-def post_issue(script, infile, verbose, post_to_github, issue_label, issue_title, **kwargs):
-    slog.init_log(verbose, post_to_github,'NCANDA Import-Laptop: ' + script + ' Message', script)
+def post_issue(script, infile, verbose, post_to_github, issue_label, issue_title, init_log=True, **kwargs):
+    # Called in-process (e.g., from harvester) the caller's log is used
+    if init_log:
+        slog.init_log(verbose, post_to_github,'NCANDA Import-Laptop: ' + script + ' Message', script)
 
     if 'post_resolution_instructions' not in kwargs:
         infoTxt="After this issue is resolved please run 'harvester --file-to-upload " + infile + " --overwrite' to insure that data is upload to redcap" 
@@ -20,3 +33,4 @@ def post_issue_and_exit(script, infile, verbose, post_to_github, issue_label,
     post_issue(script, infile, verbose, post_to_github, issue_label,
                issue_title, **kwargs)
     sys.exit(1)
+
@@ -0,0 +1,451 @@
+##
+##  See COPYING file distributed along with the ncanda-data-integration package
+##  for the copyright and license terms
+##
+
+"""
+Import contents of CSV files into a non-longitudinal REDCap project (used by
+csv2redcap and harvester)
+"""
+
+from builtins import str
+import re
+import os
+import sys
+import hashlib
+import csv
+import io
+
+import pandas as pd
+
+from sibispy import sibislogger as slog
+
+
+def is_form_status_field(field_name):
+    """
+    REDCap form status fields end in '_complete'.
+
+    This intentionally does not match LimeSurvey timestamp fields such as
+    'lssaga1_youth_completed'.
+    """
+    return field_name.endswith("_complete")
+
+
+def normalize_redcap_value(value):
+    """
+    Normalize values before comparing CSV input to REDCap export values.
+
+    This avoids false differences due to NaN/None/empty string, whitespace,
+    or integer-like values represented as floats, e.g. 2.0 vs 2.
+    """
+    if pd.isna(value):
+        return ""
+
+    value = str(value).strip()
+
+    if re.match(r"^-?\d+\.0$", value):
+        value = re.sub(r"\.0$", "", value)
+
+    return value
+
+# SSAGA sex fields (e.g. lssaga1_youth_dm14sex1 ... dm14sex21) are supposed to
+# be REDCap-coded 1=Male, 2=Female, but some source CSVs encode them as 'M'/'F'
+# strings, which REDCap rejects on import. Normalize before upload.
+SEX_FIELD_REGEX = re.compile(r'dm14sex\d+$')
+SEX_VALUE_MAP = {'M': '1', 'F': '2'}
+
+def normalize_sex_fields(df):
+    sex_cols = [c for c in df.columns if SEX_FIELD_REGEX.search(c)]
+    for col in sex_cols:
+        df[col] = df[col].apply(
+            lambda v: SEX_VALUE_MAP.get(str(v).strip().upper(), v)
+            if pd.notna(v) else v
+        )
+    return df
+
+
+def parse_locked_form_fields(err_msg):
+    """
+    Parse REDCap locked-form upload errors and return the rejected field names.
+
+    Expected REDCap error pattern is something like:
+
+    '"E-70075-M-7-2026-03-11",
+      "limesurvey_ssaga_part_1_youth_complete",
+      "1",
+      "This field is located on a form that is locked..."'
+    """
+    err_text = str(err_msg)
+
+    if "This field is located on a form that is locked" not in err_text:
+        return []
+
+    locked_fields = []
+
+    # REDCap/PyCap often gives a dict-like string:
+    # {'error': '"record","field","value","message"'}
+    # Strip the outer wrapper when possible, then parse the inner CSV row.
+    csv_text = err_text
+    if csv_text.startswith("{'error': '") and csv_text.endswith("'}"):
+        csv_text = csv_text[len("{'error': '"):-2]
+
+    try:
+        reader = csv.reader(io.StringIO(csv_text))
+        for row in reader:
+            if len(row) >= 4 and "form that is locked" in row[3]:
+                locked_fields.append(row[1])
+    except Exception:
+        pass
+
+    # Fallback regex in case the above CSV parsing fails.
+    if not locked_fields:
+        locked_fields = re.findall(
+            r'"[^"]+","([^"]+)","[^"]*","[^"]*form that is locked[^"]*"',
+            err_text,
+        )
+
+    return list(set(locked_fields))
+
+
+def only_import_laptops_complete_lock_difference(
+    project,
+    record_list,
+    locked_fields,
+    verbose=False,
+):
+    """
+    Return True only for the known benign import_laptops locked-form case.
+
+    Benign case:
+      - REDCap rejected the upload because a form is locked.
+      - The rejected locked field is a REDCap form status field.
+      - Incoming CSV has that form status as 1.
+      - Existing import_laptops REDCap record has that form status as 2.
+      - No substantive fields differ.
+
+    redcap_data_access_group is intentionally excluded from the comparison
+    because it can be imported but is not a regular REDCap export field.
+    """
+    if not locked_fields:
+        return False
+
+    if not all(is_form_status_field(field) for field in locked_fields):
+        return False
+
+    incoming_records = {
+        record["record_id"]: record
+        for record in record_list
+        if "record_id" in record
+    }
+
+    if not incoming_records:
+        return False
+
+    fields_to_check = sorted({
+        field
+        for record in record_list
+        for field in record.keys()
+        if field not in ["record_id", "redcap_data_access_group"]
+    })
+
+    try:
+        existing_df = project.export_records(
+            records=list(incoming_records.keys()),
+            fields=fields_to_check,
+            format_type="df",
+        )
+    except Exception as export_err:
+        if verbose:
+            print("Could not export existing REDCap records for locked-form check:",
+                  export_err)
+        return False
+
+    for record_id, incoming in incoming_records.items():
+        if record_id not in existing_df.index:
+            if verbose:
+                print("Record not found in REDCap during locked-form check:",
+                      record_id)
+            return False
+
+        existing = existing_df.loc[record_id]
+
+        for field, incoming_value in incoming.items():
+            if field in ["record_id", "redcap_data_access_group"]:
+                continue
+
+            existing_value = existing[field] if field in existing.index else ""
+
+            incoming_norm = normalize_redcap_value(incoming_value)
+            existing_norm = normalize_redcap_value(existing_value)
+
+            if incoming_norm == existing_norm:
+                continue
+
+            # The only allowed difference:
+            # incoming CSV says form status 1, existing REDCap says status 2.
+            if (
+                field in locked_fields
+                and is_form_status_field(field)
+                and incoming_norm == "1"
+                and existing_norm == "2"
+            ):
+                continue
+
+            if verbose:
+                print(
+                    "Non-benign locked-form difference:",
+                    record_id,
+                    field,
+                    "existing=%r" % existing_norm,
+                    "incoming=%r" % incoming_norm,
+                )
+
+            return False
+
+    return True
+
+
+class CsvImporter(object):
+    """
+    Imports CSV files into a non-longitudinal REDCap project. Counts the
+    records read and uploaded, and lists the files whose upload failed.
+    """
+    def __init__(self, project, project_name="import_laptops", force_update=False,
+                 update_dag_only=False, verbose=False):
+        self.project = project
+        self.project_name = project_name
+        self.force_update = force_update
+        self.update_dag_only = update_dag_only
+        self.verbose = verbose
+        self.records = 0
+        self.uploaded = 0
+        # List of failed files
+        self.failed = []
+
+    def process_file(self, fname, data_access_group=None, use_file_dag=False):
+        """
+        Import one CSV file. The records are assigned to data_access_group, or
+        to the DAG named in the file if use_file_dag is set. Returns False if
+        the file could not be imported.
+        """
+        project = self.project
+
+        # Read input file
+        data = pd.read_csv(fname, dtype=object)
+
+        # Replace periods in column labels with underscores
+        data.rename(columns=lambda s: s.replace('.', '_').lower(),
+                    inplace=True)
+
+        data = normalize_sex_fields(data)   # resolve the lssaga dm14 sex mapping
+
+        # Bring original "siteid" column back to assign each record to the correct
+        # data access group
+        if data_access_group:
+            site = data_access_group
+        elif use_file_dag:
+            site = get_dag_from_df(data, verbose=self.verbose)
+            if not site:
+                slog.info(
+                    (hashlib.sha1(('import-laptops-csv2redcap / use-file-dag {}'
+                                  .format(os.path.basename(fname))).encode())
+                     .hexdigest()[0:6]),
+                    "ERROR: Site could not be inferred from file",
+                    instruction="You should re-run csv2redcap with a manually "
+                                "specified DAG in --data-access-group",
+                    filename=fname,
+                )
+                return False
+        else:
+            site = None
+        data['redcap_data_access_group'] = site
+
+        # Get REDCap form-status fields of existing records so we can protect
+        # records already marked Complete from overwriting.
+        #
+        # Previously this looked for '*_completed', which matched LimeSurvey
+        # timestamp fields such as 'lssaga1_youth_completed'. REDCap form status
+        # fields are '*_complete'.
+        complete_fields = [
+            var for var in data.columns
+            if is_form_status_field(var)
+            and var != 'visit_information_complete'
+        ]
+
+        if complete_fields:
+            existing_data = project.export_records(fields=complete_fields,
+                                                   format_type='df')
+
+        # Make list of dicts for REDCap import
+        record_list = []
+        for key, row in data.iterrows():
+            if 'record_id' not in row.index:
+                justFile = os.path.basename(fname)
+                slog.info(
+                    "%s-%s" % (str(row['redcap_data_access_group']),
+                               hashlib.sha1(fname.encode()).hexdigest()[0:6]),
+                    "'record_id' is not defined in file '%s'!" % justFile,
+                    cmd=" ".join(sys.argv),
+                    file_name=fname,
+                    project=self.project_name
+                )
+                return False
+
+            row['record_id'] = re.sub(r'(#|&|\+|\')', '?', row['record_id'])
+
+            record_id = row['record_id']
+            if complete_fields:
+                if record_id in existing_data.index.tolist():
+                    already_complete = any(
+                        normalize_redcap_value(existing_data[field][record_id]) == "2"
+                        for field in complete_fields
+                        if field in existing_data.columns
+                    )
+
+                    if already_complete:
+                        if self.force_update:
+                            print("Forcing update of 'Complete' record", record_id)
+                        else:
+                            continue
+
+            # DAG stuff
+            if self.update_dag_only:
+                row = row[['record_id', 'redcap_data_access_group']]
+                if self.verbose:
+                    print("%s assigned to %s" % (record_id,
+                                                 row['redcap_data_access_group']))
+
+            # Prune and convert to dict
+            record = dict(row.dropna().apply(lambda s: re.sub(r'&quot;', '""', s)))
+            record_list.append(record)
+
+        # If every record was skipped because it was already complete, there is
+        # nothing to upload. Treat this as success.
+        if len(record_list) == 0:
+            self.records += len(data)
+            if self.verbose:
+                print("%s: No records to upload after Complete-record protection."
+                      % fname)
+            return True
+
+        # Upload new data to REDCap
+        try:
+            import_response = project.import_records(record_list,
+                                                     overwrite='overwrite')
+
+        except Exception as err_msg:
+            locked_fields = parse_locked_form_fields(err_msg)
+
+            if (
+                self.project_name == "import_laptops"
+                and locked_fields
+                and only_import_laptops_complete_lock_difference(
+                    project,
+                    record_list,
+                    locked_fields=locked_fields,
+                    verbose=self.verbose,
+                )
+            ):
+                if self.verbose:
+                    print(
+                        "WARNING: %s: Skipping benign import_laptops locked-form "
+                        "status-only difference." % fname
+                    )
+                    print(
+                        "WARNING: Existing import_laptops record is Complete/locked "
+                        "with REDCap form status 2, while incoming CSV has form "
+                        "status 1."
+                    )
+                    print(
+                        "WARNING: No substantive data differences were found; "
+                        "treating as benign no-op."
+                    )
+                    print(
+                        "WARNING: Locked form-status field(s): %s"
+                        % ", ".join(sorted(locked_fields))
+                    )
+
+                import_response = {
+                    "count": 0,
+                    "benign_import_laptops_locked_complete_status": True,
+                    "fields": locked_fields,
+                }
+
+            else:
+                justFile = os.path.basename(fname)
+                slog.info(
+                    str(data_access_group) + "-" +
+                    hashlib.sha1((fname + str(err_msg)).encode()).hexdigest()[0:6],
+                    "Upload error to redcap for file " + justFile,
+                    error_msg=str(err_msg),
+                    record_list=str(record_list),
+                    cmd=" ".join(sys.argv),
+                    file_name=fname,
+                    project=self.project_name
+                )
+                return False
+
+        # If there were any errors, try to print them as well as possible
+        if 'error' in list(import_response.keys()):
+            error = "Upload error"
+            slog.info(hashlib.sha1('import-laptops-csv2redcap {}'.format(import_response['error']).encode()).hexdigest()[0:6], error,
+                      error_msg=str(import_response['error']))
+
+        if 'fields' in list(import_response.keys()):
+            for field in import_response['fields']:
+                print("\t", field)
+
+        if 'records' in list(import_response.keys()):
+            for record in import_response['records']:
+                print("\t", record)
+
+        # Finally, print upload status if so desired
+        if 'count' in list(import_response.keys()):
+            self.uploaded += import_response['count']
+            self.records += len(data)
+            if self.verbose:
+                print(("%s: Successfully uploaded %d/%d records to REDCap.") %
+                      (fname, import_response['count'], len(data)))
+        else:
+            self.failed.append(fname)
+
+        return True
+
+
+def get_dag_from_df(df, dag_field_regex=r'_[sS]ite\d?', site_lookup=None,
+                    default_site=None, preserve_invalid_dag=False,
+                    verbose=False):
+    """
+    If present, extract and translate the content of the DAG field in the file.
+
+    By default, the DAG field is expected to be a single lowercase letter to be
+    converted to one of NCANDA's five sites.
+
+    If the DAG field is not found in site_lookup, the result is default_site
+    or, if preserve_invalid_dag is set, the original value.
+    """
+    if not site_lookup:
+        site_lookup = {
+            'a': 'upmc',
+            'b': 'sri',
+            'c': 'duke',
+            'd': 'ohsu',
+            'e': 'ucsd',
+        }
+
+    varnames = [col for col in df.columns if re.search(dag_field_regex, col)]
+    if len(varnames) < 1:
+        if verbose:
+            print("Regex %s found %d columns, expected 1" % (dag_field_regex,
+                                                             len(varnames)))
+        return None
+    dag_varname = varnames[0]
+
+    # .item() ensures that the *content* of the cell is returned, not a Series
+    # with a single column
+    if preserve_invalid_dag:
+        return df[dag_varname].map(lambda x: site_lookup.get(x, x)).item()
+    else:
+        return (df[dag_varname]
+                .map(lambda x: site_lookup.get(x, default_site))
+                .item())
@@ -0,0 +1,118 @@
+##
+##  See COPYING file distributed along with the ncanda-data-integration package
+##  for the copyright and license terms
+##
+
+"""
+Convert a Delayed Discounting results file to CSV (used by dd2csv and harvester)
+"""
+
+from builtins import str
+import pandas
+import re
+import os
+
+from convert_util import ConversionError
+
+
+def convert_dd(ddfile, outdir, overwrite=False):
+    """
+    Convert ddfile into a CSV file in outdir. Returns the list of CSV files
+    written; raises ConversionError if the file cannot be converted.
+    """
+    #Get experiment_id for logs
+    subject_label = str(ddfile).split('/')[-2]
+
+    # Read the temporary CSV file
+    try:
+       dd = pandas.read_csv(ddfile, sep='\t', header=None, names=['SubjectID', 'FuturePresent', 'Reward', 'HypReal', 'Exp1', 'Exp2', 'Amount', 'Days', 'DelDisc', 'Version', 'Date'])
+    except Exception as err_msg:
+        raise ConversionError(subject_label, 'Error: could not load file  %s' % ddfile , err_msg = str(err_msg))
+    #
+    # Check correctness of file format
+    #
+    dd = dd.dropna(axis=0, how='all')
+    if len( dd ) == 0:
+        raise ConversionError(subject_label, 'Error: file %s is empty or of the wrong format' % ddfile)
+
+    # Check if this file has the right number of rows.
+    dd = dd[ dd['FuturePresent'] == 'future' ]
+    dd = dd[ dd['Reward'] == 'money' ]
+    dd = dd[ dd['HypReal'] == 'hyp' ]
+    dd = dd[ dd['Exp1'] == 'gain' ]
+
+    # Anything still left? If not, this file has nothing for us.
+    if len( dd ) == 0:
+        raise ConversionError(subject_label, 'Error: no suitable data in file %s' % ddfile)
+
+    # Make sure all rows have the same "Amount", and it's either 100 or 1000
+    amount = dd['Amount'][0]
+    if not amount in [100,1000]:
+        raise ConversionError(subject_label, 'Error: amount %f is neither 100 nor 1000 in %s' % (amount, ddfile))
+
+    dd = dd[ dd['Amount'] == amount ]
+
+    #
+    # Prepare for import into redcap
+    #
+
+    # Now drop the columns we know we don't want anymore
+    dd = dd.drop(['FuturePresent', 'Reward', 'HypReal', 'Exp1', 'Exp2'], axis=1)
+
+    # Convert days to integer to avoid comparing floats
+    dd['Days'] = dd['Days'].map( int )
+
+
+    # Make proper subject ID
+    entered_id = dd['SubjectID'][0].upper()
+
+    # First, see if prefix is valid N-CANDA ID
+    match_id = re.search(r'^\s*([A-F]-[0-9]{5}-[MFT]-[0-9]).*', entered_id)
+    if match_id:
+        subject_id = match_id.group(1)
+    else:
+        # If that didn't work, truncate off "-1000" or "-100" suffix
+        match_id = re.search(r'^\s*(.*)-1000?$', entered_id)
+        if match_id:
+            subject_id = match_id.group(1)
+        else:
+            # Still no luck, just use whatever the RAs entered
+            subject_id = entered_id
+
+    # Bring "Date" into proper format
+    match_date = re.search(r'^([0-9]*)/([0-9]*)/(20[0-9]{2})$', dd['Date'][0])
+    if match_date:
+        date = '%s-%02d-%02d' % (match_date.group(3), int(match_date.group(1)), int(match_date.group(2)))
+    else:
+        raise ConversionError(subject_label, 'ERROR: %s\nCannot extract date from "%s"' % ( ddfile, dd['Date'][0] ))
+
+    # Create unique record ID
+    record_id = '%s-%s' % (subject_id, date)
+
+    # Create output table
+    prefix = 'dd%s' %  amount
+    data = {'record_id': record_id,
+            'visit_information_complete' : 1,
+            ('delayed_discounting_%s_complete' % amount) : 1 }
+
+    for ( days, field ) in [ (1, '1d'), (7, '7d'), (30, '1mo'), (182, '6mo') ]:
+        selection = dd[ dd['Days'] == days ]
+        if len( selection ) > 0:
+            data[ '%s_logk_%s' % (prefix,field) ] = selection['DelDisc'].tolist()[0]
+        else:
+            data[ '%s_logk_%s' % (prefix,field) ] = ''
+
+    out_df = pandas.DataFrame(data=data, index=[0])
+
+    # Determine directory name - create if it doesn't exist
+    if not os.path.exists(outdir):
+        os.makedirs(outdir, exist_ok=True)
+
+    # Determine file name, only proceed if file does not exist already
+    written_files = []
+    filename = os.path.join(outdir, '%s-%s.csv' % (record_id, amount))
+    if not os.path.exists(filename) or overwrite:
+        out_df.to_csv(filename, index=False)
+        written_files.append(filename)
+
+    return written_files
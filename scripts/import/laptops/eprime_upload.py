@@ -0,0 +1,68 @@
+##
+##  See COPYING file distributed along with the ncanda-data-integration package
+##  for the copyright and license terms
+##
+
+"""
+Upload an e-Prime Stroop log file to a file upload field in REDCap (used by
+eprime2redcap and harvester)
+"""
+
+import os
+import re
+import hashlib
+
+import redcap
+
+from convert_util import ConversionError
+
+
+def upload_eprime_file(project, infile, tofield, record=None, event=None):
+    """
+    Upload infile to field tofield of the record the log file belongs to (or
+    of the given record). Raises ConversionError if the upload fails.
+    """
+    file = open( infile, 'rb').read().decode('utf-16').split("\r\n")
+        
+    date_of_test = None
+    subject = None
+    session = None
+
+    # Read ePrime log file and parse out subject, session, and date of test.
+    for s in file:
+        if 'SessionDate:' in s:
+            date_of_test = '%s-%s-%s' % (s[19:23], s[13:15], s[16:18])
+        
+        match = re.match( 'Subject:[^0-9]*([0-9]{1,5})', s )
+        if match:
+            subject = ("0000%s" % match.group(1))[-4:]
+        match = re.match( 'Session:[^0-9]*([0-9]{1,5})', s )
+        if match:
+            session = ("0000%s" % match.group(1))[-4:]
+
+    if not subject or not session or not date_of_test:
+        raise ConversionError(hashlib.sha1(('harvester' + infile).encode()).hexdigest()[0:6] , "ERROR: no subject, session ID, or test date in Stroop file %s" % infile)
+
+    # Reconstruct actual N-CANDA Subject ID
+    digit_to_site = { '1': 'A', '2': 'B', '3': 'C', '4': 'D', '5': 'E', '6': 'F', '7': 'G', '8': 'H', '9': 'I', '0': 'J' }
+    digit_to_sex = { '1': 'M', '2': 'F', '3': 'X', '4': 'X', '5': 'X', '6': 'X', '7': 'X', '8': 'X', '9': 'T', '0': 'X' }
+
+    subject_id = '%s-%s%s-%s-%s' % ( digit_to_site[subject[0]], subject[1:4], session[0:2], digit_to_sex[session[2]], session[3] )
+
+    if record:
+        record_id = record
+    else:
+        record_id = '%s-%s' % ( subject_id, date_of_test )
+
+    # Upload given file to REDCap
+    file = open( infile, 'rb')
+    try:
+        response = project.import_file( record=record_id, event=event, field=tofield, fname=os.path.basename(infile), fobj=file )
+    except redcap.RedcapError:
+        # Your import didn't work
+        raise ConversionError(record_id, "ERROR: file upload did not work for file {} with record id {}".format(infile,record_id))
+
+    finally:
+        file.close()
+
+    return response
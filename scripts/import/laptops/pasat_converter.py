@@ -0,0 +1,103 @@
+##
+##  See COPYING file distributed along with the ncanda-data-integration package
+##  for the copyright and license terms
+##
+
+"""
+Convert a PASAT results database to CSV files (used by pasat2csv and harvester)
+"""
+
+from builtins import str
+import os
+import re
+import shutil
+import hashlib
+import tempfile
+import pandas
+from sibispy import utils as sutils
+
+from convert_util import ConversionError
+
+
+def convert_pasat(mdbfile, outdir, overwrite=False):
+    """
+    Convert mdbfile into one CSV file per subject in outdir (only new files
+    are created unless overwrite is set). Returns the list of CSV files
+    written; raises ConversionError if the database cannot be exported.
+    """
+    # Make a temporary directory
+    temp_dir_path = tempfile.mkdtemp()
+    try:
+        return _convert_pasat(mdbfile, outdir, overwrite, temp_dir_path)
+    finally:
+        # Clean up - remove temp directory
+        shutil.rmtree( temp_dir_path )
+
+
+def _convert_pasat(mdbfile, outdir, overwrite, temp_dir_path):
+    # Create a temporary CSV file by dumping MDB contents using "mdb-export" (via MDB Tools)
+    temp_csv = "%s/pasat.csv" % (temp_dir_path)
+    (ecode,cout,cerr) = sutils.mdb_export("%s MainStressor_bb > %s" % (mdbfile, temp_csv))
+    if ecode :
+       raise ConversionError(hashlib.sha1(str(cerr).encode()).hexdigest()[0:6], "mdb-export failed!", error_msg=str(cerr))
+
+    # Read the temporary CSV file
+    pasat_csv = pandas.read_csv( temp_csv ).sort_values(by=['ID'], ascending=False)
+
+    # Drop the columns we know we don't want
+    pasat = pasat_csv.drop( [ 'ID', 'SessNUm', 'Group', 'Gender', 'ExpName' ], axis=1 )
+
+    # Prefix all column names with 'pasat_'
+    columns = list()
+    for label in pasat.columns:
+        if label == 'SubjNum':
+            columns.append( 'pasat_subject_id' )
+        else:
+            columns.append("pasat_" + label.lower())
+    pasat.columns = columns
+
+    # Make all IDs uppercase, just in case
+    pasat['pasat_subject_id'] = pasat['pasat_subject_id'].map( lambda s:  str( s ).upper() if str( s ) != 'nan' else 'NOID' )
+
+    # Insert a column for unique record ID (to be filled later)
+    pasat.insert(0, 'record_id', '' )
+
+    # Set "completeness" to "unverified" (also for "visit information")
+    pasat['paced_auditory_serial_addition_test_pasat_complete'] = 1
+    pasat['visit_information_complete'] = 1
+
+    # Determine output directory name - create if it doesn't exist
+    if not os.path.exists( outdir ):
+        os.makedirs( outdir, exist_ok=True )
+
+    # Fix up and export every row (i.e., every subject)
+    written_files = []
+    for row_index, row in pasat.iterrows():
+        # First, catch subject IDs with missing hyphens and fix.
+        match_id = re.search( '^([A-F])([0-9]{5})([MF])([0-9])$', row['pasat_subject_id'] )
+        if match_id:
+            row['pasat_subject_id'] = "%s-%s-%s-%s" % ( match_id.group(1), match_id.group(2), match_id.group(3), match_id.group(4) )
+
+        # Second, extract date and bring into YYYYMMDD format
+        match_date = re.search( '^([0-9]{2})/([0-9]{2})/([0-9]{2}) .*$', row['pasat_date'] )
+        if match_date:
+            row['pasat_date'] = '20%s-%s-%s' % (match_date.group(3),match_date.group(1),match_date.group(2))
+
+        # Third, extract time
+        match_time = re.search( '.* ([0-9]{2}):([0-9]{2}):([0-9]{2})$', row['pasat_time'] )
+        if match_time:
+            row['pasat_time'] = '%s:%s' % (match_time.group(1),match_time.group(2))
+
+        # Compute and set unique record ID
+        row['record_id'] = '%s-%s' % (row['pasat_subject_id'],row['pasat_date'])
+
+        # Drop the separate subject_id and date columns
+        row = row.drop( ['pasat_subject_id', 'pasat_date' ] )
+
+        # Determine file name, only proceed if file does not exist already
+        filename = os.path.join( outdir, '%s.csv' % row['record_id'])
+        if not os.path.exists( filename ) or overwrite:
+            pandas.DataFrame( row ).transpose().to_csv( filename, index=False )
+            written_files.append(filename)
+
+    return written_files
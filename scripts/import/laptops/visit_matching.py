@@ -0,0 +1,99 @@
+##
+##  See COPYING file distributed along with the ncanda-data-integration package
+##  for the copyright and license terms
+##
+
+"""
+Matching of imported (laptop) records to the visits of the Data Entry project
+
+update_visit_data used to scan the whole import table for every visit to find
+the records of the subject, and the visit log of the subject to find the next
+visit. Both are now grouped by subject once per form; the records within a
+visit window are looked up in the date-sorted records of the subject.
+"""
+
+import bisect
+
+
+class ImportedRecordIndex(object):
+    """
+    Imported records of one form, grouped by subject and sorted by date.
+
+    Lookups return the records in the order of the import table, without the
+    subject id column - i.e., what filtering the table used to return.
+    """
+    def __init__(self, imported_records, subject_label, date_label):
+        self.date_label = date_label
+        records = imported_records.drop([subject_label], axis=1)
+        self._empty = records.iloc[0:0]
+
+        self._records = dict()
+        self._dates = dict()
+        self._positions = dict()
+        subject_ids = imported_records[subject_label].tolist()
+        for subject_id, positions in _group_positions(subject_ids).items():
+            subject_records = records.iloc[positions]
+            dates = subject_records[date_label].tolist()
+            # Stable sort - records with the same date keep the table order
+            order = sorted(range(len(dates)), key=dates.__getitem__)
+            self._records[subject_id] = subject_records
+            self._dates[subject_id] = [dates[pos] for pos in order]
+            self._positions[subject_id] = order
+
+    def get_subject_records(self, subject_id):
+        return self._records.get(subject_id, self._empty)
+
+    def get_records_in_window(self, subject_id, date_on_or_after, date_before):
+        """ Records of the subject dated within [date_on_or_after, date_before) """
+        dates = self._dates.get(subject_id)
+        if not dates:
+            return self._empty
+
+        lo = bisect.bisect_left(dates, date_on_or_after)
+        hi = bisect.bisect_left(dates, date_before)
+        return self._select(subject_id, lo, max(lo, hi))
+
+    def get_records_on_date(self, subject_id, date):
+        dates = self._dates.get(subject_id)
+        if not dates:
+            return self._empty
+
+        lo = bisect.bisect_left(dates, date)
+        hi = bisect.bisect_right(dates, date)
+        return self._select(subject_id, lo, hi)
+
+    def _select(self, subject_id, lo, hi):
+        return self._records[subject_id].iloc[sorted(self._positions[subject_id][lo:hi])]
+
+
+class NextVisitIndex(object):
+    """
+    Sorted visit dates of each subject, restricted to the events that have a
+    given form (the Recovery baseline is skipped, it is usually the MR day of
+    a standard visit).
+    """
+    def __init__(self, entry_data, events_this_form, skip_event=None):
+        visit_dates = entry_data["visit_date"].dropna()
+        self._dates = dict()
+        for (subject_id, event), date in zip(visit_dates.index.tolist(), visit_dates.tolist()):
+            if event == skip_event or event not in events_this_form:
+                continue
+            self._dates.setdefault(subject_id, []).append(date)
+
+        for dates in self._dates.values():
+            dates.sort()
+
+    def get_next_visit_date(self, subject_id, after_visit_date):
+        """ Earliest visit date of the subject after after_visit_date (or None) """
+        dates = self._dates.get(subject_id, [])
+        pos = bisect.bisect_right(dates, after_visit_date)
+        if pos < len(dates):
+            return dates[pos]
+        return None
+
+
+def _group_positions(values):
+    positions = dict()
+    for (pos, value) in enumerate(values):
+        positions.setdefault(value, []).append(pos)
+    return positions
@@ -4,6 +4,7 @@ from __future__ import print_function
 import collections 
 import json
 import os
+import signal
 import subprocess
 import shutil
 import re
@@ -18,20 +19,65 @@ def log(uid, message, **kwargs):
     print(jlog)
 
 
-def call_shell_program(cmd):
+# Raises subprocess.TimeoutExpired (after killing the program) if it runs
+# longer than timeout seconds. The program then runs in a process group of its
+# own, so that the Windows program that wine started is killed with it.
+def call_shell_program(cmd, env=None, timeout=None):
     try : 
-        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        (out, err) = process.communicate()
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env,
+                                   start_new_session=(timeout is not None))
     except Exception as emsg:
         return (1,"" ,emsg)
 
+    try :
+        (out, err) = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        try :
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            process.kill()
+        process.communicate()
+        raise
+
     return (process.returncode, out, err)
 
-def sas(sas_script) :
+# sas_script is either the name of a script on drive S: or a full Windows path
+def sas(sas_script, display=None, timeout=None) :
     sas_path = os.path.join( os.path.expanduser("~"), '.wine', 'drive_c', 'Program Files', 'SAS', 'SAS 9.1', 'sas.exe' )
-    # points to ncanda-data-integration/ssaga/sas
-    sas_script_path = 'S:\\%s' % sas_script
-    return call_shell_program(['wine',sas_path,'-SYSIN', sas_script_path,'-NOSPLASH','-NOLOGO','-NOTERMINAL'])
+    if re.match(r'^[A-Za-z]:', sas_script):
+        sas_script_path = sas_script
+    else:
+        # points to ncanda-data-integration/ssaga/sas
+        sas_script_path = 'S:\\%s' % sas_script
+
+    env = None
+    if display:
+        env = dict(os.environ, DISPLAY=display)
+
+    return call_shell_program(['wine',sas_path,'-SYSIN', sas_script_path,'-NOSPLASH','-NOLOGO','-NOTERMINAL'], env=env, timeout=timeout)
+
+# Directory that drive letter (e.g., 'S') is mapped to in Wine
+def drive_path(drive) :
+    return os.path.realpath(os.path.join( os.path.expanduser("~"), '.wine', 'dosdevices', '%s:' % drive.lower() ))
+
+# Windows path of a file on the Unix file system (drive Z: is mapped to /)
+def windows_path(path) :
+    return 'Z:' + os.path.abspath(path).replace('/', '\\')
+
+# Start a virtual X server on a free display; returns process and display name
+def start_xvfb() :
+    devnull = open( '/dev/null', 'w' )
+    try :
+        process = subprocess.Popen(['Xvfb', '-displayfd', '1'], stdout=subprocess.PIPE, stderr=devnull)
+    finally :
+        devnull.close()
+
+    display = process.stdout.readline().decode().strip()
+    if not display :
+        process.terminate()
+        raise RuntimeError('Xvfb did not start')
+
+    return (process, ':' + display)
 
 def manipula(exedir,bdb_file) :
     manipulaPath = os.path.join(os.path.dirname(os.path.realpath(__file__)),'manipula')
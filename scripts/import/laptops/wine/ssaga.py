@@ -5,6 +5,10 @@
 ##  for the copyright and license terms
 ##
 
+import csv
+import operator
+import pandas
+
 #
 # List of fields to copy straight into REDCap
 #
@@ -4007,3 +4011,42 @@ field_offsets = {
 def get_field( record, name ):
     (iFrom,iTo) = field_offsets[name]
     return record[iFrom:iTo]
+
+#
+# Read all records of an ASC file, one record per line. Bytes are decoded as
+# Latin-1 so that field offsets stay byte offsets.
+#
+def read_records( ascfile_name ):
+    with open( ascfile_name, 'r', encoding='latin-1' ) as ascfile:
+        return ascfile.readlines()
+
+#
+# Decode the named fields of many ASC records at once
+#
+# All fields of a record are cut out by a single call of a precomputed slice
+# table, instead of looking up the offsets of each field for each record.
+#
+class FieldDecoder(object):
+    def __init__( self, names ):
+        # Drop repeated names, keeping the first occurrence
+        self.names = list( dict.fromkeys( names ) )
+        self.get_fields = operator.itemgetter( *[ slice( *field_offsets[name] ) for name in self.names ] )
+
+    # Returns a DataFrame with one row per record and one column per field
+    def decode( self, records ):
+        if len( self.names ) == 1:
+            rows = [ ( self.get_fields( record ).strip(), ) for record in records ]
+        else:
+            rows = [ tuple( map( str.strip, self.get_fields( record ) ) ) for record in records ]
+
+        return pandas.DataFrame( dict( zip( self.names, zip( *rows ) ) ), columns=self.names )
+
+#
+# Write a single record to a CSV file, as DataFrame.to_csv would (writing a
+# one-row DataFrame with hundreds of columns through pandas is much slower)
+#
+def write_csv_record( filename, header, row ):
+    with open( filename, 'w', newline='', encoding='utf-8' ) as output_file:
+        writer = csv.writer( output_file, lineterminator='\n' )
+        writer.writerow( header )
+        writer.writerow( row )
@@ -0,0 +1,212 @@
+##
+##  See COPYING file distributed along with the ncanda-data-integration package
+##  for the copyright and license terms
+##
+
+#
+# Score SSAGA records using the SAS scripts (used by blaise2csv)
+#
+# The SAS scripts read and write their data in Z:\tmp\ssaga. Each scoring job
+# runs on a copy of the scripts that points to a work directory of its own, so
+# that jobs can run side by side (also from different blaise2csv runs) and a
+# failed job leaves nothing behind for the next one.
+#
+# This module makes the following assumptions about the operating environment:
+#
+# 1. SAS is installed in ~/.wine/drive_c/Program\ Files/SAS/SAS\ 9.1/
+#
+# 2. Drive "S:" is mapped to the directory with the SAS scoring scripts
+#
+
+from __future__ import print_function
+from builtins import str
+import os
+import re
+import time
+import queue
+import shutil
+import hashlib
+import tempfile
+import subprocess
+import concurrent.futures
+
+import pandas
+
+import ssaga
+import sibis_wine
+
+sas_scripts = ['crtpreNSSAGA_v3.sas', 'crtNSSAGA.sas', 'crtalldx.sas', 'toCSV.sas']
+
+#
+# Score one batch of ASC files in a work directory of its own. Returns the
+# scores as a DataFrame with one row per interview, all values as text.
+#
+def score_batch( filenames_asc, display=None, timeout=None, sas_dir=None ):
+    if not sas_dir:
+        sas_dir = sibis_wine.drive_path( 'S' )
+
+    workdir = tempfile.mkdtemp( prefix='ssaga-' )
+    try:
+        with open( os.path.join( workdir, 'NSSAGA_v3_ASC' ), 'w', encoding='latin-1' ) as ascfile:
+            for filename_asc in filenames_asc:
+                for record in ssaga.read_records( filename_asc ):
+                    ascfile.write( record.rstrip( '\n' ) + '\n' )
+
+        # Point the scripts to the work directory
+        workdir_windows = sibis_wine.windows_path( workdir )
+        for sas_script in sas_scripts:
+            with open( os.path.join( sas_dir, sas_script ), 'r', encoding='latin-1' ) as infile:
+                script = infile.read()
+            script = re.sub( r'[Zz]:\\tmp\\ssaga', lambda match: workdir_windows, script )
+            with open( os.path.join( workdir, sas_script ), 'w', encoding='latin-1' ) as outfile:
+                outfile.write( script )
+
+        if timeout:
+            deadline = time.time() + timeout
+        for sas_script in sas_scripts:
+            if timeout:
+                remaining = max( deadline - time.time(), 1 )
+            else:
+                remaining = None
+            (returncode, out, err) = sibis_wine.sas( sibis_wine.windows_path( os.path.join( workdir, sas_script ) ), display=display, timeout=remaining )
+            if returncode:
+                if isinstance( err, bytes ):
+                    err = err.decode( 'latin-1' )
+                sibis_wine.log( hashlib.sha1( "blaise2csv {} {}".format( sas_script, filenames_asc ).encode() ).hexdigest()[0:6], 'ERROR: SAS script failed',
+                                sas_script=sas_script,
+                                returncode=str( returncode ),
+                                err=str( err ),
+                                filename_asc=str( filenames_asc ) )
+
+        return pandas.read_csv( os.path.join( workdir, 'dx_nssaga.csv' ), dtype=str, keep_default_na=False )
+    finally:
+        shutil.rmtree( workdir, ignore_errors=True )
+
+#
+# Split ASC files into batches. SAS identifies interviews only by IND_ID, so
+# a batch never holds two interviews of the same subject.
+#
+def make_batches( filenames_asc, batch_size ):
+    batches = []
+    for filename_asc in filenames_asc:
+        ind_id = get_ind_id( filename_asc )
+        for batch in batches:
+            if len( batch ) < batch_size and ind_id not in [ batch_id for (batch_id,batch_filename) in batch ]:
+                batch.append( (ind_id,filename_asc) )
+                break
+        else:
+            batches.append( [ (ind_id,filename_asc) ] )
+
+    return [ [ filename_asc for (ind_id,filename_asc) in batch ] for batch in batches ]
+
+def get_ind_id( filename_asc ):
+    records = ssaga.read_records( filename_asc )
+    if not records:
+        return None
+    return ssaga.get_field( records[0], 'IND_ID' ).strip()
+
+#
+# Runs scoring jobs on several Wine/SAS workers, each with its own virtual X
+# server (unless use_xvfb is False, when all use the current display)
+#
+class ScoringRunner(object):
+    def __init__( self, workers=1, batch_size=1, timeout=None, use_xvfb=True, verbose=False ):
+        self.workers = max( workers, 1 )
+        self.batch_size = max( batch_size, 1 )
+        self.timeout = timeout
+        self.use_xvfb = use_xvfb
+        self.verbose = verbose
+
+    #
+    # Score the given ASC files; returns a dict with the scores of each file
+    # as a one-row DataFrame. Files that could not be scored are left out.
+    #
+    def score( self, filenames_asc ):
+        if not filenames_asc:
+            return dict()
+
+        xvfb_processes = []
+        displays = queue.Queue()
+        try:
+            for worker in range( min( self.workers, len( filenames_asc ) ) ):
+                if self.use_xvfb:
+                    (process,display) = sibis_wine.start_xvfb()
+                    xvfb_processes.append( process )
+                    displays.put( display )
+                else:
+                    displays.put( None )
+
+            def run_batch( batch ):
+                display = displays.get()
+                try:
+                    return self._score_batch( batch, display )
+                finally:
+                    displays.put( display )
+
+            scores = dict()
+            batches = make_batches( filenames_asc, self.batch_size )
+            with concurrent.futures.ThreadPoolExecutor( max_workers=displays.qsize() ) as executor:
+                for batch_scores in executor.map( run_batch, batches ):
+                    scores.update( batch_scores )
+
+            return scores
+        finally:
+            for process in xvfb_processes:
+                process.terminate()
+
+    def _score_batch( self, batch, display, timeout=None ):
+        if timeout is None:
+            timeout = self.timeout
+        if self.verbose:
+            print( "Scoring", len( batch ), "SSAGA record(s) on display", display )
+
+        retry_timeout = timeout
+        try:
+            data = score_batch( batch, display=display, timeout=timeout )
+        except subprocess.TimeoutExpired:
+            sibis_wine.log( hashlib.sha1( "blaise2csv timeout {}".format( batch ).encode() ).hexdigest()[0:6], 'ERROR: SAS scoring did not finish in time',
+                            timeout=str( timeout ),
+                            filename_asc=str( batch ) )
+            data = None
+            # The records of the batch share its time - otherwise a hung batch
+            # would block the run for len( batch ) more timeouts
+            if timeout:
+                retry_timeout = max( timeout / len( batch ), 1 )
+        except Exception:
+            data = None
+
+        if data is None or not len( data ):
+            if len( batch ) > 1:
+                # Do not let one bad record fail the others
+                scores = dict()
+                for filename_asc in batch:
+                    scores.update( self._score_batch( [ filename_asc ], display, retry_timeout ) )
+                return scores
+
+            sibis_wine.log( hashlib.sha1( "blaise2csv {}".format( batch[0] ).encode() ).hexdigest()[0:6], 'ERROR: SAS script cannot be run for this file',
+                            sas_scripts=str( sas_scripts ),
+                            filename_asc=str( batch[0] ) )
+            return dict()
+
+        if len( batch ) == 1:
+            return { batch[0] : data }
+
+        # Split the batch output by IND_ID
+        id_columns = [ column for column in data.columns if column.lower() == 'ind_id' ]
+        if not id_columns:
+            scores = dict()
+            for filename_asc in batch:
+                scores.update( self._score_batch( [ filename_asc ], display, timeout ) )
+            return scores
+
+        ind_ids = data[id_columns[0]].str.strip()
+        scores = dict()
+        for filename_asc in batch:
+            selection = ( ind_ids == get_ind_id( filename_asc ) )
+            if selection.sum() == 1:
+                scores[filename_asc] = data[selection].reset_index( drop=True )
+            else:
+                sibis_wine.log( hashlib.sha1( "blaise2csv {}".format( filename_asc ).encode() ).hexdigest()[0:6], 'ERROR: SAS scoring returned no result for this file',
+                                filename_asc=str( filename_asc ) )
+
+        return scores
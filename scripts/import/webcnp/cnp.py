@@ -6,6 +6,7 @@
 ##
 
 import os.path
+import numpy as np
 import pandas
 
 # Dictionary mapping instruments to their internal REDCap names (for "*_complete" fields)
@@ -58,6 +59,66 @@ mean_sdev_by_field_dict = { 'cpf_ifac_tot'          : 'cpf-a_cr',
                             'spcptnl_scpt_tp'       : 'spcptnl_t_tp',
                             'spcptnl_scpt_tprt'     : 'spcptnl_t_tprt' }
 
+def get_zscores(cnp_data, age_in_years):
+    """
+    Given imported CNP records (values as strings, empty if missing) and the
+    age of each subject at test, compute the age-normalized z-scores of the
+    fields in mean_sdev_by_field_dict. Z-scores are only defined between 8
+    and 21 years; NaN where undefined or the value is missing.
+    """
+    fields = list(mean_sdev_by_field_dict.keys())
+    labels = [mean_sdev_by_field_dict[field] for field in fields]
+
+    age_in_years = pandas.Series(age_in_years, index=cnp_data.index).astype(float)
+    in_range = ((age_in_years >= 8) & (age_in_years < 22)).values
+    # Look up the norms for the 2-year age group of each record
+    age_group = (age_in_years.where(in_range, 8) / 2).astype(int) * 2
+    norms = mean_sdev_byage_table.reindex(age_group.values)
+    age_mean = norms[['%s_mean' % label for label in labels]].values
+    age_sdev = norms[['%s_sd' % label for label in labels]].values
+
+    values = cnp_data[fields].astype(object)
+    values = values.where(values != '').astype(float).values
+    zscores = (values - age_mean) / age_sdev
+    zscores[~in_range, :] = np.nan
+
+    return pandas.DataFrame(zscores, index=cnp_data.index, columns=fields)
+
+def match_visits(visits, imported_records, max_days_after_visit):
+    """
+    Interval join of visits with imported CNP records. visits has columns
+    'study_id' and 'visit_date'; imported_records has 'test_sessions_subid'
+    and 'test_sessions_dotest' and is indexed by record ID. Every visit is
+    paired with all records of the subject tested between the visit date and
+    max_days_after_visit days later. Returns one row per pair with the
+    position of the visit ('visit'), the record ID ('record_id') and the
+    position of the record in imported_records ('order'), sorted by visit and
+    then record position.
+    """
+    if not len(visits) or not len(imported_records):
+        # nothing to compare the dates of (and the empty columns are not text)
+        return pandas.DataFrame({'visit': np.array([], dtype=int),
+                                 'record_id': np.array([], dtype=object),
+                                 'order': np.array([], dtype=int)})
+
+    visit_dates = pandas.DataFrame({'visit': np.arange(len(visits)),
+                                    'study_id': list(visits['study_id']),
+                                    'visit_date': list(visits['visit_date'])})
+    visit_dates['visit_date_end'] = (pandas.to_datetime(visit_dates['visit_date'], format='%Y-%m-%d', errors='coerce')
+                                     + pandas.Timedelta(days=max_days_after_visit)).dt.strftime('%Y-%m-%d')
+
+    records = pandas.DataFrame({'study_id': list(imported_records['test_sessions_subid']),
+                                'test_sessions_dotest': list(imported_records['test_sessions_dotest']),
+                                'record_id': list(imported_records.index),
+                                'order': np.arange(len(imported_records))})
+
+    pairs = visit_dates.merge(records, on='study_id')
+    in_window = ((pairs['test_sessions_dotest'] >= pairs['visit_date'])
+                 & (pairs['test_sessions_dotest'] <= pairs['visit_date_end'].fillna('')))
+    pairs = pairs[in_window].sort_values(['visit', 'order'], kind='stable')
+
+    return pairs[['visit', 'record_id', 'order']].reset_index(drop=True)
+
 def merge_columns(df, col_dict):
     """
     Given a dataframe and a dictionary that maps between two columns that represent
@@ -0,0 +1,104 @@
+"""
+Concurrent, chunked export of REDCap records (shared by load_utils and qa_utils)
+
+Large exports are split into chunks of records that are exported by a small
+pool of workers. If a chunk fails, only that chunk is exported again, split
+into chunks of the next smaller size. The chunks are concatenated once at the
+end, in the order of the record list.
+"""
+
+import sys
+import time
+import concurrent.futures
+import pandas as pd
+import redcap as rc
+from pandas.errors import EmptyDataError
+
+
+def export_record_ids(project):
+    """ List of all record ids in the project """
+    record_list = project.export_records(fields=[project.def_field])
+    return [r[project.def_field] for r in record_list]
+
+
+def _chunks(l, n):
+    """Yield successive n-sized chunks from list l"""
+    for i in range(0, len(l), n):
+        yield l[i:i+n]
+
+
+def export_records_in_chunks(project, records=None, chunk_sizes=(100,),
+                             max_workers=4, verbose=False, **export_kwargs):
+    """
+    Export the given records (default: all records) with
+    project.export_records(records=chunk, format_type='df', **export_kwargs).
+
+    chunk_sizes lists the chunk size of the first attempt followed by the
+    sizes a failed chunk is split into. Raises ValueError if a chunk of the
+    smallest size fails. Returns None if nothing was exported.
+    """
+    if records is None:
+        records = export_record_ids(project)
+    chunk_sizes = list(chunk_sizes)
+
+    start_time = time.time()
+    stats = {'records': 0, 'requests': 0, 'retries': 0}
+
+    def export_chunk(record_chunk):
+        try:
+            return project.export_records(records=record_chunk,
+                                          format_type='df',
+                                          **export_kwargs)
+        except EmptyDataError:
+            return None
+
+    # results: position of the chunk's first record -> data frame
+    results = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {}
+
+        def submit(first_record, record_chunk, size_idx):
+            stats['requests'] += 1
+            future = executor.submit(export_chunk, record_chunk)
+            pending[future] = (first_record, record_chunk, size_idx)
+
+        for pos in range(0, len(records), chunk_sizes[0]):
+            submit(pos, records[pos:pos + chunk_sizes[0]], 0)
+
+        while pending:
+            done, _ = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                (first_record, record_chunk, size_idx) = pending.pop(future)
+                try:
+                    results[first_record] = future.result()
+                except rc.RedcapError:
+                    if size_idx + 1 >= len(chunk_sizes):
+                        for other in pending:
+                            other.cancel()
+                        msg = ("Chunked export failed for chunk_size={:d}"
+                               .format(chunk_sizes[size_idx]))
+                        raise ValueError(msg)
+
+                    # Retry only this chunk, in smaller pieces
+                    stats['retries'] += 1
+                    size = chunk_sizes[size_idx + 1]
+                    for (idx, sub_chunk) in enumerate(_chunks(record_chunk, size)):
+                        submit(first_record + idx * size, sub_chunk, size_idx + 1)
+                    continue
+
+                stats['records'] += len(record_chunk)
+                if verbose:
+                    print("Exported {:d}/{:d} records ({:d} requests, {:d} "
+                          "retried chunks, {:.1f}s)".format(
+                              stats['records'], len(records),
+                              stats['requests'], stats['retries'],
+                              time.time() - start_time),
+                          file=sys.stderr)
+
+    frames = [results[pos] for pos in sorted(results)
+              if results[pos] is not None]
+    if not frames:
+        return None
+
+    return pd.concat(frames, axis=0)
@@ -1,38 +1,26 @@
 import pandas as pd
 import redcap as rc
 from pandas.errors import EmptyDataError
+from chunked_export import export_records_in_chunks
 
 
 # Taken from http://pycap.readthedocs.io/en/latest/deep.html#dealing-with-large-exports
 # and adapted to scope down to forms
-def chunked_export(project, form, chunk_size=100, verbose=True, export_data_access_groups=False, **kwargs):
-    def chunks(l, n):
-        """Yield successive n-sized chunks from list l"""
-        for i in range(0, len(l), n):
-            yield l[i:i+n]
-    record_list = project.export_records(fields=[project.def_field])
-    records = [r[project.def_field] for r in record_list]
-    try:
-        response = None
-        record_count = 0
-        for record_chunk in chunks(records, chunk_size):
-            record_count = record_count + chunk_size
-            chunked_response = project.export_records(
-                records=record_chunk,
-                fields=[project.def_field],
-                forms=[form],
-                format_type='df',
-                export_data_access_groups=export_data_access_groups,
-                df_kwargs={'low_memory': False}.update(kwargs))
-            if response is not None:
-                response = pd.concat([response, chunked_response], axis=0)
-            else:
-                response = chunked_response
-    except rc.RedcapError:
-        msg = "Chunked export failed for chunk_size={:d}".format(chunk_size)
-        raise ValueError(msg)
-    else:
-        return response
+#
+# Chunks that fail are exported again in chunks of the sizes in
+# retry_chunk_sizes (see chunked_export.export_records_in_chunks)
+def chunked_export(project, form, chunk_size=100, verbose=True, export_data_access_groups=False,
+                   retry_chunk_sizes=(), max_workers=4, **kwargs):
+    return export_records_in_chunks(
+        project,
+        chunk_sizes=[chunk_size] + list(retry_chunk_sizes),
+        max_workers=max_workers,
+        verbose=verbose,
+        fields=[project.def_field],
+        forms=[form],
+        export_data_access_groups=export_data_access_groups,
+        # without df_kwargs, PyCap indexes by record id (and event)
+        df_kwargs=kwargs or None)
 
 
 def load_all_forms(api, arm='1', export_data_access_groups=False):
@@ -43,7 +31,8 @@ def load_all_forms(api, arm='1', export_data_access_groups=False):
     for i, form in enumerate(forms):
         print(i, form_n, form)
         dfs.append(chunked_export(
-            api, form, export_data_access_groups=export_data_access_groups))
+            api, form, export_data_access_groups=export_data_access_groups,
+            retry_chunk_sizes=[10]))
     return pd.concat(dfs, axis=1)
 
 
@@ -60,38 +49,14 @@ def load_form(api, form_name, verbose=True, export_data_access_groups=False):
     if verbose:
         print(form_name)
     
+    # Chunks of 5000 records; a chunk that fails is exported again in
+    # chunks of 1000, then 100, then 10 records
     try:
         if verbose:
             print("Trying chunked export, 5000 records at a time")
-        return chunked_export(api, form_name, 5000,
-                              export_data_access_groups=export_data_access_groups)
-    except (ValueError, rc.RedcapError, EmptyDataError):
-        pass
-    
-    # 2. Chunked load with chunk size of 1000
-    try:
-        if verbose:
-            print("Trying chunked export, 1000 records at a time")
-        return chunked_export(api, form_name, 1000,
-                              export_data_access_groups=export_data_access_groups)
-    except (ValueError, rc.RedcapError, EmptyDataError):
-        pass
-    
-    # 2. Chunked load with default chunk size
-    try:
-        if verbose:
-            print("Trying chunked export, default chunk size (100)")
-        return chunked_export(api, form_name, 100,
-                              export_data_access_groups=export_data_access_groups)
-    except (ValueError, rc.RedcapError, EmptyDataError):
-        pass
-    
-    # 3. Chunked load with tiny chunk
-    try:
-        if verbose:
-            print("Trying chunked export with tiny chunks (10)")
-        return chunked_export(api, form_name, 10,
-                              export_data_access_groups=export_data_access_groups)
+        return chunked_export(api, form_name, 5000, verbose=verbose,
+                              export_data_access_groups=export_data_access_groups,
+                              retry_chunk_sizes=[1000, 100, 10])
     except (ValueError, rc.RedcapError, EmptyDataError):
         print("Giving up")
         return None
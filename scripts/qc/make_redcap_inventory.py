@@ -4,12 +4,13 @@ Given an API, load all the forms, count up their non-NA values, and mark their m
 """
 
 import argparse
+import numpy as np
 import pandas as pd
 import pdb
 import redcap as rc
 import sys
 from load_utils import load_form_with_primary_key
-from qa_utils import chunked_form_export, get_items_matching_regex
+from qa_utils import chunked_form_export, get_items_matching_regex, split_by_event
 import sibispy
 from sibispy import sibislogger as slog
 from typing import List
@@ -47,9 +48,17 @@ def make_redcap_inventory(api: rc.Project,
                           events: List = None,
                           post_to_github: bool = False,
                           include_dag: bool = False,
-                          verbose: bool = False) -> pd.DataFrame:
+                          verbose: bool = False,
+                          records: List = None,
+                          meta: pd.DataFrame = None) -> pd.DataFrame:
+    """
+    records (see chunked_export.export_record_ids) and meta (the exported metadata)
+    can be passed in if they are already available, e.g. when making
+    inventories for many forms.
+    """
     # Determine scope
-    meta = api.export_metadata(format_type='df')
+    if meta is None:
+        meta = api.export_metadata(format_type='df')
     all_forms = meta['form_name'].unique().tolist()
     if forms is not None:
         all_forms = [form for form in all_forms if form in forms]
@@ -58,30 +67,61 @@ def make_redcap_inventory(api: rc.Project,
     # form should be, too (very NCANDA-specific)
     data = {form: chunked_form_export(api, forms=[form], events=events,
                                       include_dag=include_dag,
-                                      fields=['visit_ignore'])
+                                      fields=['visit_ignore'],
+                                      records=records)
             for form in all_forms}
 
     final_dfs = []
     for form in all_forms:
-        try:
-            form_stats = data[form].apply(get_flag_and_meta, axis=1)
-        except ValueError:
-            continue
-        form_stats['form_name'] = form
-        form_stats['status'] = make_classification(form_stats)
-        final_dfs.append(form_stats)
+        form_stats = make_form_inventory(data[form], form)
+        if form_stats is not None:
+            final_dfs.append(form_stats)
 
     return pd.concat(final_dfs, sort=False)
 
 
-# Apply to DF to get all empty records
-def get_flag_and_meta(row: pd.Series, verbose: bool = True) -> pd.Series:
+def make_event_inventories(api: rc.Project,
+                           form: str,
+                           events: List,
+                           include_dag: bool = False,
+                           records: List = None) -> dict:
+    """
+    Inventory of a form for each of the given events, keyed by event.
+
+    The form is exported once for all events. Its column types are inferred
+    for each event separately, so every inventory is the same as
+    make_redcap_inventory makes for the event alone.
+    """
+    data = chunked_form_export(api, forms=[form], events=events,
+                               include_dag=include_dag,
+                               fields=['visit_ignore'],
+                               records=records, as_text=True)
+    if data is None:
+        return {}
+
+    inventories = {}
+    for event, event_data in split_by_event(data):
+        form_stats = make_form_inventory(event_data, form)
+        if form_stats is not None:
+            inventories[event] = form_stats
+
+    return inventories
+
+
+def make_form_inventory(data: pd.DataFrame, form: str) -> pd.DataFrame:
     try:
-        columns = row.columns.tolist()
-    except Exception as e:
-        # No columns in a Series
-        columns = row.index.tolist()
+        form_stats = get_form_flags_and_meta(data)
+    except ValueError:
+        return None
+    form_stats['form_name'] = form
+    form_stats['status'] = make_classification(form_stats)
+    return form_stats
 
+
+def classify_columns(columns: List) -> dict:
+    """
+    Sort the columns of a form into the meta columns used by the inventory
+    """
     cols_dag = get_items_matching_regex('redcap_data_access_group', columns)
     cols_complete = get_items_matching_regex(
         "_complete$|^np_reyo_qc___completed$", columns)
@@ -108,6 +148,30 @@ def get_flag_and_meta(row: pd.Series, verbose: bool = True) -> pd.Series:
     all_meta_cols = (cols_complete + cols_ignore + cols_missing + cols_dag
                      + cols_missing_explanation + cols_checklists)
 
+    return {'dag': cols_dag,
+            'complete': cols_complete,
+            'ignore': cols_ignore,
+            'missing': cols_missing,
+            'checklists_pure': cols_checklists_pure,
+            'meta': all_meta_cols}
+
+
+# Apply to DF to get all empty records
+def get_flag_and_meta(row: pd.Series, verbose: bool = True) -> pd.Series:
+    try:
+        columns = row.columns.tolist()
+    except Exception as e:
+        # No columns in a Series
+        columns = row.index.tolist()
+
+    cols = classify_columns(columns)
+    cols_dag = cols['dag']
+    cols_complete = cols['complete']
+    cols_ignore = cols['ignore']
+    cols_missing = cols['missing']
+    cols_checklists_pure = cols['checklists_pure']
+    all_meta_cols = cols['meta']
+
     result = {}
     if len(cols_dag) > 0:
         result.update({'dag': row['redcap_data_access_group']})
@@ -144,6 +208,100 @@ def get_flag_and_meta(row: pd.Series, verbose: bool = True) -> pd.Series:
     return pd.Series(result)
 
 
+def get_form_flags_and_meta(form: pd.DataFrame) -> pd.DataFrame:
+    """
+    Same result as form.apply(get_flag_and_meta, axis=1), but the columns are
+    classified once per form and the counts are computed for all rows at once.
+    """
+    if form.empty:
+        return form.apply(get_flag_and_meta, axis=1)
+
+    cols = classify_columns(form.columns.tolist())
+
+    # apply() hands each row over as a Series - if all columns are numeric,
+    # the row is upcast to a common type (e.g. int to float)
+    numeric_form = all(pd.api.types.is_numeric_dtype(dtype)
+                       for dtype in form.dtypes)
+    if numeric_form:
+        common_type = np.result_type(*form.dtypes)
+
+    def get_column(col):
+        if numeric_form:
+            return form[col].astype(common_type)
+        return form[col]
+
+    def get_max(cols_max):
+        values = pd.concat([get_column(col) for col in cols_max], axis=1)
+        result = values.max(axis=1, skipna=True)
+        if numeric_form:
+            return result, _get_kinds(result)
+
+        # A row's max is the value (and type) of the first column holding it
+        kinds = pd.concat([_get_kinds(values.iloc[:, idx])
+                           for idx in range(values.shape[1])], axis=1)
+        first = (values.fillna(-np.inf).values
+                 == result.fillna(-np.inf).values[:, None]).argmax(axis=1)
+        return result, pd.Series(kinds.values[np.arange(len(first)), first],
+                                 index=form.index)
+
+    result = {}
+    kinds = {}
+    if cols['dag']:
+        result['dag'] = get_column('redcap_data_access_group')
+        kinds['dag'] = _get_kinds(result['dag'])
+
+    non_nan_count = form.drop(columns=cols['meta']).notnull().sum(axis=1)
+    if cols['checklists_pure']:
+        non_nan_count = non_nan_count + (form[cols['checklists_pure']]
+                                         .isin([1, '1']).sum(axis=1))
+    result['non_nan_count'] = non_nan_count
+    kinds['non_nan_count'] = _get_kinds(non_nan_count)
+
+    if cols['ignore']:
+        result['exclude'], kinds['exclude'] = get_max(cols['ignore'])
+    if cols['missing']:
+        result['missing'], kinds['missing'] = get_max(cols['missing'])
+    if cols['complete']:
+        if 'np_reyo_qc___completed' in cols['complete']:
+            result['complete'], kinds['complete'] = get_max(cols['complete'])
+        else:
+            result['complete'] = get_column(cols['complete'][-1])
+            kinds['complete'] = _get_kinds(result['complete'])
+
+    # The Series returned for a row without text is upcast to float if any of
+    # its values is a float (or NaN); the columns are then inferred from the
+    # values of all rows
+    kinds = pd.DataFrame(kinds)
+    text_row = (kinds == 'O').any(axis=1)
+    float_row = (kinds == 'f').any(axis=1) & ~text_row
+    stats = pd.DataFrame(index=form.index)
+    for name, values in result.items():
+        if name == 'dag':
+            stats[name] = values.astype(object).infer_objects()
+        elif ((kinds[name] == 'f') | float_row).any():
+            stats[name] = values.astype(float)
+        else:
+            stats[name] = values.astype(np.int64)
+
+    return stats
+
+
+def _get_kinds(values: pd.Series) -> pd.Series:
+    """
+    Type of each value - 'i' (int), 'f' (float, including NaN) or 'O' (text)
+    """
+    if pd.api.types.is_integer_dtype(values.dtype):
+        return pd.Series('i', index=values.index)
+    if pd.api.types.is_float_dtype(values.dtype):
+        return pd.Series('f', index=values.index)
+
+    kinds = pd.Series('O', index=values.index)
+    kinds[values.isnull()] = 'f'
+    kinds[values.map(lambda value: isinstance(value, (int, np.integer)))] = 'i'
+    kinds[values.map(lambda value: isinstance(value, (float, np.floating)))] = 'f'
+    return kinds
+
+
 def make_classification(form: pd.DataFrame) -> pd.Series:
     """
     Return an indexed series of content classifications (present, missing,
@@ -1,5 +1,6 @@
+import io
 import pandas as pd
-import redcap as rc
+from chunked_export import export_records_in_chunks
 
 
 """
@@ -114,44 +115,33 @@ def form_has_content_and_is_not_missing(row):
 # and adapted to scope down to forms
 
 # FIXME: Possibly duplicates chunk edges? Need to check it out
-def chunked_form_export(project, forms, events=None, include_dag=False, chunk_size=100, fields=[]):
+def chunked_form_export(project, forms, events=None, include_dag=False, chunk_size=100, fields=[], records=None, as_text=False):
+    """
+    If records (see chunked_export.export_record_ids) is not given, the record ids are exported first.
+    With as_text, all values are kept as exported (empty values as '') - see split_by_event.
+    """
     if isinstance(forms, str):
         forms = [forms]
     if isinstance(events, str):
         events = [events]
-        
-    def chunks(l, n):
-        """Yield successive n-sized chunks from list l"""
-        for i in range(0, len(l), n):
-            yield l[i:i+n]
-    record_list = project.export_records(fields=[project.def_field])
-    records = [r[project.def_field] for r in record_list]
-    try:
-        response = None
-        record_count = 0
-        for record_chunk in chunks(records, chunk_size):
-            record_count = record_count + chunk_size
-            #print record_count
-            try:
-                chunked_response = project.export_records(records=record_chunk,
-                                                          fields=[project.def_field] + fields,
-                                                          forms=forms,
-                                                          events=events,
-                                                          export_data_access_groups=include_dag,
-                                                          format_type='df',
-                                                          df_kwargs={'low_memory': False})
-            except pd.errors.EmptyDataError:
-                print("Empty DataFrame error for event {}, fields {}, forms {}"
-                        .format(events, fields, forms))
-                continue
-
-            if response is not None:
-                response = pd.concat([response, chunked_response], axis=0)
-            else:
-                response = chunked_response
-    except rc.RedcapError:
-        msg = "Chunked export failed for chunk_size={:d}".format(chunk_size)
-        raise ValueError(msg)
+
+
+    # a chunk that fails is exported again in chunks of 10 records
+    chunk_sizes = [chunk_size] + ([10] if chunk_size > 10 else [])
+    df_kwargs = {'low_memory': False}
+    if as_text:
+        df_kwargs.update(dtype=str, keep_default_na=False)
+    response = export_records_in_chunks(project,
+                                        records=records,
+                                        chunk_sizes=chunk_sizes,
+                                        fields=[project.def_field] + fields,
+                                        forms=forms,
+                                        events=events,
+                                        export_data_access_groups=include_dag,
+                                        df_kwargs=df_kwargs)
+    if response is None:
+        print("Empty DataFrame error for event {}, fields {}, forms {}"
+                .format(events, fields, forms))
     else:
         if project.is_longitudinal:
             # Only set index if not already
@@ -161,3 +151,15 @@ def chunked_form_export(project, forms, events=None, include_dag=False, chunk_si
             response.set_index([project.def_field], inplace=True)
             
         return response
+
+
+def split_by_event(data):
+    """
+    Split a form exported with chunked_form_export(..., as_text=True) by event.
+    Yields (event, data) with the column types inferred for each event, i.e.
+    the same data as exporting the event on its own.
+    """
+    index_names = list(data.index.names)
+    for event, event_data in data.groupby(level='redcap_event_name', sort=False):
+        text = event_data.reset_index().to_csv(index=False)
+        yield event, pd.read_csv(io.StringIO(text), low_memory=False).set_index(index_names)
@@ -13,10 +13,14 @@ import glob
 import shutil
 import sys
 import tempfile 
+import multiprocessing
+import concurrent.futures
 from sibispy import sibislogger as slog
 from sibispy import utils as sutils
 
 from export_mr_sessions_uris import export_spiral_files, export_alcpic_files
+from xnat_listing_cache import get_listing_cache
+from resample_sidecar import get_resample_factors, rewrite_sidecar
 
 xnatBinDir = os.path.join( os.path.dirname( os.path.dirname( os.path.abspath(__file__) ) ), 'xnat')
 sys.path.append(xnatBinDir)
@@ -61,10 +65,10 @@ def check_file_date(pipeline_file,xnat_file):
 #
 # Export one series to pipeline tree, unless it already exists there
 #
-# Returns - True if new files were created, False if not
+# Returns - True if new files were created, False if not (or if the conversion was submitted to conversion_queue)
 #
 
-def export_series( redcap_visit_id, xnat, redcap_key, session_and_scan_list, to_directory, filename_pattern, xnat_dir, mr_session_report_complete, verbose=False, timer_label=None):
+def export_series( redcap_visit_id, xnat, redcap_key, session_and_scan_list, to_directory, filename_pattern, xnat_dir, mr_session_report_complete, verbose=False, timer_label=None, conversion_queue=None):
     (subject_label, event_label) = redcap_key
     # List should have at least one "SESSION/SCAN" entry
     if not '/' in session_and_scan_list:
@@ -148,73 +152,100 @@ def export_series( redcap_visit_id, xnat, redcap_key, session_and_scan_list, to_
             if os.path.exists(nii_file):
                 os.remove(nii_file)
 
-    if len( dicom_path_list ):
-        temp_dir = tempfile.mkdtemp()
-        tmp_path_pattern = os.path.join(temp_dir, filename_pattern )
+    if not len( dicom_path_list ):
+        return False
+
+    exp=xnat.select.experiments[ session ]
+    scanPtr=exp.scans[ scan ]
+
+    # check if new DTI of sri with higher  voxel resolution was created - if so resample to original one   
+    resample_factors = None
+    voxel_res = None
+    if scanPtr.type == "ncanda-dti6b500pepolar-v1" or  scanPtr.type == "ncanda-dti60b1000-v1" or scanPtr.type == "ncanda-dti30b400-v1":
+        voxel_res = [ scanPtr.fulldata['data_fields'].get('parameters/voxelRes/' + axis) for axis in 'xyz' ]
+        resample_factors = get_resample_factors( voxel_res )
+
+    # Everything the conversion needs from XNAT is collected here, so the job itself can run in another process
+    job = dict( redcap_visit_id = redcap_visit_id,
+                scan = scan,
+                session = session,
+                dicom_path_list = dicom_path_list,
+                num_dcm_files = make_session_niftis.get_num_dcm_files( exp.project, session, scanPtr, verbose ),
+                to_directory = to_directory,
+                filename_pattern = filename_pattern,
+                eid_file_path = eid_file_path,
+                session_and_scan_list = session_and_scan_list,
+                resample_factors = resample_factors,
+                voxel_res = voxel_res,
+                verbose = verbose )
+
+    # Timed conversions are run right away so that the timer only measures this series
+    if conversion_queue and not timer_label:
+        conversion_queue.submit( job )
+        return False
+
+    return report_conversion( job, convert_series( job, timer_label=timer_label ) )
+
+#
+# Convert the DICOM files of one series in its own temporary directory and move the result to the pipeline
+#
+# Returns - (conversion_error, eid_file_error) to be reported by report_conversion, where conversion_error is
+#           None if successful and (error, details) otherwise
+#
+def convert_series( job, timer_label=None ):
+    to_directory = job['to_directory']
+    verbose = job['verbose']
+
+    eid_file_error = False
+    temp_dir = tempfile.mkdtemp()
+    try:
+        tmp_path_pattern = os.path.join(temp_dir, job['filename_pattern'] )
         if timer_label :
             slog.startTimer2() 
 
-        exp=xnat.select.experiments[ session ]
-        scanPtr=exp.scans[ scan ]
-
-        eout=make_session_niftis.dcm2niftiWithCheck(dicom_path_list , tmp_path_pattern,exp.project,session, scanPtr, False,verbose)
-        
-        # args= '--tolerance 1e-3 --write-single-slices  --include-ndar --strict-xml --no-progress -rxO %s %s 2>&1' % ( , ' '.join( dicom_path_list ))
-        # (ecode, sout, eout) = sutils.dcm2image(args)
+        eout=make_session_niftis.dcm2nifti( job['dicom_path_list'], tmp_path_pattern, job['num_dcm_files'], False, verbose )
         if eout != "":
-            slog.info(redcap_visit_id + "_" + scan,"Error: Unable to create dicom file",
-                      experiment_site_id=session,
-                      cmd=sutils.dcm2image_cmd + " " + args,
-                      err_msg = str(eout))
-            shutil.rmtree(temp_dir)
-            return False
+            return (("Error: Unable to create dicom file",
+                     dict( experiment_site_id=job['session'],
+                           err_msg = str(eout))), eid_file_error)
 
         if timer_label:
             slog.takeTimer2('convert_dicom_to_nifti', timer_label) 
 
         try:
-            if not os.path.exists(to_directory):
-                os.makedirs(to_directory)
-
-            open( eid_file_path, 'w' ).writelines( session_and_scan_list )
+            os.makedirs(to_directory, exist_ok=True)
+            open( job['eid_file_path'], 'w' ).writelines( job['session_and_scan_list'] )
         except:
-            error = "ERROR: unable to write EID file"
-            slog.info(redcap_visit_id + "_" + scan,error,
-                      experiment_site_id=session,
-                      eid_file_path = eid_file_path)
+            # not fatal - files are still moved to the pipeline
+            if verbose:
+                print("ERROR: unable to write EID file", job['eid_file_path'])
+            eid_file_error = True
 
-        # check if new DTI of sri with higher  voxel resolution was created - if so resample to original one   
-        if  (scanPtr.type == "ncanda-dti6b500pepolar-v1" or  scanPtr.type == "ncanda-dti60b1000-v1" or scanPtr.type == "ncanda-dti30b400-v1")  and scanPtr.fulldata['data_fields']['parameters/voxelRes/x'] == 0.9375  and scanPtr.fulldata['data_fields']['parameters/voxelRes/y'] == 0.9375  and scanPtr.fulldata['data_fields']['parameters/voxelRes/z'] == 2.5:
+        resample_factors = job['resample_factors']
+        if resample_factors:
             if verbose:
-                print("INFO:resample nifti for", to_directory, "to 1.875x1.875x2.5 voxel resolution!")
+                print("INFO:resample nifti for", to_directory, "by factors", resample_factors, "!")
             
             for f in os.listdir(temp_dir):
                 fext = os.path.splitext(f)[1]
                 if fext == ".xml" :
                     # rewrite xml file
-                    output=os.path.join(to_directory,f)
-                    cmd="sed 's/PixelSpacing>0.9375\\\\0.9375/PixelSpacing>1.875\\\\1.875/g' " + os.path.join(temp_dir,f) + " > " +  output +"; sed -i 's/Columns>256/Columns>128/g' " +  output +"; sed -i 's/Rows>256/Rows>128/g' " +  output
-                    (ecode, sout, eout) = sutils.call_shell_program(cmd)
-                    if ecode:
-                        error = "ERROR: unable to rewrite xml file"
-                        slog.info(redcap_visit_id + "_" + scan,error,
-                              experiment_site_id = session,
-                              src_dir = temp_dir ,
-                              dest_dir = to_directory,
-                              err_msg = str(eout))
-                        shutil.rmtree(temp_dir)
-                        return False
+                    try:
+                        rewrite_sidecar( os.path.join(temp_dir,f), os.path.join(to_directory,f), job['voxel_res'] )
+                    except Exception as err_msg:
+                        return (("ERROR: unable to rewrite xml file",
+                                dict( experiment_site_id = job['session'],
+                                      src_dir = temp_dir ,
+                                      dest_dir = to_directory,
+                                      err_msg = str(err_msg))), eid_file_error)
                 elif  fext == ".gz" :
-                    (ecode, sout, eout) = sutils.call_shell_program("cmtk convertx --downsample-average 2,2,1 " +  os.path.join(temp_dir,f) + " " +  os.path.join(to_directory,f))
+                    (ecode, sout, eout) = sutils.call_shell_program("cmtk convertx --downsample-average " + ','.join( str(factor) for factor in resample_factors ) + " " +  os.path.join(temp_dir,f) + " " +  os.path.join(to_directory,f))
                     if ecode:
-                        error = "ERROR: unable to reample nifti file"
-                        slog.info(redcap_visit_id + "_" + scan,error,
-                              experiment_site_id = session,
-                              src_dir = temp_dir ,
-                              dest_dir = to_directory,
-                              err_msg = str(eout))
-                        shutil.rmtree(temp_dir)
-                        return False
+                        return (("ERROR: unable to reample nifti file",
+                                dict( experiment_site_id = job['session'],
+                                      src_dir = temp_dir ,
+                                      dest_dir = to_directory,
+                                      err_msg = str(eout))), eid_file_error)
                 else :
                     if verbose:
                         print("INFO:", f, " was just moved to", to_directory, "!")
@@ -226,19 +257,94 @@ def export_series( redcap_visit_id, xnat, redcap_key, session_and_scan_list, to_
                     shutil.move(os.path.join(temp_dir,f),to_directory)
 
             except Exception as err_msg: 
-                error = "ERROR: unable to move files"
-                slog.info(redcap_visit_id + "_" + scan,error,
-                          experiment_site_id = session,
-                          src_dir = temp_dir ,
-                          dest_dir = to_directory,
-                          err_msg = str(err_msg))
-                shutil.rmtree(temp_dir)
-                return False
-
-        shutil.rmtree(temp_dir)
-        return True
-    
-    return False
+                return (("ERROR: unable to move files",
+                        dict( experiment_site_id = job['session'],
+                              src_dir = temp_dir ,
+                              dest_dir = to_directory,
+                              err_msg = str(err_msg))), eid_file_error)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    return (None, eid_file_error)
+
+#
+# Log outcome of convert_series
+#
+# Returns - True if new files were created, False if not
+#
+def report_conversion( job, conversion_result ):
+    (conversion_error, eid_file_error) = conversion_result
+    error_id = job['redcap_visit_id'] + "_" + job['scan']
+    if eid_file_error:
+        slog.info(error_id,"ERROR: unable to write EID file",
+                  experiment_site_id=job['session'],
+                  eid_file_path = job['eid_file_path'])
+
+    if conversion_error:
+        (error, details) = conversion_error
+        slog.info(error_id, error, **details)
+        return False
+
+    return True
+
+#
+# Bounded pool of DICOM to NIfTI conversions
+#
+# export_series submits its conversion to the queue instead of running it, wait() collects the results.
+# With max_workers <= 1 conversions are run immediately in this process (as before). The conversions
+# of a visit run on executor (see make_conversion_executor) if given, otherwise on a pool of its own.
+#
+class SeriesConversionQueue(object):
+    def __init__(self, max_workers=1, executor=None):
+        self.executor = executor
+        self.own_executor = False
+        if not executor and max_workers > 1:
+            self.executor = make_conversion_executor(max_workers)
+            self.own_executor = True
+        self.jobs = []
+        self.new_files_created = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.own_executor:
+            self.executor.shutdown(wait=True)
+        return False
+
+    def submit(self, job):
+        if self.executor:
+            self.jobs.append((job, self.executor.submit(convert_series, job)))
+        else:
+            self.new_files_created = report_conversion(job, convert_series(job)) or self.new_files_created
+
+    def wait(self):
+        # results are reported in the order the series were submitted
+        for (job, future) in self.jobs:
+            try:
+                conversion_result = future.result()
+            except Exception as err_msg:
+                conversion_result = (("ERROR: conversion of series failed", dict(experiment_site_id=job['session'], err_msg=str(err_msg))), False)
+            self.new_files_created = report_conversion(job, conversion_result) or self.new_files_created
+
+        self.jobs = []
+        return self.new_files_created
+
+#
+# Pool of processes for the DICOM to NIfTI conversions (None if max_workers <= 1)
+#
+# Create it once in the main thread, before starting any other threads, and share it between visits:
+# the worker processes are forked right away rather than later from the threads that export the
+# visits (forking a process that runs several threads can deadlock the child).
+#
+def make_conversion_executor(max_workers=1):
+    if max_workers <= 1:
+        return None
+
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('fork'))
+    for future in [executor.submit(os.getpid) for worker in range(max_workers)]:
+        future.result()
+    return executor
 
 #
 # Copy ADNI phantom T1w image file for structural session
@@ -256,7 +362,7 @@ def copy_adni_phantom_t1w( redcap_visit_id, xnat, xnat_eid, to_directory ):
 
     # Get list of resource files that match the T1w image file name pattern
     experiment_files = []
-    resource_list=get_resource_list(redcap_visit_id,xnat,xnat_eid,experiment.resources)
+    resource_list=get_resource_list(redcap_visit_id,xnat,xnat_eid)
     for resource in resource_list:
         experiment_files += [ (file['cat_ID'], re.sub( r'.*\/files\/', '', file['URI']) ) for file in resource if re.match( r'^t1.nii.gz$', file['Name'] ) ]
 
@@ -286,7 +392,7 @@ def copy_adni_phantom_xml( redcap_visit_id, xnat, xnat_eid, to_directory ):
 
     # Get list of resource files that match the phantom XML file name pattern
     experiment_files = []
-    resource_list=get_resource_list(redcap_visit_id,xnat,xnat_eid,experiment.resources)
+    resource_list=get_resource_list(redcap_visit_id,xnat,xnat_eid)
     for resource in resource_list:
         experiment_files += [ (file['cat_ID'], re.sub( r'.*\/files\/', '', file['URI']) ) for file in resource if re.match( r'^phantom.xml$', file['Name'] ) ]
 
@@ -309,22 +415,24 @@ def gzip_physio( physio_file_path ):
         error = "ERROR: unable to compress physio file"
         slog.info(physio_file_path,error, err_msg = str(eout))
 
-def get_resource_list(redcap_visit_id,xnat,xnat_eid,exp_resources):
+def get_resource_list(redcap_visit_id,xnat,xnat_eid):
+    listing_cache = get_listing_cache(xnat)
 
     resource_list=[]
-    for resource in exp_resources.listing:
-        uri='/data/experiments/%s/resources/%s/files' % ( xnat_eid, resource.id )
+    for resource in listing_cache.get_resources(xnat_eid) or []:
+        resource_id = resource['xnat_abstractresource_id']
+        uri='/data/experiments/%s/resources/%s/files' % ( xnat_eid, resource_id )
         try : 
-            json_data=xnat._get_json(uri)
+            json_data=listing_cache.get_files(xnat_eid, resource_id)
             resource_list.append(json_data)
 
             # ==== test code === 
             for file in json_data:
-                if file['cat_ID'] != resource.id :
+                if str(file['cat_ID']) != str(resource_id) :
                     raise RuntimeError("cat_id was different than resource.id for", uri,str(file))
             
         except Exception as err_msg:
-            slog.info(redcap_visit_id, "WARNING: Could not retrieve" + uri  + " from xnat.", error_msg=str(err_msg),info="Modt likely file data of session is outdated - to update file data load session in xnat, select 'Manage Files', and press 'Update File Data'!", resource_dir=resource.label,resource_id=resource.id)
+            slog.info(redcap_visit_id, "WARNING: Could not retrieve" + uri  + " from xnat.", error_msg=str(err_msg),info="Modt likely file data of session is outdated - to update file data load session in xnat, select 'Manage Files', and press 'Update File Data'!", resource_dir=resource.get('label'),resource_id=resource_id)
 
     return resource_list
 
@@ -357,7 +465,7 @@ def copy_rsfmri_physio_files( redcap_visit_id, xnat, xnat_eid_and_scan, to_direc
 
     # Get list of resource files that match one of the physio file name patterns
     physio_files = []
-    resource_list=get_resource_list(redcap_visit_id,xnat,xnat_eid,experiment.resources)
+    resource_list=get_resource_list(redcap_visit_id,xnat,xnat_eid)
     for resource in resource_list:
         for (pattern,outfile_name) in list(physio_filename_patterns.items()):
              physio_files += [ (file['cat_ID'], re.sub( r'.*\/files\/', '', file['URI']), outfile_name ) for file in resource if re.match( pattern, file['Name'] ) ]
@@ -430,7 +538,7 @@ def copy_manual_pipeline_files( redcap_visit_id, xnat, xnat_eid, to_directory ):
 
     # Get list of resource files that match one of the physio file name patterns
     files = []
-    resource_list=get_resource_list(redcap_visit_id,xnat,xnat_eid,experiment.resources)
+    resource_list=get_resource_list(redcap_visit_id,xnat,xnat_eid)
     for resource in resource_list:
         files += [ (file['cat_ID'], re.sub( r'.*\/files\/', '', file['URI']) ) for file in resource if file['collection'] == 'pipeline' ]
 
@@ -476,7 +584,15 @@ def delete_workdir(workdir, redcap_visit_id, mr_session_report_complete, missing
 #
 # Returns - True if new file as created, False if not
 #
-def export_to_workdir( redcap_visit_id, xnat, session_data, pipeline_workdir, redcap_key, xnat_dir, mr_session_report_complete,stroop=(None,None,None), verbose=False, timerFlag=False):
+def export_to_workdir( redcap_visit_id, xnat, session_data, pipeline_workdir, redcap_key, xnat_dir, mr_session_report_complete,stroop=(None,None,None), verbose=False, timerFlag=False, max_conversions=1, conversion_executor=None):
+    # Series are converted concurrently while the remaining files are copied from XNAT
+    with SeriesConversionQueue(max_workers=max_conversions, executor=conversion_executor) as conversion_queue:
+        new_files_created = queue_exports_to_workdir( redcap_visit_id, xnat, session_data, pipeline_workdir, redcap_key, xnat_dir, mr_session_report_complete, conversion_queue, stroop=stroop, verbose=verbose, timerFlag=timerFlag )
+        new_files_created = conversion_queue.wait() or new_files_created
+
+    return new_files_created
+
+def queue_exports_to_workdir( redcap_visit_id, xnat, session_data, pipeline_workdir, redcap_key, xnat_dir, mr_session_report_complete, conversion_queue, stroop=(None,None,None), verbose=False, timerFlag=False):
 
     new_files_created = False
     
@@ -489,9 +605,9 @@ def export_to_workdir( redcap_visit_id, xnat, session_data, pipeline_workdir, re
         else :
             timerLabel = None
 
-        new_files_created = export_series( redcap_visit_id, xnat, redcap_key, session_data['mri_series_t1'], pipeline_workdir_structural_native, 't1.nii', xnat_dir, mr_session_report_complete, verbose=verbose, timer_label= timerLabel ) 
+        new_files_created = export_series( redcap_visit_id, xnat, redcap_key, session_data['mri_series_t1'], pipeline_workdir_structural_native, 't1.nii', xnat_dir, mr_session_report_complete, verbose=verbose, timer_label= timerLabel, conversion_queue=conversion_queue ) 
 
-        new_files_created = export_series( redcap_visit_id, xnat, redcap_key, session_data['mri_series_t2'], pipeline_workdir_structural_native, 't2.nii', xnat_dir, mr_session_report_complete, verbose=verbose) or new_files_created
+        new_files_created = export_series( redcap_visit_id, xnat, redcap_key, session_data['mri_series_t2'], pipeline_workdir_structural_native, 't2.nii', xnat_dir, mr_session_report_complete, verbose=verbose, conversion_queue=conversion_queue) or new_files_created
 
         # Copy ADNI phantom XML file
         if 'NCANDA_E' in session_data['mri_adni_phantom_eid']:
@@ -512,12 +628,12 @@ def export_to_workdir( redcap_visit_id, xnat, session_data, pipeline_workdir, re
     pipeline_workdir_diffusion_main = os.path.join( pipeline_workdir, 'diffusion' );
     pipeline_workdir_diffusion_native = os.path.join(pipeline_workdir_diffusion_main, 'native' );
     if session_data['mri_series_dti6b500pepolar'] != '' and session_data['mri_series_dti60b1000'] != '':
-        new_files_created = export_series( redcap_visit_id, xnat, redcap_key, session_data['mri_series_dti6b500pepolar'], os.path.join( pipeline_workdir_diffusion_native, 'dti6b500pepolar' ), 'dti6-%n.nii', xnat_dir, mr_session_report_complete, verbose=verbose ) or new_files_created
+        new_files_created = export_series( redcap_visit_id, xnat, redcap_key, session_data['mri_series_dti6b500pepolar'], os.path.join( pipeline_workdir_diffusion_native, 'dti6b500pepolar' ), 'dti6-%n.nii', xnat_dir, mr_session_report_complete, verbose=verbose, conversion_queue=conversion_queue ) or new_files_created
 
-        new_files_created = export_series( redcap_visit_id, xnat, redcap_key, session_data['mri_series_dti60b1000'], os.path.join( pipeline_workdir_diffusion_native, 'dti60b1000' ), 'dti60-%n.nii', xnat_dir, mr_session_report_complete, verbose=verbose ) or new_files_created
+        new_files_created = export_series( redcap_visit_id, xnat, redcap_key, session_data['mri_series_dti60b1000'], os.path.join( pipeline_workdir_diffusion_native, 'dti60b1000' ), 'dti60-%n.nii', xnat_dir, mr_session_report_complete, verbose=verbose, conversion_queue=conversion_queue ) or new_files_created
 
         if session_data['mri_series_dti30b400'] != '' :
-            new_files_created = export_series( redcap_visit_id, xnat, redcap_key, session_data['mri_series_dti30b400'], os.path.join( pipeline_workdir_diffusion_native, 'dti30b400' ), 'dti30-%n.nii', xnat_dir, mr_session_report_complete, verbose=verbose ) or new_files_created
+            new_files_created = export_series( redcap_visit_id, xnat, redcap_key, session_data['mri_series_dti30b400'], os.path.join( pipeline_workdir_diffusion_native, 'dti30b400' ), 'dti30-%n.nii', xnat_dir, mr_session_report_complete, verbose=verbose, conversion_queue=conversion_queue ) or new_files_created
 
         # if session_data['mri_series_dti_fieldmap'] != '':
         #     new_files_created = export_series( redcap_visit_id, xnat, redcap_key, session_data['mri_series_dti_fieldmap'], os.path.join( pipeline_workdir_diffusion_native, 'fieldmap' ), 'fieldmap-%T%N.nii', xnat_dir, mr_session_report_complete, verbose=verbose ) or new_files_created
@@ -546,7 +662,8 @@ def export_to_workdir( redcap_visit_id, xnat, session_data, pipeline_workdir, re
             'dti6b3000-%n.nii',
             xnat_dir,
             mr_session_report_complete,
-            verbose=verbose
+            verbose=verbose,
+            conversion_queue=conversion_queue
         ) or new_files_created
 
         # dti96b3000 -> 32ch-diffusion/native/dti96b3000/dti96b3000-%n.nii
@@ -559,7 +676,8 @@ def export_to_workdir( redcap_visit_id, xnat, session_data, pipeline_workdir, re
             'dti96b3000-%n.nii',
             xnat_dir,
             mr_session_report_complete,
-            verbose=verbose
+            verbose=verbose,
+            conversion_queue=conversion_queue
         ) or new_files_created
 
     else :
@@ -582,11 +700,11 @@ def export_to_workdir( redcap_visit_id, xnat, session_data, pipeline_workdir, re
         else :
             timerLabel = None
 
-        new_files_created = export_series( redcap_visit_id, xnat, redcap_key, session_data['mri_series_rsfmri'], os.path.join( pipeline_workdir_functional_native, 'rs-fMRI' ), 'bold-%n.nii', xnat_dir, mr_session_report_complete,verbose=verbose, timer_label = timerLabel ) or new_files_created
+        new_files_created = export_series( redcap_visit_id, xnat, redcap_key, session_data['mri_series_rsfmri'], os.path.join( pipeline_workdir_functional_native, 'rs-fMRI' ), 'bold-%n.nii', xnat_dir, mr_session_report_complete,verbose=verbose, timer_label = timerLabel, conversion_queue=conversion_queue ) or new_files_created
         # Copy rs-fMRI physio files
         new_files_created = copy_rsfmri_physio_files( redcap_visit_id, xnat, session_data['mri_series_rsfmri'], os.path.join( pipeline_workdir_functional_native, 'physio' ) ) or new_files_created
 
-        new_files_created = export_series( redcap_visit_id, xnat, redcap_key, session_data['mri_series_rsfmri_fieldmap'], os.path.join( pipeline_workdir_functional_native, 'fieldmap' ), 'fieldmap-%T%N.nii', xnat_dir, mr_session_report_complete, verbose=verbose ) or new_files_created
+        new_files_created = export_series( redcap_visit_id, xnat, redcap_key, session_data['mri_series_rsfmri_fieldmap'], os.path.join( pipeline_workdir_functional_native, 'fieldmap' ), 'fieldmap-%T%N.nii', xnat_dir, mr_session_report_complete, verbose=verbose, conversion_queue=conversion_queue ) or new_files_created
 
     else :
         missing_mri=""
@@ -635,7 +753,8 @@ def export_to_workdir( redcap_visit_id, xnat, session_data, pipeline_workdir, re
             'bold-%n.nii',
             xnat_dir,
             mr_session_report_complete,
-            verbose=verbose
+            verbose=verbose,
+            conversion_queue=conversion_queue
         ) or new_files_created
 
         # 2) Export shared rsfMRI fieldmap to alcpic/native/fieldmap
@@ -649,7 +768,8 @@ def export_to_workdir( redcap_visit_id, xnat, session_data, pipeline_workdir, re
                 'fieldmap-%T%N.nii',
                 xnat_dir,
                 mr_session_report_complete,
-                verbose=verbose
+                verbose=verbose,
+                conversion_queue=conversion_queue
             ) or new_files_created
         
         # 3) Export ALCPIC task fMRI E-Prime files (experiment-level resources)
@@ -688,7 +808,7 @@ def export_to_workdir( redcap_visit_id, xnat, session_data, pipeline_workdir, re
 #
 # Export MR session and run pipeline if so instructed
 #
-def export_and_queue(red2cas, redcap_visit_id, xnat, session_data, redcap_key, pipeline_root_dir, xnat_dir,mr_session_report_complete,stroop=(None,None,None), run_pipeline_script=None, verbose=False, timerFlag = False ):
+def export_and_queue(red2cas, redcap_visit_id, xnat, session_data, redcap_key, pipeline_root_dir, xnat_dir,mr_session_report_complete,stroop=(None,None,None), run_pipeline_script=None, verbose=False, timerFlag = False, max_conversions=1, conversion_executor=None ):
     (subject_label, event_label) = redcap_key
     # Put together pipeline work directory for this subject and visit
     subject_code = session_data['mri_xnat_sid']
@@ -707,7 +827,7 @@ def export_and_queue(red2cas, redcap_visit_id, xnat, session_data, redcap_key, p
     if verbose:
         print(subject_label,'/',subject_code,'/',event_label,'to',pipeline_workdir)
 
-    new_files_created = export_to_workdir(redcap_visit_id,xnat, session_data, pipeline_workdir, redcap_key, xnat_dir, mr_session_report_complete, stroop=stroop, verbose=verbose, timerFlag= timerFlag)
+    new_files_created = export_to_workdir(redcap_visit_id,xnat, session_data, pipeline_workdir, redcap_key, xnat_dir, mr_session_report_complete, stroop=stroop, verbose=verbose, timerFlag= timerFlag, max_conversions=max_conversions, conversion_executor=conversion_executor)
 
     if (new_files_created and run_pipeline_script):
         if verbose:
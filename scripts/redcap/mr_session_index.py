@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+##
+##  See COPYING file distributed along with the ncanda-data-integration package
+##  for the copyright and license terms
+##
+
+import bisect
+import operator
+
+#
+# Per-subject, date-sorted index over the MR sessions exported from XNAT
+#
+# Replaces the linear scans over xnat_sessions_list in import_mr_sessions, which
+# made the lookup for every visit O(#sessions in XNAT).
+#
+class MRSessionIndex(object):
+    def __init__(self, xnat_sessions_list):
+        # position in the export is kept so that results are returned in the same
+        # order as the original linear scan (first eid determines scanner and site)
+        by_subject = dict()
+        self._by_eid = dict()
+        for pos, (session_id, session_subject_id, projects, date, scanner) in enumerate(xnat_sessions_list):
+            by_subject.setdefault(session_subject_id, []).append((date or '', pos, session_id, projects, date))
+            self._by_eid[session_id] = (session_subject_id, projects, date)
+
+        self._dates = dict()
+        self._sessions = dict()
+        for subject_id, entries in by_subject.items():
+            entries.sort(key=operator.itemgetter(0, 1))
+            self._dates[subject_id] = [entry[0] for entry in entries]
+            self._sessions[subject_id] = [entry[1:] for entry in entries]
+
+    def __len__(self):
+        return len(self._by_eid)
+
+    def get_sessions_in_range(self, subject_id, date_range_from, date_range_to, inclusive_end=True):
+        """
+        Return (session_id, projects, date) for all sessions of the subject with
+        date_range_from <= date <= date_range_to (or < date_range_to if not inclusive_end),
+        ordered as in the XNAT export.
+        """
+        dates = self._dates.get(subject_id)
+        if not dates:
+            return []
+
+        lo = bisect.bisect_left(dates, date_range_from)
+        if inclusive_end:
+            hi = bisect.bisect_right(dates, date_range_to)
+        else:
+            hi = bisect.bisect_left(dates, date_range_to)
+        if lo >= hi:
+            return []
+
+        hits = sorted(self._sessions[subject_id][lo:hi])
+        return [(session_id, projects, date) for (pos, session_id, projects, date) in hits]
+
+    def get_session(self, session_id):
+        """
+        Return (subject_id, projects, date) for the given experiment ID or None.
+        """
+        return self._by_eid.get(session_id)
@@ -0,0 +1,64 @@
+##
+##  See COPYING file distributed along with the ncanda-data-integration package
+##  for the copyright and license terms
+##
+
+"""
+Subject ID and date encoded in the record IDs of the import projects
+
+Laptop records are named SUBJECT-DATE (e.g., C-70109-F-0-2015-12-07), WebCNP
+records add the dataset ID (e.g., C-70109-F-0-2015-12-07-22345). The importers
+use these wherever the subject ID or date field of a record was left blank.
+"""
+
+import pandas
+
+record_id_pattern = r'^(?P<subject_id>[A-Za-z]-\d{5}-[A-Za-z]-\d)-(?P<date>\d{4}-\d{2}-\d{2})(?:-\d+)?$'
+date_format_ymd = '%Y-%m-%d'
+
+
+def parse_record_ids(record_ids):
+    """
+    Split record IDs into upper-case subject ID and date.
+
+    Returns a DataFrame indexed by record ID with columns subject_id, date and
+    valid. Record IDs that do not match the pattern, or that name a date that
+    does not exist, are not valid and have empty subject ID and date.
+    """
+    record_ids = pandas.Index(record_ids, dtype=object).astype(str)
+    keys = pandas.Series(record_ids, index=record_ids).str.extract(record_id_pattern)
+
+    dates = pandas.to_datetime(keys['date'], format=date_format_ymd, errors='coerce')
+    valid = keys['subject_id'].notnull() & dates.notnull()
+
+    keys = pandas.DataFrame({'subject_id': keys['subject_id'].str.upper().where(valid, ''),
+                             'date': keys['date'].where(valid, ''),
+                             'valid': valid.values}, index=record_ids)
+    return keys
+
+
+def fill_from_record_ids(data, subject_label, date_label,
+                         subject_slice=slice(0, 11), date_slice=slice(12, 22)):
+    """
+    Fill blank (empty or NaN) subject ID and date columns of data, which is
+    indexed by record ID, from the record IDs.
+
+    Record IDs that cannot be parsed fall back to the characters at
+    subject_slice and date_slice, as the importers always did. Returns these
+    record IDs (those that needed a value but could not be parsed).
+    """
+    if not len(data):
+        return []
+
+    keys = parse_record_ids(data.index)
+    record_ids = pandas.Series(keys.index, index=keys.index)
+    fallback = {'subject_id': record_ids.str[subject_slice], 'date': record_ids.str[date_slice]}
+
+    missing = pandas.Series(False, index=data.index)
+    for (label, key) in [(subject_label, 'subject_id'), (date_label, 'date')]:
+        values = keys[key].where(keys['valid'], fallback[key])
+        blank = (data[label].isnull() | (data[label] == '')).values
+        data[label] = data[label].where(~blank, values.values)
+        missing |= blank
+
+    return data.index[missing.values & ~keys['valid'].values].tolist()
@@ -0,0 +1,323 @@
+#!/usr/bin/env python
+
+##
+##  See COPYING file distributed along with the ncanda-data-integration package
+##  for the copyright and license terms
+##
+
+import io
+import os
+import json
+import datetime
+import tempfile
+import pandas as pd
+from pandas.errors import EmptyDataError
+
+#
+# Local snapshot of a REDCap project - one Parquet (or Feather) file per form
+#
+# refresh() exports only the records created or modified since the last
+# refresh (REDCap's dateRangeBegin) and replaces them in the form files;
+# records deleted from REDCap are dropped. export_records() then answers the
+# exports the scripts run against REDCap from the local files.
+#
+# All values are kept as the text REDCap exported, so that export_records()
+# can return the data frame that PyCap would have built from the same export.
+#
+# With max_age set, export_records() refuses forms that were last refreshed
+# longer ago (e.g. because the nightly refresh failed), so that callers can
+# fall back to exporting from REDCap instead of reading stale data.
+#
+STATE_FILE = 'snapshot.json'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Records modified while a refresh is running are picked up by the next one
+REFRESH_OVERLAP = datetime.timedelta(hours=1)
+
+
+def _get_default_file_mode():
+    # the umask can only be read by setting it, so read it once on import
+    # rather than while other threads may be creating files
+    umask = os.umask(0o022)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+# mkstemp creates files that only the owner can read - give the snapshot the
+# mode of any other new file so that other accounts can read it
+FILE_MODE = _get_default_file_mode()
+
+
+class RedcapSnapshot(object):
+    def __init__(self, project, snapshot_dir, file_format='parquet', max_age=None, verbose=False):
+        if file_format not in ['parquet', 'feather']:
+            raise ValueError("Unknown snapshot file format " + str(file_format))
+
+        self.project = project
+        self.snapshot_dir = snapshot_dir
+        self.file_format = file_format
+        self.max_age = max_age
+        self.verbose = verbose
+        self.def_field = project.def_field
+        self._state = self._read_state()
+
+    #
+    # Refresh
+    #
+    def refresh(self, forms=None, full=False):
+        """
+        Update the snapshot of the given forms (default: all forms). Returns
+        the number of records exported per form.
+        """
+        refresh_start = datetime.datetime.now()
+        if not os.path.exists(self.snapshot_dir):
+            os.makedirs(self.snapshot_dir)
+
+        metadata = self.project.export_metadata()
+        form_fields = dict()
+        for field in metadata:
+            form_fields.setdefault(field['form_name'], []).append(field['field_name'])
+
+        record_ids = self._export_record_ids()
+        exported = dict()
+        for form in (forms or list(form_fields.keys())):
+            if form not in form_fields:
+                raise ValueError("Form %s does not exist in REDCap" % form)
+
+            form_state = self._state['forms'].get(form, dict())
+            date_begin = None
+            if not full and form_state.get('fields') == form_fields[form] and self._exists(form):
+                date_begin = datetime.datetime.strptime(form_state['refreshed'], DATE_FORMAT) - REFRESH_OVERLAP
+
+            delta = self._export_form(form, date_begin)
+            if date_begin is None:
+                data = delta
+            else:
+                data = self._merge(self._read_form(form), delta)
+
+            # Drop records that were deleted in REDCap, keep the REDCap record order
+            record_pos = dict((record_id, pos) for (pos, record_id) in enumerate(record_ids))
+            data = data[data[self.def_field].isin(record_pos)]
+            data = data.iloc[data[self.def_field].map(record_pos).argsort(kind='stable')].reset_index(drop=True)
+
+            self._write_form(form, data)
+            self._state['forms'][form] = {'refreshed': refresh_start.strftime(DATE_FORMAT),
+                                          'fields': form_fields[form],
+                                          'incremental': date_begin is not None}
+            self._state['metadata'] = metadata
+            self._write_state()
+
+            exported[form] = delta[self.def_field].nunique()
+            if self.verbose:
+                print("%s: exported %d records (%s), %d rows in snapshot"
+                      % (form, exported[form], 'incremental' if date_begin else 'full', len(data)))
+
+        return exported
+
+    def _export_record_ids(self):
+        records = self.project.export_records(fields=[self.def_field])
+        return list(pd.unique(pd.Series([record[self.def_field] for record in records], dtype=object)))
+
+    def _export_form(self, form, date_begin):
+        kwargs = dict(forms=[form],
+                      event_name='unique',
+                      export_data_access_groups=True,
+                      format_type='df',
+                      df_kwargs={'dtype': str, 'keep_default_na': False, 'index_col': False})
+        if date_begin is not None:
+            kwargs['date_begin'] = date_begin
+
+        try:
+            return self.project.export_records(**kwargs)
+        except EmptyDataError:
+            return pd.DataFrame(columns=[self.def_field])
+        except TypeError:
+            # Older PyCap versions lack date_begin - export everything
+            if date_begin is None:
+                raise
+            del kwargs['date_begin']
+            return self.project.export_records(**kwargs)
+
+    def _merge(self, data, delta):
+        if not len(delta.columns) or delta.empty:
+            return data
+
+        # A modified record is exported with all of its rows
+        data = data[~data[self.def_field].isin(delta[self.def_field])]
+        columns = list(delta.columns) + [col for col in data.columns if col not in delta.columns]
+        return pd.concat([data, delta], axis=0, sort=False)[columns].fillna('')
+
+    #
+    # Read API
+    #
+    def get_forms(self):
+        return [form for form in self._state['forms'] if self._exists(form)]
+
+    def get_refresh_date(self, form):
+        return self._state['forms'].get(form, dict()).get('refreshed')
+
+    def _is_stale(self, form):
+        if self.max_age is None:
+            return False
+        refreshed = self.get_refresh_date(form)
+        if not refreshed:
+            return True
+        return datetime.datetime.now() - datetime.datetime.strptime(refreshed, DATE_FORMAT) > self.max_age
+
+    def export_records(self, records=None, fields=None, forms=None, events=None,
+                       export_data_access_groups=False, format_type='df',
+                       df_kwargs=None, **kwargs):
+        """
+        Same arguments and result as PyCap's export_records (with
+        event_name='unique'), answered from the snapshot.
+        """
+        if isinstance(fields, str):
+            fields = [fields]
+        if isinstance(forms, str):
+            forms = [forms]
+
+        field_forms = dict((field['field_name'], field['form_name']) for field in self._state.get('metadata', []))
+        load_forms = list(forms or [])
+        for field in (fields or []):
+            if field not in field_forms:
+                raise ValueError("Field %s is not part of the snapshot" % field)
+            if field_forms[field] not in load_forms:
+                load_forms.append(field_forms[field])
+        if not forms and not fields:
+            load_forms = self.get_forms()
+
+        data = None
+        dag = None
+        for form in load_forms:
+            if not self._exists(form):
+                raise ValueError("Form %s is not part of the snapshot - please refresh it" % form)
+            if self._is_stale(form):
+                raise ValueError("Snapshot of form %s was last refreshed on %s - please refresh it"
+                                 % (form, self.get_refresh_date(form)))
+
+            form_data = self._read_form(form)
+            if records is not None:
+                form_data = form_data[form_data[self.def_field].isin(records)]
+            if events is not None and 'redcap_event_name' in form_data:
+                form_data = form_data[form_data['redcap_event_name'].isin(events)]
+
+            if 'redcap_data_access_group' in form_data:
+                form_dag = form_data[[self.def_field, 'redcap_data_access_group']]
+                dag = form_dag if dag is None else pd.concat([dag, form_dag])
+                form_data = form_data.drop(columns=['redcap_data_access_group'])
+
+            if data is None:
+                data = form_data
+            else:
+                keys = [col for col in [self.def_field, 'redcap_event_name',
+                                        'redcap_repeat_instrument', 'redcap_repeat_instance']
+                        if col in data and col in form_data]
+                data = data.merge(form_data, on=keys, how='outer', sort=False)
+
+        if data is None:
+            data = pd.DataFrame(columns=[self.def_field])
+        data = data.fillna('')
+
+        columns = self._select_columns(data.columns, fields, forms, field_forms)
+        if export_data_access_groups:
+            columns.insert(columns.index('redcap_event_name') + 1 if 'redcap_event_name' in columns else 1,
+                           'redcap_data_access_group')
+            dag_map = dag.drop_duplicates(self.def_field).set_index(self.def_field)['redcap_data_access_group'] \
+                if dag is not None else pd.Series(dtype=object)
+            data['redcap_data_access_group'] = data[self.def_field].map(dag_map).fillna('')
+        data = data[columns]
+
+        # Like REDCap, skip rows without data in the requested fields (rows
+        # that only exist in another of the loaded forms)
+        value_columns = [col for col in columns[1:]
+                         if col not in ['redcap_event_name', 'redcap_data_access_group',
+                                        'redcap_repeat_instrument', 'redcap_repeat_instance']]
+        if value_columns:
+            data = data[(data[value_columns] != '').any(axis=1)]
+
+        if format_type == 'json':
+            return data.to_dict('records')
+        if format_type == 'csv':
+            return data.to_csv(index=False)
+        if format_type != 'df':
+            raise ValueError("Unsupported format " + str(format_type))
+
+        if data.empty:
+            raise EmptyDataError("No columns to parse from file")
+
+        if not df_kwargs:
+            # PyCap's default index
+            if 'redcap_event_name' in data:
+                df_kwargs = {'index_col': [self.def_field, 'redcap_event_name']}
+            else:
+                df_kwargs = {'index_col': self.def_field}
+
+        return pd.read_csv(io.StringIO(data.to_csv(index=False)), **df_kwargs)
+
+    def _select_columns(self, columns, fields, forms, field_forms):
+        key_columns = [col for col in [self.def_field, 'redcap_event_name',
+                                       'redcap_repeat_instrument', 'redcap_repeat_instance']
+                       if col in columns]
+        if not fields and not forms:
+            return key_columns + [col for col in columns if col not in key_columns]
+
+        wanted = set()
+        for field in (fields or []):
+            wanted.add(field)
+        for field, form in field_forms.items():
+            if forms and form in forms:
+                wanted.add(field)
+        for form in (forms or []):
+            wanted.add(form + '_complete')
+
+        # Checkbox fields are exported as one column per choice (field___choice)
+        selected = [col for col in columns
+                    if col not in key_columns
+                    and (col in wanted or col.split('___')[0] in wanted)]
+        return key_columns + selected
+
+    #
+    # Files
+    #
+    def _form_path(self, form):
+        return os.path.join(self.snapshot_dir, '%s.%s' % (form, self.file_format))
+
+    def _exists(self, form):
+        return os.path.exists(self._form_path(form))
+
+    def _read_form(self, form):
+        if self.file_format == 'parquet':
+            data = pd.read_parquet(self._form_path(form))
+        else:
+            data = pd.read_feather(self._form_path(form))
+        return data.astype(str)
+
+    def _write_form(self, form, data):
+        data = data.astype(str).reset_index(drop=True)
+        (fd, tmp_path) = tempfile.mkstemp(dir=self.snapshot_dir, suffix='.tmp')
+        os.close(fd)
+        try:
+            if self.file_format == 'parquet':
+                data.to_parquet(tmp_path, index=False)
+            else:
+                data.to_feather(tmp_path)
+            os.chmod(tmp_path, FILE_MODE)
+            os.replace(tmp_path, self._form_path(form))
+        except:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _read_state(self):
+        state_path = os.path.join(self.snapshot_dir, STATE_FILE)
+        if os.path.exists(state_path):
+            with open(state_path) as fi:
+                return json.load(fi)
+        return {'forms': dict()}
+
+    def _write_state(self):
+        (fd, tmp_path) = tempfile.mkstemp(dir=self.snapshot_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w') as fi:
+            json.dump(self._state, fi, indent=1)
+        os.chmod(tmp_path, FILE_MODE)
+        os.replace(tmp_path, os.path.join(self.snapshot_dir, STATE_FILE))
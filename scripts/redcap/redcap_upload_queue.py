@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+
+##
+##  See COPYING file distributed along with the ncanda-data-integration package
+##  for the copyright and license terms
+##
+
+import re
+import ast
+import math
+import hashlib
+
+from sibispy import sibislogger as slog
+
+#
+# Queue that collects REDCap records and imports them in batches
+#
+# Each record is added together with the label (usually redcap_visit_id) under
+# which errors are reported, so that a rejected batch can still be traced back
+# to the visit that caused it. Additional keyword arguments of add() (e.g.,
+# redcap_url) are included in the error report of that record.
+#
+# Single records - all of them with batch_size=1, otherwise those left over
+# when a rejected batch is split - are imported through
+# session.redcap_import_record, which reports failed imports (e.g., locked
+# forms) as before batching. Batches are imported into redcap_project directly,
+# as the queue needs the error to find the records that REDCap rejected.
+#
+class RedcapUploadQueue(object):
+    def __init__(self, session, redcap_project, batch_size=200, record_id_field='study_id', timer_label=None, verbose=False):
+        self.session = session
+        self.redcap_project = redcap_project
+        self.record_id_field = record_id_field
+        self.batch_size = max(1, batch_size)
+        self.timer_label = timer_label
+        self.verbose = verbose
+        self.records_uploaded = 0
+        self.requests_sent = 0
+        self._queue = []
+
+    def __len__(self):
+        return len(self._queue)
+
+    # time_label times the import of this record when it is imported on its own
+    def add(self, error_label, record, time_label=None, record_id=None, **error_context):
+        self._queue.append((error_label, _sanitize_record(record), error_context, (time_label, record_id)))
+        if len(self._queue) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        while self._queue:
+            batch = self._queue[:self.batch_size]
+            self._queue = self._queue[self.batch_size:]
+            self._upload(batch)
+
+        return self.records_uploaded
+
+    def _import(self, batch):
+        # only time the first upload - otherwise creating too many records
+        if self.timer_label and not self.requests_sent:
+            timer_label = self.timer_label
+        else:
+            timer_label = None
+        self.requests_sent += 1
+
+        if len(batch) == 1:
+            (error_label, record, context, (time_label, record_id)) = batch[0]
+            return self.session.redcap_import_record(error_label, record.get(self.record_id_field), record.get('redcap_event_name'),
+                                                     time_label or timer_label, [record], record_id, import_format="json")
+
+        if timer_label:
+            slog.startTimer2()
+
+        import_response = self.redcap_project.import_records([record for (label, record, context, options) in batch], overwrite='overwrite')
+
+        if timer_label:
+            slog.takeTimer2('redcap_import_records', timer_label)
+
+        return import_response
+
+    def _upload(self, batch):
+        if self.verbose:
+            print("Uploading", len(batch), "records to REDCap")
+
+        try:
+            import_response = self._import(batch)
+        except Exception as err_msg:
+            self._handle_rejected_batch(batch, err_msg)
+            return
+
+        # session.redcap_import_record has already reported a failed import
+        if not import_response:
+            return
+
+        if 'count' in list(import_response.keys()):
+            self.records_uploaded += int(import_response['count'])
+
+        if 'error' in list(import_response.keys()):
+            self._handle_rejected_batch(batch, import_response['error'])
+
+        error_label = batch[0][0] if len(batch) == 1 else 'RedcapUploadQueue'
+        if 'fields' in list(import_response.keys()):
+            slog.info(error_label + "-" + hashlib.sha1(str(import_response['fields']).encode()).hexdigest()[0:6],
+                      "Info: something wrong with fields ! Not sure what to do !",
+                      fields=str(import_response['fields']))
+        if 'records' in list(import_response.keys()):
+            slog.info(error_label + "-" + hashlib.sha1(str(import_response['records']).encode()).hexdigest()[0:6],
+                      "Info: something wrong with redcords ! Not sure what to do !",
+                      records=str(import_response['records']))
+
+    def _handle_rejected_batch(self, batch, err_msg):
+        if len(batch) == 1:
+            (error_label, record, context, (time_label, record_id)) = batch[0]
+            if record_id:
+                context = dict(context, record_id=record_id)
+            slog.info(error_label, "UPLOAD ERROR: {}".format(_get_error_text(err_msg)), record, **context)
+            return
+
+        # REDCap rejects the whole batch if a single record is invalid - report
+        # the records named in the error message and upload the others again
+        rejected = _match_error_lines(batch, _get_error_text(err_msg), self.record_id_field)
+        if rejected:
+            # import them on their own, so that they are reported like any other failed import
+            for pos in sorted(rejected):
+                self._upload([batch[pos]])
+
+            remaining = [entry for pos, entry in enumerate(batch) if pos not in rejected]
+            if remaining:
+                self._upload(remaining)
+            return
+
+        # Could not tell which record caused the error - bisect the batch
+        if self.verbose:
+            print("Upload of", len(batch), "records was rejected - splitting batch")
+
+        middle = len(batch) // 2
+        self._upload(batch[:middle])
+        self._upload(batch[middle:])
+
+
+def _sanitize_record(record):
+    # REDCap cannot parse NaN or numpy types in JSON imports
+    result = dict()
+    for (key, value) in record.items():
+        if hasattr(value, 'item'):
+            value = value.item()
+        if isinstance(value, float) and math.isnan(value):
+            value = ''
+        result[key] = value
+
+    return result
+
+
+def _get_error_text(err_msg):
+    # PyCap raises the REDCap response as exception text, e.g. {"error": "..."}
+    try:
+        return str(ast.literal_eval(str(err_msg))['error'])
+    except Exception:
+        return str(err_msg)
+
+
+def _match_error_lines(batch, error_text, record_id_field):
+    # Validation errors list one offending value per line, e.g.
+    # "A-00000-F-1 (baseline_visit_arm_1)","field","value","message"
+    rejected = dict()
+    for error_line in error_text.split('\n'):
+        error_list = [field.strip().strip('"') for field in error_line.split(',')]
+        match = re.match(r'^(\S+)(?:\s+\((\S+)\))?$', error_list[0])
+        if not match:
+            continue
+
+        (record_id, event_name) = match.groups()
+        for pos, (error_label, record, context, options) in enumerate(batch):
+            if str(record.get(record_id_field)) != record_id:
+                continue
+            if event_name and record.get('redcap_event_name') != event_name:
+                continue
+            rejected.setdefault(pos, []).append(error_line)
+
+    return rejected
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+##
+##  See COPYING file distributed along with the ncanda-data-integration package
+##  for the copyright and license terms
+##
+
+import os
+import shutil
+import tempfile
+from lxml import etree
+
+#
+# Voxel-size transforms applied when exporting series to the pipeline
+#
+# Maps the voxel resolution (x, y, z) of a scan in XNAT to the downsampling
+# factors (x, y, z) used by 'cmtk convertx --downsample-average'. SRI acquired
+# high-resolution DTI, which is resampled to the resolution of the other sites.
+#
+DTI_RESAMPLE_TRANSFORMS = {
+    (0.9375, 0.9375, 2.5): (2, 2, 1),
+}
+
+#
+# Image size (Columns, Rows) of the scans with these voxel resolutions. Only
+# sidecar elements holding the original size or voxel spacing are rewritten.
+#
+DTI_RESAMPLE_MATRIX_SIZES = {
+    (0.9375, 0.9375, 2.5): (256, 256),
+}
+
+def get_resample_factors(voxel_res, transforms=DTI_RESAMPLE_TRANSFORMS):
+    try:
+        return transforms.get(tuple(float(res) for res in voxel_res))
+    except (TypeError, ValueError):
+        return None
+
+def _format_spacing(value):
+    return '%g' % value
+
+def _same_spacing(text, spacing):
+    try:
+        values = [float(value) for value in text.split('\\')]
+    except ValueError:
+        return False
+    return len(values) == len(spacing) and all(abs(a - b) < 1e-6 for (a, b) in zip(values, spacing))
+
+#
+# Rewrite the in-plane geometry (PixelSpacing, Columns, Rows) of a dcm2image
+# XML sidecar of a scan with the given voxel resolution (x, y, z) for the
+# downsampled image. Everything else, including comments and namespace
+# prefixes, is kept as it is.
+#
+# The result is written to a temporary file next to to_path and then renamed,
+# so readers never see a partially written sidecar.
+#
+def rewrite_sidecar(from_path, to_path, voxel_res, transforms=DTI_RESAMPLE_TRANSFORMS,
+                    matrix_sizes=DTI_RESAMPLE_MATRIX_SIZES):
+    voxel_res = tuple(float(res) for res in voxel_res)
+    (factor_x, factor_y) = transforms[voxel_res][0:2]
+    (columns, rows) = matrix_sizes[voxel_res]
+
+    # DICOM order is row spacing (y) \ column spacing (x)
+    spacing = (voxel_res[1], voxel_res[0])
+    new_spacing = '\\'.join([_format_spacing(voxel_res[1] * factor_y), _format_spacing(voxel_res[0] * factor_x)])
+
+    tree = etree.parse(from_path)
+    for element in tree.iter(etree.Element):
+        name = etree.QName(element).localname
+        text = (element.text or '').strip()
+        if name == 'PixelSpacing' and _same_spacing(text, spacing):
+            element.text = new_spacing
+        elif name == 'Columns' and text == str(columns):
+            element.text = str(columns // factor_x)
+        elif name == 'Rows' and text == str(rows):
+            element.text = str(rows // factor_y)
+
+    (fd, tmp_path) = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(to_path)), suffix='.xml.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as tmp_file:
+            tree.write(tmp_file, encoding=tree.docinfo.encoding or 'utf-8', xml_declaration=True)
+        shutil.copymode(from_path, tmp_path)
+        os.replace(tmp_path, to_path)
+    except:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
@@ -13,6 +13,7 @@ TODO: Reflect exceptions set in special_cases.yml::outside_visit_window and
 """
 
 import argparse
+import datetime
 import os
 import pandas as pd
 import sys
@@ -22,6 +23,7 @@ from sibispy import sibislogger as slog
 import json
 import yaml
 from typing import Sequence, List, Dict, Tuple
+from redcap_snapshot import RedcapSnapshot
 
 def parse_args(arg_input=None):
     parser = argparse.ArgumentParser(
@@ -65,6 +67,17 @@ def parse_args(arg_input=None):
         help="Skip generating REDCap form URLs (useful if DB backing URL lookup is unavailable).",
         action="store_true",
     )   
+    parser.add_argument(
+        "--snapshot-dir",
+        help="Read the date fields from the local REDCap snapshots in this directory "
+        "(see update_redcap_snapshots) instead of exporting them from REDCap.",
+        default=None)
+    parser.add_argument(
+        "--max-snapshot-age",
+        help="Export from REDCap instead if the snapshot was last refreshed more "
+        "than this many hours ago.",
+        default=24,
+        type=float)
     output = parser.add_mutually_exclusive_group()
     output.add_argument(
         '-o', '--output',
@@ -106,16 +119,26 @@ def get_form_lookup_for_vars(varnames, metadata):
     return metadata.loc[varnames, 'form_name'].to_dict()
 
 
-def retrieve_date_data(api, fields, events=None, records=None):
+def retrieve_date_data(api, fields, events=None, records=None, snapshot_dir=None,
+                       max_snapshot_age=24):
     # output should have pandas.Datetime dtype
-    data = api.export_records(fields=fields, events=events, records=records,
-                              export_data_access_groups=True,
-                              format_type='df',
-                              df_kwargs={
-                                  'index_col': [api.def_field, 'redcap_event_name'],
-                                  'dtype': object,
-                                  'parse_dates': fields,
-                              })
+    kwargs = dict(fields=fields, events=events, records=records,
+                  export_data_access_groups=True,
+                  format_type='df',
+                  df_kwargs={
+                      'index_col': [api.def_field, 'redcap_event_name'],
+                      'dtype': object,
+                      'parse_dates': fields,
+                  })
+    if snapshot_dir:
+        try:
+            snapshot = RedcapSnapshot(api, os.path.join(snapshot_dir, 'data_entry'),
+                                      max_age=datetime.timedelta(hours=max_snapshot_age))
+            return snapshot.export_records(**kwargs)
+        except (ValueError, ImportError) as err:
+            print("Warning: cannot use REDCap snapshot in %s (%s) - exporting from REDCap"
+                  % (snapshot_dir, err))
+    data = api.export_records(**kwargs)
     return data
 
 
@@ -255,7 +278,9 @@ def main(api, args):
     meta = api.export_metadata(format_type='df')
     lookup = get_form_lookup_for_vars(datevars, meta)
     data = retrieve_date_data(api, fields=datevars, events=events,
-                              records=args.subjects)
+                              records=args.subjects,
+                              snapshot_dir=args.snapshot_dir,
+                              max_snapshot_age=args.max_snapshot_age)
     marks = mark_lagging_dates(data, comparison_date_var,
                                days_duration=args.max_days_after_visit)
 
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+
+##
+##  See COPYING file distributed along with the ncanda-data-integration package
+##  for the copyright and license terms
+##
+
+import json
+import sqlite3
+import threading
+
+#
+# Memoizing cache for the resource, file, and scan listings of XNAT experiments
+#
+# The MR import helpers (import_mr_sessions, export_mr_sessions_pipeline) all
+# list the resources and files of the same experiments - with the cache each
+# listing is fetched once per run. If the experiment's LAST_MODIFIED is known
+# the listings can also be kept in a SQLite file between runs; a persisted
+# listing is only used if the experiment did not change since it was fetched.
+#
+class XnatListingCache(object):
+    def __init__(self, xnat, cache_file=None):
+        self.xnat = xnat
+        self.hits = 0
+        self.misses = 0
+        self._last_modified = dict()
+        self._listings = dict()
+        self._lock = threading.Lock()
+        self._thread_xnat = threading.local()
+        self._db = None
+        if cache_file:
+            self._db = sqlite3.connect(cache_file, check_same_thread=False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS listing (uri TEXT PRIMARY KEY, eid TEXT, last_modified TEXT, data TEXT)')
+            self._db.commit()
+
+    def __str__(self):
+        return "XNAT listing cache: %d hits, %d misses" % (self.hits, self.misses)
+
+    def set_last_modified(self, eid, last_modified):
+        with self._lock:
+            if self._last_modified.get(eid) != last_modified:
+                self._last_modified[eid] = last_modified
+                self._listings = dict((uri, entry) for (uri, entry) in self._listings.items() if entry[0] != eid)
+
+    def invalidate(self, eid):
+        with self._lock:
+            self._listings = dict((uri, entry) for (uri, entry) in self._listings.items() if entry[0] != eid)
+            if self._db:
+                self._db.execute('DELETE FROM listing WHERE eid = ?', (eid,))
+                self._db.commit()
+
+    def get_resources(self, eid):
+        return self._get_json(eid, '/data/experiments/%s/resources/' % eid)
+
+    def get_files(self, eid, resource_id):
+        return self._get_json(eid, '/data/experiments/%s/resources/%s/files' % (eid, resource_id))
+
+    def get_scans(self, eid):
+        return self._get_json(eid, '/data/experiments/%s/scans' % eid)
+
+    # Fetch the listings of the calling thread through xnat - pyxnat interfaces
+    # cannot be shared between threads. get_listing_cache(xnat) then also
+    # returns this cache, so that all threads share the listings.
+    def use_in_thread(self, xnat):
+        self._thread_xnat.xnat = xnat
+        _listing_caches[id(xnat)] = self
+
+    def close(self):
+        if self._db:
+            self._db.close()
+            self._db = None
+
+    def _get_json(self, eid, uri):
+        with self._lock:
+            last_modified = self._last_modified.get(eid)
+            entry = self._listings.get(uri)
+            if entry:
+                self.hits += 1
+                return entry[2]
+
+            # Persisted listings can only be trusted if we know the experiment did not change
+            if self._db and last_modified:
+                row = self._db.execute('SELECT data FROM listing WHERE uri = ? AND last_modified = ?', (uri, last_modified)).fetchone()
+                if row:
+                    data = json.loads(row[0])
+                    self._listings[uri] = (eid, last_modified, data)
+                    self.hits += 1
+                    return data
+
+            self.misses += 1
+
+        # Fetch outside the lock so that workers can list different experiments concurrently
+        data = getattr(self._thread_xnat, 'xnat', self.xnat)._get_json(uri)
+        if data is None:
+            return data
+
+        with self._lock:
+            self._listings[uri] = (eid, last_modified, data)
+            if self._db and last_modified:
+                self._db.execute('INSERT OR REPLACE INTO listing (uri, eid, last_modified, data) VALUES (?, ?, ?, ?)', (uri, eid, last_modified, json.dumps(data)))
+                self._db.commit()
+
+        return data
+
+
+# One cache per XNAT interface, so that helpers in different modules share it
+_listing_caches = dict()
+
+def get_listing_cache(xnat, cache_file=None):
+    cache = _listing_caches.get(id(xnat))
+    if cache is None:
+        cache = XnatListingCache(xnat, cache_file=cache_file)
+        _listing_caches[id(xnat)] = cache
+
+    return cache
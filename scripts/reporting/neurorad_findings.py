@@ -153,7 +153,13 @@ def main(args=None):
 
     # Update the cache of XNAT Experiment XML files
     if args.update:
-        xe.extract_experiment_xml(session,args.experimentsdir, args.num_extract)
+        if args.sync:
+            if not session.connect_server('xnat', True):
+                print("Error: could not connect to xnat server!")
+                sys.exit()
+            xe.sync_experiment_xml(session, args.experimentsdir, args.num_extract, jobs=args.jobs)
+        else:
+            xe.extract_experiment_xml(session,args.experimentsdir, args.num_extract)
 
     # extract info from the experiment XML files
     experiment = xe.get_experiments_dir_info(args.experimentsdir)
@@ -285,6 +291,16 @@ if __name__ == "__main__":
     parser.add_argument('-u', '--update',
                         action='store_true',
                         help='Update the cache of xml files')
+    parser.add_argument('--sync',
+                        action='store_true',
+                        help='With -u, only download the xml files of '
+                             'experiments that were added or modified since '
+                             'the last update')
+    parser.add_argument('-j', '--jobs',
+                        type=int,
+                        default=1,
+                        help='Number of xml files to download concurrently '
+                             '(only works in connection with --sync)')
     parser.add_argument('-v', '--verbose',
                         action='store_true',
                         help='Print verbose output.')
@@ -13,18 +13,42 @@ from __future__ import print_function
 import os
 import glob
 import json
+import queue
 import tempfile
+import concurrent.futures
 
 import requests
 import pandas as pd
 from lxml import etree
 
+import sibispy
+
 # Verbose setting for cli
 verbose = None
 
 # Define global namespace for parsing XNAT XML files
 ns = {'xnat': 'http://nrg.wustl.edu/xnat'}
 
+# LAST_MODIFIED of the downloaded experiments (hidden, so the directory
+# listings only return the XML files)
+manifest_filename = '.manifest.json'
+
+
+def get_default_file_mode():
+    """
+    Mode that open() gives new files (the umask can only be read by setting it)
+
+    :return: int
+    """
+    umask = os.umask(0o022)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+# Read once, before any download threads start - the umask belongs to the
+# whole process
+default_file_mode = get_default_file_mode()
+
 def write_experiments(session):
     """
     Write out a csv file representing all the experiments in the given XNAT
@@ -78,16 +102,167 @@ def extract_experiment_xml(session, experiment_dir, extract=None):
         experiment = session.xnat_http_get_experiment_xml(experiment_id)
         experiment_file = os.path.join(outdir, '{0}.xml'.format(experiment_id))
         experiment_files.append(experiment_file)
-        with open(experiment_file, 'w') as fi:
-            fi.flush()
-            fi.write(experiment.text)
-            fi.close()
+        write_file_atomic(experiment_file, experiment.text)
         if verbose:
             num = idx + 1
             print("Writing XML file {0} of {1} to: {2}".format(num, extract, experiment_file))
     return experiment_files
 
 
+def sync_experiment_xml(session, experiment_dir, extract=None, jobs=1):
+    """
+    Bring the XML files in the experiment directory up to date, downloading
+    only the experiments that are new or were modified since they were last
+    written.
+
+    The LAST_MODIFIED value of each downloaded experiment is kept in a
+    manifest in the experiment directory. Experiments that XNAT reports
+    without a LAST_MODIFIED value are downloaded on every run. The XML files
+    are downloaded by up to `jobs` sessions concurrently; the session has to
+    be connected to both 'xnat' and 'xnat_http'.
+
+    :param session: sibispy.Session
+    :param experiment_dir: str
+    :param extract: int
+    :param jobs: int
+    :return: list
+    """
+    experiments_file = write_experiments(session)
+    outdir = os.path.abspath(experiment_dir)
+    if not os.path.exists(outdir):
+        os.mkdir(outdir)
+    experiment_ids = pd.read_csv(experiments_file).ID[:extract].tolist()
+    last_modified = get_experiments_last_modified(session)
+
+    # Drop files of experiments that are no longer listed
+    manifest = read_manifest(outdir)
+    listed = set(experiment_ids)
+    for experiment_file in glob.glob(os.path.join(outdir, '*.xml')):
+        experiment_id = os.path.basename(experiment_file)[:-len('.xml')]
+        if experiment_id not in listed:
+            os.remove(experiment_file)
+            manifest.pop(experiment_id, None)
+
+    changed_ids = [experiment_id for experiment_id in experiment_ids
+                   if not last_modified.get(experiment_id)
+                   or manifest.get(experiment_id) != last_modified.get(experiment_id)
+                   or not os.path.exists(os.path.join(outdir, '{0}.xml'.format(experiment_id)))]
+    if verbose:
+        print("Downloading XML files of {0} of {1} experiments".format(len(changed_ids), len(experiment_ids)))
+
+    sessions = queue.Queue()
+    sessions.put(session)
+    for idx in range(1, min(jobs, len(changed_ids))):
+        http_session = connect_http_session()
+        if not http_session:
+            break
+        sessions.put(http_session)
+
+    def download(experiment_id):
+        http_session = sessions.get()
+        try:
+            experiment = http_session.xnat_http_get_experiment_xml(experiment_id)
+        except Exception as err:
+            # e.g. a connection error - keep the previous file and retry on the next run
+            print("ERROR: Failed to download XML of experiment", experiment_id, "-", err)
+            return False
+        finally:
+            sessions.put(http_session)
+
+        if experiment is None or not experiment.ok:
+            print("ERROR: Failed to download XML of experiment", experiment_id)
+            return False
+
+        experiment_file = os.path.join(outdir, '{0}.xml'.format(experiment_id))
+        write_file_atomic(experiment_file, experiment.text)
+        if verbose:
+            print("Writing XML file to: {0}".format(experiment_file))
+        return True
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=sessions.qsize()) as executor:
+            for experiment_id, downloaded in zip(changed_ids, executor.map(download, changed_ids)):
+                if downloaded:
+                    manifest[experiment_id] = last_modified.get(experiment_id)
+    finally:
+        # Keep what was downloaded, also if the run was interrupted
+        write_manifest(outdir, manifest)
+
+    return [os.path.join(outdir, '{0}.xml'.format(experiment_id)) for experiment_id in experiment_ids
+            if os.path.exists(os.path.join(outdir, '{0}.xml'.format(experiment_id)))]
+
+
+def get_experiments_last_modified(session):
+    """
+    Get the LAST_MODIFIED value of all MR sessions in XNAT
+
+    :param session: sibispy.Session
+    :return: dict
+    """
+    last_modified_list = session.xnat_export_general('xnat:mrSessionData',
+                                                     ['xnat:mrSessionData/SESSION_ID',
+                                                      'xnat:mrSessionData/LAST_MODIFIED'],
+                                                     [('xnat:mrSessionData/SESSION_ID', 'LIKE', '%')],
+                                                     "session_last_modified")
+    return dict((experiment_id, last_modified) for (experiment_id, last_modified) in (last_modified_list or []))
+
+
+def connect_http_session():
+    """
+    Open another session to the XNAT server for concurrent downloads
+
+    :return: sibispy.Session
+    """
+    session = sibispy.Session()
+    if not session.configure() or not session.connect_server('xnat_http', True):
+        print("Warning: could not open another connection to the xnat server")
+        return None
+    return session
+
+
+def read_manifest(experiment_dir):
+    """
+    Read the LAST_MODIFIED values of the experiment XML files on disk
+
+    :param experiment_dir: str
+    :return: dict
+    """
+    manifest_file = os.path.join(experiment_dir, manifest_filename)
+    if not os.path.exists(manifest_file):
+        return dict()
+    try:
+        with open(manifest_file) as fi:
+            return json.load(fi)
+    except ValueError:
+        print("Warning: ignoring unreadable manifest", manifest_file)
+        return dict()
+
+
+def write_manifest(experiment_dir, manifest):
+    write_file_atomic(os.path.join(experiment_dir, manifest_filename),
+                      json.dumps(manifest, indent=1, sort_keys=True))
+
+
+def write_file_atomic(filename, text, mode=default_file_mode):
+    """
+    Write a file via a temporary file in the same directory, so that readers
+    never see a partially written file
+
+    :param filename: str
+    :param text: str
+    :param mode: int (mkstemp only lets the owner read the file)
+    """
+    (fd, temp_filename) = tempfile.mkstemp(dir=os.path.dirname(filename), prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as fi:
+            fi.write(text)
+        os.chmod(temp_filename, mode)
+        os.replace(temp_filename, filename)
+    except:
+        os.remove(temp_filename)
+        raise
+
+
 def parse_xml_file(experiment_xml_file): 
     try : 
         return etree.parse(experiment_xml_file)
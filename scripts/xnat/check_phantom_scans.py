@@ -21,6 +21,7 @@ import sibispy
 from sibispy import sibislogger as slog
 from sibispy import sibis_email, xnat_util
 from settings import XNAT_DATE_FORMAT
+from phantom_index import PhantomIndex
 
 
 #
@@ -36,7 +37,72 @@ map_project_to_site ={
      "ohsu_incoming": "D",
      "ucsd_incoming": "E"
 }
-    
+
+# Experiment ids as stored in the list of unresolved sessions, e.g. NCANDA_E00067
+EID_PATTERN = r"^[A-Za-z0-9]+_E[0-9]+$"
+
+
+# Parse the comma-separated list of experiments that were still missing a
+# phantom during the last run (other entries, e.g. the time of the run, are
+# skipped)
+def parse_unresolved_eids(contents):
+    if not contents:
+        return set()
+
+    return set(
+        eid.strip()
+        for eid in contents.split(",")
+        if re.match(EID_PATTERN, eid.strip())
+    )
+
+
+# Get the ids of all MR sessions modified since the given date (struct_time)
+def get_modified_session_ids(ifc, date_last_checked):
+    criteria = [
+        (
+            "xnat:mrSessionData/LAST_MODIFIED",
+            ">=",
+            time.strftime(XNAT_DATE_FORMAT, date_last_checked),
+        )
+    ]
+    sessions = ifc.search(
+        "xnat:mrSessionData", ["xnat:mrSessionData/SESSION_ID"]
+    ).where(criteria)
+    return [session[0] for session in sessions.items()]
+
+
+# Load all ADNI and fBIRN phantom sessions into a PhantomIndex - two XNAT
+# searches instead of one per checked session
+def load_phantom_index(ifc):
+    phantom_ids = []
+    for phantom_label in ["%-99999-P-9", "%-00000-P-0"]:
+        criteria = [("xnat:subjectData/SUBJECT_LABEL", "LIKE", phantom_label)]
+        phantom_ids += ifc.search(
+            "xnat:subjectData", ["xnat:subjectData/SUBJECT_ID"]
+        ).where(criteria).get("subject_id", always_list=True)
+
+    if not phantom_ids:
+        return PhantomIndex([])
+
+    criteria = [
+        ("xnat:mrSessionData/SUBJECT_ID", "LIKE", phantom_id)
+        for phantom_id in phantom_ids
+    ]
+    if len(criteria) > 1:
+        criteria.append("OR")
+
+    phantom_sessions = ifc.search(
+        "xnat:mrSessionData",
+        [
+            "xnat:mrSessionData/SUBJECT_ID",
+            "xnat:mrSessionData/SESSION_ID",
+            "xnat:mrSessionData/DATE",
+            "xnat:mrSessionData/TIME",
+        ],
+    ).where(criteria)
+    return PhantomIndex(phantom_sessions.items())
+
+
 # Find a phantom scan within 24h of the given experiment
 def find_phantom_scan_24h(
     prj,
@@ -50,6 +116,7 @@ def find_phantom_scan_24h(
     scanner,
     args,
     email,
+    phantom_index=None,
 ):
     # Compute the date before and after the experiment date
     today = datetime.datetime.today()
@@ -62,58 +129,63 @@ def find_phantom_scan_24h(
         "%Y-%m-%d"
     )
                     
-    # Simple approach: search only on dates (meaning we might accidentally pick
-    # something that's N days + M hours later):
-    # constraints = [('xnat:mrSessionData/SUBJECT_ID', 'LIKE', phantom_id), 'AND',
-    #                [('xnat:mrSessionData/DATE', '>=', edate_yesterday),
-    #                 ('xnat:mrSessionData/DATE', '<=', edate_tomorrow),
-    #                 'AND']]
-
-    # Full approach:
-    # eligible phantom happens *either*
-    # - ON the upper/lower bound dates, at which point time matters, OR
-    # - BETWEEN lower and upped bound dates, in which case we just need DATE to
-    #   be greater than lower bound and smaller than upper bound.
-    constraints = [
-        ("xnat:mrSessionData/SUBJECT_ID", "LIKE", phantom_id),
-        "AND",
-        [
+    if phantom_index is not None:
+        phantom_scans = phantom_index.find_sessions(
+            phantom_id, edate, etime, PHANTOM_DAY_LIMIT
+        )
+    else:
+        # Simple approach: search only on dates (meaning we might accidentally pick
+        # something that's N days + M hours later):
+        # constraints = [('xnat:mrSessionData/SUBJECT_ID', 'LIKE', phantom_id), 'AND',
+        #                [('xnat:mrSessionData/DATE', '>=', edate_yesterday),
+        #                 ('xnat:mrSessionData/DATE', '<=', edate_tomorrow),
+        #                 'AND']]
+
+        # Full approach:
+        # eligible phantom happens *either*
+        # - ON the upper/lower bound dates, at which point time matters, OR
+        # - BETWEEN lower and upped bound dates, in which case we just need DATE to
+        #   be greater than lower bound and smaller than upper bound.
+        constraints = [
+            ("xnat:mrSessionData/SUBJECT_ID", "LIKE", phantom_id),
+            "AND",
             [
                 [
-                    ("xnat:mrSessionData/DATE", "=", edate_yesterday),
-                    ("xnat:mrSessionData/TIME", ">=", etime),
-                    "AND",
+                    [
+                        ("xnat:mrSessionData/DATE", "=", edate_yesterday),
+                        ("xnat:mrSessionData/TIME", ">=", etime),
+                        "AND",
+                    ],
+                    [
+                        ("xnat:mrSessionData/DATE", "=", edate_tomorrow),
+                        ("xnat:mrSessionData/TIME", "<=", etime),
+                        "AND",
+                    ],
+                    "OR",
                 ],
                 [
-                    ("xnat:mrSessionData/DATE", "=", edate_tomorrow),
-                    ("xnat:mrSessionData/TIME", "<=", etime),
-                    "AND",
+                    [
+                        ("xnat:mrSessionData/DATE", ">", edate_yesterday),
+                        ("xnat:mrSessionData/DATE", "<", edate_tomorrow),
+                        "AND",
+                    ]
                 ],
                 "OR",
             ],
-            [
-                [
-                    ("xnat:mrSessionData/DATE", ">", edate_yesterday),
-                    ("xnat:mrSessionData/DATE", "<", edate_tomorrow),
-                    "AND",
-                ]
-            ],
-            "OR",
-        ],
-    ]
+        ]
 
-    phantom_scans = list(
-        ifc.search(
-            "xnat:mrSessionData",
-            [
-                "xnat:mrSessionData/SESSION_ID",
-                "xnat:mrSessionData/DATE",
-                "xnat:mrSessionData/TIME",
-            ],
+        phantom_scans = list(
+            ifc.search(
+                "xnat:mrSessionData",
+                [
+                    "xnat:mrSessionData/SESSION_ID",
+                    "xnat:mrSessionData/DATE",
+                    "xnat:mrSessionData/TIME",
+                ],
+            )
+            .where(constraints)
+            .items()
         )
-        .where(constraints)
-        .items()
-    )
 
     # Still haven't found anything - then there is no phantom scan
     if (len(phantom_scans) == 0) and (today_str >= edate_tomorrow):
@@ -180,9 +252,13 @@ def find_phantom_scan_24h(
             )
         )
 
+    return len(phantom_scans) > 0
+
 
 # Check one experiment for matching phantom scans
-def check_experiment(session, ifc, sibis_config, args, email, eid, xnat_url, experiment):
+# Returns False if the experiment is still missing a phantom (or could not be
+# checked), so that it is checked again during the next run
+def check_experiment(session, ifc, sibis_config, args, email, eid, xnat_url, experiment, phantom_index=None):
     expUtil = xnat_util.XNATSessionElementUtil(experiment)
     try:
         experiment_last_modified = expUtil.get("last_modified")
@@ -289,8 +365,11 @@ def check_experiment(session, ifc, sibis_config, args, email, eid, xnat_url, exp
                     xnat_url=xnat_url,
                     project=prj,
                 )
+                # Reported - checking it again would only report it again (a
+                # modified session is checked anyway)
+                return True
             elif len(phantom_scans) == 0:
-                find_phantom_scan_24h(
+                return find_phantom_scan_24h(
                     prj,
                     experiment_label,
                     seid,
@@ -302,6 +381,7 @@ def check_experiment(session, ifc, sibis_config, args, email, eid, xnat_url, exp
                     scanner,
                     args,
                     email,
+                    phantom_index,
                 )
         except IndexError as e:
             error = "ERROR: Subject likely switched sites if site_id > NCANDA_S01010"
@@ -315,6 +395,9 @@ def check_experiment(session, ifc, sibis_config, args, email, eid, xnat_url, exp
                 info="Most likely entry missing for this visit in section 'check_phantom_scans' of file 'special_cases.yml'",
                 error_msg=str(e),
             )
+            return False
+
+    return True
 
             # changed_sites_phantom=str(changed_sites_phantom),
 
@@ -338,7 +421,9 @@ def _parse_args(input_args: Sequence[str] = None) -> argparse.Namespace:
         action="store_true",
         dest="check_all",
         default=False,
-        help="Check all sessions, regardless of modification date.",
+        help="Check all sessions, regardless of modification date. By default "
+        "only sessions modified since the last run and sessions that were still "
+        "missing a phantom scan are checked.",
     )
     parser.add_argument(
         "-w",
@@ -436,13 +521,17 @@ if __name__ == "__main__":
     # Set up email object to contact users and admin
     email = sibis_email.xnat_email(session)
 
-    # Date (and time) when we last checked things
+    # Date (and time) when we last checked things and the sessions that were
+    # still missing a phantom at that time
     date_last_checked = time.localtime(0)
+    unresolved_eids = set()
     config_uri = "/data/config/pyxnat/check_phantom_scans"
     try:
         content = ifc._exec(config_uri, format="json")
-        creation_date = json.loads(content)["ResultSet"]["Result"][0]["create_date"]
+        config = json.loads(content)["ResultSet"]["Result"][0]
+        creation_date = config["create_date"]
         date_last_checked = time.strptime(creation_date[0:19], XNAT_DATE_FORMAT)
+        unresolved_eids = parse_unresolved_eids(config.get("contents"))
         if args.verbose:
             print(
                 "Last checked on: {0}".format(
@@ -457,10 +546,26 @@ if __name__ == "__main__":
 
     if args.eid:
         experiment_ids.append(args.eid)
-    else:
+    elif args.check_all:
         # Get a list of all MR imaging sessions
         experiment_ids = list(ifc.select.experiments.keys())
+    else:
+        # Sessions modified since the last run plus those that were still
+        # missing a phantom scan
+        experiment_ids = get_modified_session_ids(ifc, date_last_checked)
+        experiment_ids += sorted(unresolved_eids.difference(experiment_ids))
+        if args.verbose:
+            print(
+                "Checking {0} sessions ({1} unresolved from last run)".format(
+                    len(experiment_ids), len(unresolved_eids)
+                )
+            )
+
+    # Phantom sessions for the search within PHANTOM_DAY_LIMIT days
+    phantom_index = load_phantom_index(ifc)
 
+    # Sessions that need to be checked again during the next run
+    experiments_for_next_run = list()
     for eid in experiment_ids:
         xnat_url = session.get_xnat_session_address(eid, 'html')
         # For each experiment, see if the override variable is set. Otherwise check it
@@ -480,28 +585,44 @@ if __name__ == "__main__":
         # Do not change to True ! as xnat saves it as 'true'
         if experiment.fields.get("phantommissingoverride") != "true":
             count_phantom += 1
-            check_experiment(session, ifc, sibis_config, args, email, eid, xnat_url, experiment)
+            if not check_experiment(session, ifc, sibis_config, args, email, eid, xnat_url, experiment, phantom_index):
+                experiments_for_next_run.append(eid)
 
     if args.sendmail:
         email.send_all(ifc)
 
-    uri_addr = "%s?inbody=true" % config_uri
-    try:
-        with sibispy.session.Capturing() as xnat_output:
-            content = ifc._exec(
-                uri=uri_addr,
-                method="PUT",
-                body=now_str,
-                headers={"content-type": "text/plain"},
+    # Store the sessions to check again - the create_date of the config is the
+    # date of this run. Checking a single session does not update the config,
+    # as it would drop the sessions modified since the last run.
+    if not args.eid:
+        uri_addr = "%s?inbody=true" % config_uri
+        # Written in one request, so that the list is never lost halfway. The
+        # time of the run ensures that the stored value changes, so that
+        # create_date is always updated.
+        body = ",".join([now_str] + sorted(set(experiments_for_next_run)))
+        xnat_output = []
+        try:
+            with sibispy.session.Capturing() as xnat_output:
+                content = ifc._exec(
+                    uri=uri_addr,
+                    method="PUT",
+                    body=body,
+                    headers={"content-type": "text/plain"},
+                )
+        except Exception as e:
+            slog.info(
+                "check_phantom_scans",
+                "Warning: failed to update XNAT server location " + uri_addr,
+                error_msg=str(e),
+                xnat_api_output=xnat_output,
+            )
+
+        if args.verbose:
+            print(
+                "Flagging {} sessions for re-check during next script run".format(
+                    len(set(experiments_for_next_run))
+                )
             )
-    except Exception as e:
-        slog.info(
-            eid,
-            "Warning: failed to update XNAT server location " + uri_addr,
-            error_msg=str(e),
-            xnat_url=xnat_url,
-            xnat_api_output=xnat_output,
-        )
 
     slog.takeTimer1(
         "script_time", "{'TotalCheckedPhantoms': " + str(count_phantom) + "}"
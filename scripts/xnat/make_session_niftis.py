@@ -26,19 +26,26 @@ from sibispy.xnat_util import XNATSessionElementUtil, XNATResourceUtil, XNATExpe
 # Export experiment files to NIFTI
 # Note only checks ones scanPtr as t2w only has one ! 
 def dcm2niftiWithCheck(dcmDirList, niftiPrefix, project,eid, scanPtr, logFileFlag=False,verbose=False):
-    numDCMFiles=0
     #temp_dir = tempfile.mkdtemp()
     # niftiPrefix='%s/%s_%s/image' %(temp_dir, scan, scantype)
     # print("dcm2nifti:",dcmDirList, niftiPrefix, project,eid, scanPtr,verbose)
+    numDCMFiles=get_num_dcm_files(project, eid, scanPtr, verbose)
+    return dcm2nifti(dcmDirList, str(niftiPrefix), numDCMFiles, logFileFlag,verbose)
+
+#
+# Number of dicom files to convert (0 = all) - only differs for SRI T2 scans which duplicate the slices
+#
+def get_num_dcm_files(project, eid, scanPtr, verbose=False):
+    numDCMFiles=0
     if project == "sri_incoming" :
         if scanPtr.type == "ncanda-t2fse-v1" and scanPtr.fulldata['data_fields']['parameters/voxelRes/z'] == 2.4 :
             # check if NCANDA0X  that means it comes after NCANDA_ ...
             if  eid > "NCANDA_E11968" or eid.split('_')[0] != "NCANDA" :
-                if verbose :
-                    print("INFO:only using half the dicom files in " + dcmDirList[0])
                 numDCMFiles=int(scanPtr.fulldata['children'][0]['items'][0]['data_fields']['file_count']/2)
+                if verbose :
+                    print("INFO:only using half the dicom files of " + eid)
 
-    return dcm2nifti(dcmDirList, str(niftiPrefix), numDCMFiles, logFileFlag,verbose)
+    return numDCMFiles
 
  
 def dcm2nifti(dcmDirList, niftiPrefix, numDCMFiles=0, logFileFlag=False,verbose=False):
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+
+##
+##  See COPYING file distributed along with the ncanda-data-integration package
+##  for the copyright and license terms
+##
+
+import bisect
+import datetime
+
+#
+# Per-phantom, datetime-sorted index over the phantom MR sessions in XNAT
+#
+# check_phantom_scans used to run one XNAT search per session to find a
+# phantom scan within PHANTOM_DAY_LIMIT days; with the index all phantom
+# sessions are loaded once and the window is looked up locally.
+#
+class PhantomIndex(object):
+    def __init__(self, phantom_sessions):
+        # phantom_sessions: (phantom subject id, session id, date, time)
+        by_subject = dict()
+        for (subject_id, session_id, date, time) in phantom_sessions:
+            by_subject.setdefault(subject_id, []).append((self._datetime(date, time), session_id))
+
+        self._datetimes = dict()
+        self._session_ids = dict()
+        for subject_id, entries in by_subject.items():
+            entries.sort()
+            self._datetimes[subject_id] = [entry[0] for entry in entries]
+            self._session_ids[subject_id] = [entry[1] for entry in entries]
+
+    @staticmethod
+    def _datetime(date, time):
+        # "YYYY-MM-DD HH:MM:SS" strings sort like the datetimes they represent
+        return "%s %s" % (date or '', time or '')
+
+    def find_sessions(self, phantom_id, edate, etime, day_limit):
+        """
+        Return the ids of the phantom sessions of phantom_id acquired within
+        day_limit days (same time of day) before or after edate etime.
+        """
+        datetimes = self._datetimes.get(phantom_id)
+        if not datetimes:
+            return []
+
+        this_date = datetime.datetime.strptime(edate, "%Y-%m-%d")
+        date_from = (this_date - datetime.timedelta(day_limit)).strftime("%Y-%m-%d")
+        date_to = (this_date + datetime.timedelta(day_limit)).strftime("%Y-%m-%d")
+
+        lo = bisect.bisect_left(datetimes, self._datetime(date_from, etime))
+        hi = bisect.bisect_right(datetimes, self._datetime(date_to, etime))
+        return self._session_ids[phantom_id][lo:hi]
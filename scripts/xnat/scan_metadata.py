@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+##
+##  See COPYING file distributed along with the ncanda-data-integration package
+##  for the copyright and license terms
+##
+
+import re
+import xml.etree.ElementTree as ET
+
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+#
+# Parsed XML of a single XNAT scan
+#
+# Values are addressed with the same paths as XNATSessionElementUtil.mget,
+# e.g. 'xnat:mrScanData/parameters/te' or 'frames'. The last path component
+# can also be an attribute, e.g. 'type' or 'parameters/voxelRes/x'.
+#
+class ScanMetadata(object):
+    def __init__(self, xml):
+        self.xml = xml
+        self._root = ET.fromstring(xml.encode('utf-8') if isinstance(xml, str) else xml)
+        self.type = self.get('type')
+        self.quality = self.get('quality')
+        self.frames = self.get('frames')
+        self.te = self.get('parameters/te')
+        self.fov = (self.get('parameters/fov/x'), self.get('parameters/fov/y'))
+        self.voxel_res = (self.get('parameters/voxelRes/x'), self.get('parameters/voxelRes/y'), self.get('parameters/voxelRes/z'))
+
+    def get(self, path):
+        names = path.split('/')
+        # drop the data type, e.g. 'xnat:mrScanData'
+        if ':' in names[0]:
+            names = names[1:]
+
+        element = self._root
+        for (idx, name) in enumerate(names):
+            child = None
+            for candidate in element:
+                if isinstance(candidate.tag, str) and _local_name(candidate.tag) == name:
+                    child = candidate
+                    break
+
+            if child is None:
+                if idx == len(names) - 1:
+                    for (key, value) in element.attrib.items():
+                        if _local_name(key) == name:
+                            return value
+                return None
+
+            element = child
+
+        if element.text is None:
+            return None
+        return element.text.strip()
+
+    def mget(self, paths):
+        return [self.get(path) for path in paths]
+
+    # The voxelRes attributes as written in the XML (x="..." y="..." z="...")
+    def voxel_res_string(self):
+        match = re.match(r".*<xnat:voxelRes (.*?)/>", self.xml, flags=re.DOTALL)
+        if match:
+            return re.sub(r"\s*<!--.*?-->\s*", "", match.group(1), flags=re.DOTALL)
+        return None
+
+
+#
+# Scan metadata of one session
+#
+# Each scan's XML is fetched once (via get_scan_xml(scan_id)) and shared by
+# all checks of the session instead of every check requesting it again.
+#
+class SessionScanMetadata(object):
+    def __init__(self, get_scan_xml):
+        self.get_scan_xml = get_scan_xml
+        self.requests = 0
+        self._scans = dict()
+
+    def get(self, scan):
+        metadata = self._scans.get(scan)
+        if metadata is None:
+            self.requests += 1
+            metadata = ScanMetadata(self.get_scan_xml(scan))
+            self._scans[scan] = metadata
+
+        return metadata
+
+    def mget(self, scan, paths):
+        return self.get(scan).mget(paths)
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+##
+##  See COPYING file distributed along with the ncanda-data-integration package
+##  for the copyright and license terms
+##
+
+from __future__ import print_function
+import os
+import sys
+import threading
+import concurrent.futures
+import pytest
+import requests
+import pandas as pd
+
+current_dir = os.path.dirname(__file__)
+sys.path.append(os.path.join(current_dir, '../../../scripts/import/laptops'))
+from batch_export import export_in_batches
+
+RECORDS = ['record-%03d' % idx for idx in range(25)]
+
+
+def test_failed_batches_are_retried_alone():
+    lock = threading.Lock()
+    calls = []
+
+    def export_batch(record_batch):
+        with lock:
+            calls.append(record_batch[0])
+            first_try = calls.count(record_batch[0]) == 1
+        # the batch starting at record-010 comes back empty, then raises, then succeeds
+        if record_batch[0] == 'record-010' and calls.count(record_batch[0]) < 3:
+            if first_try:
+                return pd.DataFrame()
+            raise requests.exceptions.ConnectionError("connection reset")
+        return pd.DataFrame({'value': record_batch}, index=record_batch)
+
+    exported, failed = export_in_batches(export_batch, RECORDS, batch_size=5, max_workers=3, backoff=0)
+    assert failed == []
+    assert exported.index.tolist() == RECORDS
+    assert sorted(calls) == sorted(RECORDS[::5] + ['record-010'] * 2)
+
+
+def test_batches_failing_after_max_tries_are_reported():
+    def export_batch(record_batch):
+        if 'record-021' in record_batch:
+            return None
+        return pd.DataFrame({'value': record_batch}, index=record_batch)
+
+    exported, failed = export_in_batches(export_batch, RECORDS, batch_size=10, max_tries=2, backoff=0)
+    assert failed == [RECORDS[20:]]
+    assert exported.index.tolist() == RECORDS[:20]
+
+
+def test_other_errors_are_not_retried():
+    calls = []
+
+    def export_batch(record_batch):
+        calls.append(record_batch[0])
+        if record_batch[0] == 'record-010':
+            raise KeyError('study_id')
+        return pd.DataFrame({'value': record_batch}, index=record_batch)
+
+    with pytest.raises(KeyError):
+        export_in_batches(export_batch, RECORDS, batch_size=5, max_workers=1, backoff=0)
+    assert calls.count('record-010') == 1
+
+
+def test_given_executor_is_kept():
+    def export_batch(record_batch):
+        return pd.DataFrame({'value': record_batch}, index=record_batch)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        for _ in range(2):
+            exported, failed = export_in_batches(export_batch, RECORDS, batch_size=5, executor=executor)
+            assert failed == []
+            assert exported.index.tolist() == RECORDS
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+##
+##  See COPYING file distributed along with the ncanda-data-integration package
+##  for the copyright and license terms
+##
+
+from __future__ import print_function
+import os
+import sys
+import random
+import datetime
+import numpy as np
+import pandas as pd
+
+current_dir = os.path.dirname(__file__)
+sys.path.append(os.path.join(current_dir, '../../../scripts/import/webcnp'))
+import cnp
+
+
+def make_imported_records(rng, subjects, records_per_subject):
+    rows = []
+    for subject in subjects:
+        for idx in range(records_per_subject):
+            date = datetime.date(2015, 1, 1) + datetime.timedelta(days=rng.randint(0, 900))
+            row = {'record_id': '%s-%s-%d' % (subject, date, idx),
+                   'test_sessions_subid': subject,
+                   'test_sessions_dotest': str(date)}
+            for field in cnp.mean_sdev_by_field_dict:
+                row[field] = '' if rng.random() < 0.2 else str(round(rng.uniform(0, 3000), 2))
+            rows.append(row)
+    rng.shuffle(rows)
+    return pd.DataFrame(rows).set_index('record_id')
+
+
+def test_match_visits_selects_records_in_window():
+    rng = random.Random(7)
+    subjects = ['A-%05d-F-1' % idx for idx in range(30)]
+    imported_records = make_imported_records(rng, subjects, 4)
+    visits = pd.DataFrame({'study_id': [subject for subject in subjects for visit in range(2)],
+                           'visit_date': [str(datetime.date(2015, 1, 1) + datetime.timedelta(days=rng.randint(0, 900)))
+                                          for subject in subjects for visit in range(2)]})
+
+    pairs = cnp.match_visits(visits, imported_records, 120)
+
+    # Same selection as the former per-visit filtering
+    for (visit, row) in visits.iterrows():
+        records_this_subject = imported_records[imported_records['test_sessions_subid'] == row['study_id']]
+        records_this_visit = records_this_subject[records_this_subject['test_sessions_dotest'] >= row['visit_date']]
+        visit_date_plus_n = (datetime.datetime.strptime(row['visit_date'], '%Y-%m-%d')
+                             + datetime.timedelta(120)).strftime('%Y-%m-%d')
+        records_this_visit = records_this_visit[records_this_visit['test_sessions_dotest'] <= visit_date_plus_n]
+
+        assert pairs[pairs['visit'] == visit]['record_id'].tolist() == records_this_visit.index.tolist()
+    assert pairs['visit'].is_monotonic_increasing
+
+
+def test_match_visits_without_visits_or_records():
+    rng = random.Random(7)
+    imported_records = make_imported_records(rng, ['A-00001-F-1'], 2)
+    visits = pd.DataFrame({'study_id': ['A-00001-F-1'], 'visit_date': ['2015-01-01']})
+
+    for pairs in [cnp.match_visits(visits.iloc[0:0], imported_records, 120),
+                  cnp.match_visits(visits, imported_records.iloc[0:0], 120)]:
+        assert pairs.empty
+        assert list(pairs.columns) == ['visit', 'record_id', 'order']
+        assert pairs.groupby('visit').tail(1)['visit'].values.tolist() == []
+
+
+def test_zscores_match_per_record_computation():
+    rng = random.Random(11)
+    cnp_data = make_imported_records(rng, ['A-%05d-F-1' % idx for idx in range(50)], 2)
+    ages = [rng.uniform(6, 24) for idx in range(len(cnp_data))] + [22.0, 8.0, np.nan]
+    cnp_data = pd.concat([cnp_data, cnp_data.iloc[:3]])
+
+    zscores = cnp.get_zscores(cnp_data, np.array(ages))
+
+    for (position, (record_id, record)) in enumerate(cnp_data.iterrows()):
+        age_in_years = ages[position]
+        for field in cnp.mean_sdev_by_field_dict:
+            expected = np.nan
+            if age_in_years >= 8 and age_in_years < 22 and record[field] != '':
+                age_group = int(age_in_years / 2) * 2
+                label = cnp.mean_sdev_by_field_dict[field]
+                age_mean = cnp.mean_sdev_byage_table['%s_mean' % label][age_group]
+                age_sdev = cnp.mean_sdev_byage_table['%s_sd' % label][age_group]
+                expected = (float(record[field]) - age_mean) / age_sdev
+
+            actual = zscores[field].iloc[position]
+            assert (np.isnan(expected) and np.isnan(actual)) or actual == expected
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+
+##
+##  See COPYING file distributed along with the ncanda-data-integration package
+##  for the copyright and license terms
+##
+
+from __future__ import print_function
+import os
+import sys
+import pytest
+import pandas as pd
+
+current_dir = os.path.dirname(__file__)
+sys.path.append(os.path.join(current_dir, '../../../scripts/import/laptops'))
+from convert_util import ConversionError
+from dd_converter import convert_dd
+
+ROWS = [
+    ['A-00001-F-1-1000', 'future', 'money', 'hyp', 'gain', 'x', 1000, 1, -2.5, 'v1', '3/4/2016'],
+    ['A-00001-F-1-1000', 'future', 'money', 'hyp', 'gain', 'x', 1000, 30, -1.5, 'v1', '3/4/2016'],
+    ['A-00001-F-1-1000', 'present', 'money', 'hyp', 'gain', 'x', 1000, 7, -9.0, 'v1', '3/4/2016'],
+]
+
+
+def write_dd_file(tmpdir, rows):
+    ddfile = tmpdir.mkdir('A-00001-F-1-20160304').join('V12.txt')
+    ddfile.write('\n'.join('\t'.join(str(value) for value in row) for row in rows) + '\n')
+    return str(ddfile)
+
+
+def test_convert_dd_writes_record_once(tmpdir):
+    ddfile = write_dd_file(tmpdir, ROWS)
+    outdir = str(tmpdir.join('deldisc'))
+
+    written_files = convert_dd(ddfile, outdir)
+    assert written_files == [os.path.join(outdir, 'A-00001-F-1-2016-03-04-1000.csv')]
+
+    data = pd.read_csv(written_files[0])
+    assert data['record_id'][0] == 'A-00001-F-1-2016-03-04'
+    assert data['dd1000_logk_1d'][0] == -2.5
+    assert data['dd1000_logk_1mo'][0] == -1.5
+    assert pd.isnull(data['dd1000_logk_7d'][0])
+
+    # existing files are only rewritten on request
+    assert convert_dd(ddfile, outdir) == []
+    assert convert_dd(ddfile, outdir, overwrite=True) == written_files
+
+
+def test_convert_dd_raises_instead_of_exiting(tmpdir):
+    ddfile = write_dd_file(tmpdir, [row[:-1] + ['2016-03-04'] for row in ROWS])
+
+    with pytest.raises(ConversionError) as error:
+        convert_dd(ddfile, str(tmpdir.join('deldisc')))
+
+    assert error.value.issue_label == 'A-00001-F-1-20160304'
+    assert 'Cannot extract date' in error.value.issue_title
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+##
+##  See COPYING file distributed along with the ncanda-data-integration package
+##  for the copyright and license terms
+##
+
+from __future__ import print_function
+import os
+import sys
+import random
+import string
+import pandas as pd
+
+current_dir = os.path.dirname(__file__)
+sys.path.append(os.path.join(current_dir, '../../../scripts/import/laptops/wine'))
+import ssaga
+
+RECORD_WIDTH = max(iTo for (iFrom, iTo) in ssaga.field_offsets.values())
+
+
+def make_record(rng, subject_number):
+    record = [' '] * RECORD_WIDTH
+    record[0:19] = list('A-%05d-F-1%s' % (subject_number, '04032016'))
+    # leave ID and date alone, and the last field blank
+    answers = [offsets for offsets in ssaga.field_offsets.values()
+               if offsets[0] >= 19 and offsets != ssaga.field_offsets['QS']]
+    for (iFrom, iTo) in rng.sample(answers, 1000):
+        for index in range(iFrom, iTo):
+            record[index] = rng.choice(string.ascii_letters + string.digits + ' \xe9')
+    return ''.join(record).rstrip() + '\r\n'
+
+
+def write_asc_file(tmpdir, number_of_records):
+    rng = random.Random(42)
+    ascfile = tmpdir.join('NSSAGA_v3.asc')
+    ascfile.write_binary(''.join(make_record(rng, idx) for idx in range(number_of_records)).encode('latin-1'))
+    return str(ascfile)
+
+
+def fields_one_by_one(records):
+    return [dict(('ssaga_youth_%s' % field.lower(), ssaga.get_field(record, field).strip())
+                 for field in ssaga.fields_to_copy)
+            for record in records]
+
+
+def test_decoder_matches_get_field(tmpdir):
+    records = ssaga.read_records(write_asc_file(tmpdir, 20))
+    assert len(records) == 20
+    assert records[0].endswith('\n') and not records[0].endswith('\r\n')
+
+    names = ['IND_ID'] + ssaga.fields_to_copy + ['QS']
+    decoded = ssaga.FieldDecoder(names).decode(records)
+    assert list(decoded.columns) == list(dict.fromkeys(names))
+    assert decoded['IND_ID'].tolist() == ['A-%05d-F-1' % idx for idx in range(20)]
+    # fields past the end of a shortened record are empty
+    assert decoded['QS'].tolist() == [''] * 20
+
+    decoded = decoded.drop(columns=['IND_ID', 'QS']).rename(columns=lambda field: 'ssaga_youth_%s' % field.lower())
+    assert decoded.to_dict('records') == fields_one_by_one(records)
+
+
+def test_write_csv_record_matches_pandas(tmpdir):
+    data = pd.DataFrame({'record_id': ['A-00001-F-1-2016-03-04'], 'text': ['a, "b", \xe9'],
+                         'empty': [''], 'visit_information_complete': [1]})
+    data.to_csv(str(tmpdir.join('pandas.csv')), index=False)
+    ssaga.write_csv_record(str(tmpdir.join('csv.csv')), list(data.columns),
+                           next(data.itertuples(index=False, name=None)))
+
+    assert tmpdir.join('csv.csv').read_binary() == tmpdir.join('pandas.csv').read_binary()
+
+
+def test_fields_csv_matches_one_by_one(tmpdir):
+    records = ssaga.read_records(write_asc_file(tmpdir, 5))
+    tmpdir.mkdir('one_by_one')
+    tmpdir.mkdir('batched')
+
+    # One record at a time, as blaise2csv used to
+    for (index, ssaga_fields) in enumerate(fields_one_by_one(records)):
+        pd.DataFrame([ssaga_fields]).to_csv(str(tmpdir.join('one_by_one', '%d.csv' % index)), index=False)
+
+    # All records decoded at once, one row written per record
+    decoded = ssaga.FieldDecoder(ssaga.fields_to_copy).decode(records)
+    decoded.rename(columns=lambda field: 'ssaga_youth_%s' % field.lower(), inplace=True)
+    header = list(decoded.columns)
+    for (index, row) in enumerate(decoded.itertuples(index=False, name=None)):
+        ssaga.write_csv_record(str(tmpdir.join('batched', '%d.csv' % index)), header, row)
+
+    for index in range(len(records)):
+        assert (tmpdir.join('batched', '%d.csv' % index).read_binary()
+                == tmpdir.join('one_by_one', '%d.csv' % index).read_binary())
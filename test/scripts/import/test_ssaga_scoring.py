@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+
+##
+##  See COPYING file distributed along with the ncanda-data-integration package
+##  for the copyright and license terms
+##
+
+from __future__ import print_function
+import os
+import re
+import sys
+import time
+import threading
+import subprocess
+import pytest
+import pandas as pd
+from unittest import mock
+
+current_dir = os.path.dirname(__file__)
+sys.path.append(os.path.join(current_dir, '../../../scripts/import/laptops/wine'))
+import ssaga_scoring
+
+SAS_DIR = os.path.join(current_dir, '../../../ssaga/sas')
+
+
+def write_asc(tmpdir, name, ind_id):
+    ascfile = tmpdir.join(name)
+    ascfile.write('%-11s04032016 rest of the interview\n' % ind_id)
+    return str(ascfile)
+
+
+def unix_path(windows_path):
+    return windows_path[2:].replace('\\', '/')
+
+
+def test_scripts_run_in_separate_work_directories(tmpdir):
+    filenames_asc = [write_asc(tmpdir, 'a.asc', 'A-00001-F-1'), write_asc(tmpdir, 'b.asc', 'B-00002-M-1')]
+    workdirs = []
+
+    def fake_sas(sas_script, display=None, timeout=None):
+        with open(unix_path(sas_script), encoding='latin-1') as infile:
+            script = infile.read()
+        workdir = os.path.dirname(unix_path(sas_script))
+        for path in re.findall(r"[Zz]:\\[^';]*", script):
+            assert os.path.normcase(unix_path(path)).startswith(workdir)
+        workdirs.append(workdir)
+        with open(os.path.join(workdir, 'NSSAGA_v3_ASC')) as ascfile:
+            assert [line[:11] for line in ascfile] == ['A-00001-F-1', 'B-00002-M-1']
+        if sas_script.endswith('toCSV.sas'):
+            outfile = re.search(r"outfile='([^']*)'", script).group(1)
+            with open(unix_path(outfile), 'w') as csvfile:
+                csvfile.write('IND_ID,AL_dx\nA-00001-F-1,1\nB-00002-M-1,\n')
+        return (0, '', '')
+
+    with mock.patch.object(ssaga_scoring.sibis_wine, 'sas', side_effect=fake_sas):
+        data = ssaga_scoring.score_batch(filenames_asc, sas_dir=SAS_DIR)
+
+    assert len(set(workdirs)) == 1 and len(workdirs) == 4
+    assert not os.path.exists(workdirs[0])
+    assert data.to_dict('records') == [{'IND_ID': 'A-00001-F-1', 'AL_dx': '1'},
+                                       {'IND_ID': 'B-00002-M-1', 'AL_dx': ''}]
+
+
+def test_batches_hold_each_subject_once(tmpdir):
+    filenames_asc = [write_asc(tmpdir, 'a1.asc', 'A-00001-F-1'), write_asc(tmpdir, 'a2.asc', 'A-00001-F-1'),
+                     write_asc(tmpdir, 'b.asc', 'B-00002-M-1'), write_asc(tmpdir, 'c.asc', 'C-00003-M-1')]
+
+    batches = ssaga_scoring.make_batches(filenames_asc, 2)
+    assert [[os.path.basename(name) for name in batch] for batch in batches] == [['a1.asc', 'b.asc'],
+                                                                               ['a2.asc', 'c.asc']]
+
+
+def test_runner_splits_batches_and_retries_failed_ones(tmpdir):
+    filenames_asc = [write_asc(tmpdir, '%d.asc' % idx, 'A-%05d-F-1' % idx) for idx in range(6)]
+    lock = threading.Lock()
+    calls = []
+
+    def fake_score_batch(batch, display=None, timeout=None):
+        with lock:
+            calls.append(len(batch))
+        ind_ids = [ssaga_scoring.get_ind_id(name) for name in batch]
+        # A-00004-F-1 cannot be scored, and takes its batch down with it
+        if 'A-00004-F-1' in ind_ids:
+            raise Exception('SAS failed')
+        return pd.DataFrame({'IND_ID': ind_ids, 'score': [ind_id[6] for ind_id in ind_ids]}, dtype=str)
+
+    runner = ssaga_scoring.ScoringRunner(workers=2, batch_size=3, use_xvfb=False)
+    with mock.patch.object(ssaga_scoring, 'score_batch', side_effect=fake_score_batch), \
+         mock.patch.object(ssaga_scoring.sibis_wine, 'log') as log:
+        scores = runner.score(filenames_asc)
+
+    assert sorted(calls) == [1, 1, 1, 3, 3]
+    assert sorted(scores.keys()) == sorted(name for name in filenames_asc if not name.endswith('4.asc'))
+    assert scores[filenames_asc[5]].to_dict('records') == [{'IND_ID': 'A-00005-F-1', 'score': '5'}]
+    assert log.call_count == 1
+
+
+def test_retries_of_timed_out_batch_share_its_timeout(tmpdir):
+    filenames_asc = [write_asc(tmpdir, '%d.asc' % idx, 'A-%05d-F-1' % idx) for idx in range(4)]
+    timeouts = []
+
+    def fake_score_batch(batch, display=None, timeout=None):
+        timeouts.append((len(batch), timeout))
+        if len(batch) > 1:
+            raise subprocess.TimeoutExpired('wine', timeout)
+        return pd.DataFrame({'IND_ID': [ssaga_scoring.get_ind_id(batch[0])]}, dtype=str)
+
+    runner = ssaga_scoring.ScoringRunner(batch_size=4, timeout=3600, use_xvfb=False)
+    with mock.patch.object(ssaga_scoring, 'score_batch', side_effect=fake_score_batch), \
+         mock.patch.object(ssaga_scoring.sibis_wine, 'log'):
+        scores = runner.score(filenames_asc)
+
+    assert len(scores) == 4
+    assert timeouts == [(4, 3600)] + [(1, 900)] * 4
+
+
+def test_failed_sas_scripts_are_logged(tmpdir):
+    filenames_asc = [write_asc(tmpdir, 'a.asc', 'A-00001-F-1')]
+
+    def fake_sas(sas_script, display=None, timeout=None):
+        if sas_script.endswith('crtalldx.sas'):
+            return (2, '', b'ERROR: Library NSSAGA does not exist.')
+        return (0, '', '')
+
+    with mock.patch.object(ssaga_scoring.sibis_wine, 'sas', side_effect=fake_sas), \
+         mock.patch.object(ssaga_scoring.sibis_wine, 'log') as log:
+        with pytest.raises(FileNotFoundError):
+            ssaga_scoring.score_batch(filenames_asc, sas_dir=SAS_DIR)
+
+    assert log.call_count == 1
+    assert log.call_args[1]['sas_script'] == 'crtalldx.sas'
+    assert log.call_args[1]['err'] == 'ERROR: Library NSSAGA does not exist.'
+
+
+def test_timeout_kills_programs_started_by_wine(tmpdir):
+    # Like wine, the shell leaves a process behind that does the actual work
+    pidfile = str(tmpdir.join('pid'))
+    cmd = ['sh', '-c', 'sleep 60 & echo $! > %s; wait' % pidfile]
+    start = time.time()
+    with pytest.raises(subprocess.TimeoutExpired):
+        ssaga_scoring.sibis_wine.call_shell_program(cmd, timeout=1)
+    assert time.time() - start < 30
+
+    with open(pidfile) as infile:
+        pid = int(infile.read())
+    for attempt in range(50):
+        try:
+            os.kill(pid, 0)
+        except OSError:
+            break
+        time.sleep(0.1)
+    else:
+        pytest.fail('sleep was not killed')
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+
+##
+##  See COPYING file distributed along with the ncanda-data-integration package
+##  for the copyright and license terms
+##
+
+from __future__ import print_function
+import os
+import sys
+import random
+import pandas as pd
+
+current_dir = os.path.dirname(__file__)
+sys.path.append(os.path.join(current_dir, '../../../scripts/import/laptops'))
+from visit_matching import ImportedRecordIndex, NextVisitIndex
+
+SUBJECTS = ['A-00001-F-1', 'B-00002-M-2', 'C-00003-F-3']
+DATES = ['2019-12-30', '2020-01-01', '2020-01-05', '2020-03-01', '2020-06-30', '2021-01-01']
+
+
+def make_imported_records():
+    rng = random.Random(42)
+    rows = []
+    for idx in range(60):
+        subject_id = rng.choice(SUBJECTS)
+        rows.append({'record_id': '%s-%d' % (subject_id, idx),
+                     'stroop_subject_id': subject_id,
+                     'stroop_date': rng.choice(DATES),
+                     'stroop_complete': '2'})
+    return pd.DataFrame(rows).set_index('record_id')
+
+
+def test_records_match_table_filter():
+    imported_records = make_imported_records()
+    index = ImportedRecordIndex(imported_records, 'stroop_subject_id', 'stroop_date')
+
+    for subject_id in SUBJECTS + ['D-00004-M-4']:
+        records_this_subject = imported_records[
+            imported_records['stroop_subject_id'] == subject_id
+        ].drop(['stroop_subject_id'], axis=1)
+        pd.testing.assert_frame_equal(index.get_subject_records(subject_id), records_this_subject)
+
+        for date in DATES + ['2020-02-01']:
+            expected = records_this_subject[records_this_subject['stroop_date'] == date]
+            pd.testing.assert_frame_equal(index.get_records_on_date(subject_id, date), expected)
+
+        for date_on_or_after in DATES:
+            for date_before in DATES + ['2020-02-01']:
+                expected = records_this_subject[records_this_subject['stroop_date'] >= date_on_or_after]
+                expected = expected[expected['stroop_date'] < date_before]
+                pd.testing.assert_frame_equal(
+                    index.get_records_in_window(subject_id, date_on_or_after, date_before), expected)
+
+
+def test_next_visit_date():
+    entry_data = pd.DataFrame([
+        ('A-00001-F-1', 'baseline_visit_arm_1', '2020-01-01'),
+        ('A-00001-F-1', '1y_visit_arm_1', '2021-01-05'),
+        ('A-00001-F-1', 'recovery_baseline_arm_2', '2020-06-01'),
+        ('A-00001-F-1', '2y_visit_arm_1', None),
+        ('A-00001-F-1', '3y_visit_arm_1', '2023-01-03'),
+        ('B-00002-M-2', 'baseline_visit_arm_1', '2020-02-01'),
+    ], columns=['study_id', 'redcap_event_name', 'visit_date']).set_index(['study_id', 'redcap_event_name'])
+
+    index = NextVisitIndex(entry_data, ['baseline_visit_arm_1', '1y_visit_arm_1', 'recovery_baseline_arm_2'],
+                           skip_event='recovery_baseline_arm_2')
+    assert index.get_next_visit_date('A-00001-F-1', '2020-01-01') == '2021-01-05'
+    assert index.get_next_visit_date('A-00001-F-1', '2019-12-31') == '2020-01-01'
+    assert index.get_next_visit_date('A-00001-F-1', '2021-01-05') is None
+    assert index.get_next_visit_date('B-00002-M-2', '2020-02-01') is None
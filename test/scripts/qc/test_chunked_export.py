@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+##
+##  See COPYING file distributed along with the ncanda-data-integration package
+##  for the copyright and license terms
+##
+
+from __future__ import print_function
+import os
+import sys
+import threading
+import pandas as pd
+import pytest
+import redcap as rc
+
+current_dir = os.path.dirname(__file__)
+sys.path.append(os.path.join(current_dir, '../../../scripts/qc'))
+from chunked_export import export_records_in_chunks
+
+
+class FakeProject(object):
+    '''
+    Mimics PyCap's export_records - fails for chunks larger than max_chunk
+    that contain one of the bad records.
+    '''
+    def_field = 'study_id'
+
+    def __init__(self, num_records, bad_records=(), max_chunk=10):
+        self.records = ['X-%05d-F-1' % idx for idx in range(num_records)]
+        self.bad_records = set(bad_records)
+        self.max_chunk = max_chunk
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def export_records(self, records=None, fields=None, format_type='json', **kwargs):
+        if records is None:
+            return [{self.def_field: record} for record in self.records]
+
+        with self.lock:
+            self.requests.append(len(records))
+        if len(records) > self.max_chunk and self.bad_records.intersection(records):
+            raise rc.RedcapError('chunk too large')
+
+        return pd.DataFrame({'foo': [int(record[2:7]) for record in records]},
+                            index=pd.Index(records, name=self.def_field))
+
+
+def test_exports_all_records_in_order():
+    project = FakeProject(1050)
+    result = export_records_in_chunks(project, chunk_sizes=[100])
+    assert result.index.tolist() == project.records
+    assert project.requests == [100] * 10 + [50]
+
+
+def test_only_failed_chunk_is_retried():
+    project = FakeProject(1000, bad_records=['X-00150-F-1'])
+    result = export_records_in_chunks(project, chunk_sizes=[100, 10], max_workers=3)
+    assert result.index.tolist() == project.records
+    assert sorted(project.requests) == sorted([100] * 10 + [10] * 10)
+
+
+def test_gives_up_at_smallest_chunk_size():
+    project = FakeProject(100, bad_records=['X-00050-F-1'], max_chunk=0)
+    with pytest.raises(ValueError):
+        export_records_in_chunks(project, chunk_sizes=[50, 10])
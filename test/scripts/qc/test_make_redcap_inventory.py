@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+##
+##  See COPYING file distributed along with the ncanda-data-integration package
+##  for the copyright and license terms
+##
+
+from __future__ import print_function
+import os
+import sys
+import io
+import numpy as np
+import pandas as pd
+import pytest
+
+current_dir = os.path.dirname(__file__)
+sys.path.append(os.path.join(current_dir, '../../../scripts/qc'))
+from make_redcap_inventory import (get_flag_and_meta, get_form_flags_and_meta,
+                                   make_redcap_inventory, make_event_inventories)
+
+
+def make_form(num_records, with_text=True, with_dag=True, seed=42):
+    """
+    Synthetic form export, with the column types of a PyCap data frame export
+    """
+    rng = np.random.default_rng(seed)
+    index = pd.MultiIndex.from_tuples(
+        [('X-%05d-F-1' % idx, 'baseline_visit_arm_1') for idx in range(num_records)],
+        names=['study_id', 'redcap_event_name'])
+
+    def maybe_nan(values, fraction=0.3):
+        values = np.asarray(values, dtype=float)
+        values[rng.random(len(values)) < fraction] = np.nan
+        return values
+
+    form = pd.DataFrame(index=index)
+    if with_dag:
+        form['redcap_data_access_group'] = pd.Series(
+            rng.choice(['sri', 'duke', 'ohsu', ''], num_records), index=index).replace('', np.nan)
+    form['visit_ignore___yes'] = rng.integers(0, 2, num_records)
+    form['foo_missing'] = maybe_nan(rng.integers(0, 2, num_records))
+    if with_text:
+        form['foo_missing_why'] = pd.Series(rng.choice(['refused', ''], num_records), index=index).replace('', np.nan)
+    for idx in range(20):
+        form['foo_q%d' % idx] = maybe_nan(rng.integers(0, 5, num_records), fraction=rng.random())
+    if with_text:
+        form['foo_notes'] = pd.Series(rng.choice(['n/a', 'late', ''], num_records), index=index).replace('', np.nan)
+    for idx in range(1, 4):
+        form['foo_check___%d' % idx] = rng.integers(0, 2, num_records)
+    form['foo_exclude'] = maybe_nan(rng.integers(0, 2, num_records))
+    form['foo_complete'] = rng.integers(0, 3, num_records)
+    return form
+
+
+class FakeProject(object):
+    '''
+    Mimics PyCap's data frame export of a longitudinal project
+    '''
+    def_field = 'study_id'
+    is_longitudinal = True
+
+    def __init__(self, columns, rows):
+        self.columns = columns
+        self.rows = rows
+
+    def export_records(self, records=None, events=None, format_type='json', df_kwargs=None, **kwargs):
+        if records is None:
+            return [{self.def_field: record} for record in dict.fromkeys(row[0] for row in self.rows)]
+
+        rows = [row for row in self.rows if row[0] in records and row[1] in events]
+        text = pd.DataFrame(rows, columns=self.columns).to_csv(index=False)
+        return pd.read_csv(io.StringIO(text), **(df_kwargs or {}))
+
+
+def test_event_inventories_match_single_event_exports():
+    columns = ['study_id', 'redcap_event_name', 'redcap_data_access_group',
+               'visit_ignore___yes', 'foo_q1', 'foo_missing', 'foo_complete']
+    rows = [['A', 'ev1', 'sri', '1', '0', '0', '2'],
+            ['A', 'ev2', 'sri', '0', '', '', ''],
+            ['B', 'ev1', 'duke', '0', '3', '0', '1'],
+            ['B', 'ev2', 'duke', '0', '2.5', '1', '0']]
+    api = FakeProject(columns, rows)
+    meta = pd.DataFrame({'form_name': ['foo']})
+
+    inventories = make_event_inventories(api, 'foo', ['ev1', 'ev2'], include_dag=True)
+
+    assert list(inventories) == ['ev1', 'ev2']
+    for event in ['ev1', 'ev2']:
+        expected = make_redcap_inventory(api, forms=['foo'], events=[event], include_dag=True, meta=meta)
+        assert inventories[event].to_csv() == expected.to_csv()
+    assert inventories['ev1'].to_csv().splitlines()[1] == 'A,ev1,sri,1,1,0,2,foo,EXCLUDED'
+
+
+@pytest.mark.parametrize('with_text,with_dag', [(True, True), (True, False), (False, True), (False, False)])
+def test_matches_row_wise_result(with_text, with_dag):
+    form = make_form(300, with_text=with_text, with_dag=with_dag)
+    expected = form.apply(get_flag_and_meta, axis=1)
+    pd.testing.assert_frame_equal(get_form_flags_and_meta(form), expected)
+    assert get_form_flags_and_meta(form).to_csv() == expected.to_csv()
+
+
+def test_reyo_completion_checklist():
+    form = make_form(100)
+    form = form.drop(columns=['foo_complete'])
+    form['np_reyo_qc___completed'] = np.random.default_rng(1).integers(0, 2, len(form))
+    form['np_reyo_complete'] = np.random.default_rng(2).integers(0, 3, len(form))
+    pd.testing.assert_frame_equal(get_form_flags_and_meta(form),
+                                  form.apply(get_flag_and_meta, axis=1))
+
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+##
+##  See COPYING file distributed along with the ncanda-data-integration package
+##  for the copyright and license terms
+##
+
+from __future__ import print_function
+import os
+import sys
+import random
+import datetime
+import operator
+import pytest
+
+current_dir = os.path.dirname(__file__)
+sys.path.append(os.path.join(current_dir, '../../../scripts/redcap'))
+from mr_session_index import MRSessionIndex
+
+
+def linear_sessions_in_range(xnat_sessions_list, subject_id, date_range_from, date_range_to, inclusive_end=True):
+    # lookup as previously done in import_mr_sessions:get_sessions_in_range
+    before_or_on = operator.le if inclusive_end else operator.lt
+    sessions_in_range = []
+    for session_id, session_subject_id, projects, date, scanner in xnat_sessions_list:
+        if (subject_id == session_subject_id) and (date >= date_range_from) and before_or_on(date, date_range_to):
+            sessions_in_range.append((session_id, projects, date))
+    return sessions_in_range
+
+
+def make_sessions(num_sessions, num_subjects, seed=42):
+    rng = random.Random(seed)
+    start = datetime.date(2013, 1, 1)
+    sessions = []
+    for idx in range(num_sessions):
+        subject_id = 'NCANDA_S%05d' % rng.randrange(num_subjects)
+        date = (start + datetime.timedelta(rng.randrange(3650))).strftime('%Y-%m-%d')
+        sessions.append(('NCANDA_E%05d' % idx, subject_id, '<sri_incoming>', date, 'scanner'))
+    return sessions
+
+
+def make_queries(num_queries, num_subjects, seed=7):
+    rng = random.Random(seed)
+    start = datetime.date(2013, 1, 1)
+    queries = []
+    for _ in range(num_queries):
+        subject_id = 'NCANDA_S%05d' % rng.randrange(num_subjects)
+        date_from = start + datetime.timedelta(rng.randrange(3650))
+        date_to = date_from + datetime.timedelta(rng.choice([0, 1, 30, 120]))
+        queries.append((subject_id, date_from.strftime('%Y-%m-%d'), date_to.strftime('%Y-%m-%d')))
+    return queries
+
+
+@pytest.mark.parametrize("inclusive_end", [True, False])
+def test_matches_linear_scan(inclusive_end):
+    sessions = make_sessions(2000, 50)
+    index = MRSessionIndex(sessions)
+    for (subject_id, date_from, date_to) in make_queries(500, 60):
+        assert index.get_sessions_in_range(subject_id, date_from, date_to, inclusive_end=inclusive_end) \
+            == linear_sessions_in_range(sessions, subject_id, date_from, date_to, inclusive_end=inclusive_end)
+
+
+def test_same_day_and_export_order():
+    sessions = [('E3', 'S1', '<b>', '2015-01-02', ''),
+                ('E1', 'S1', '<a>', '2015-01-01', ''),
+                ('E2', 'S1', '<a>', '2015-01-01', ''),
+                ('E4', 'S2', '<a>', '2015-01-01', '')]
+    index = MRSessionIndex(sessions)
+    assert index.get_sessions_in_range('S1', '2015-01-01', '2015-01-02') \
+        == [('E3', '<b>', '2015-01-02'), ('E1', '<a>', '2015-01-01'), ('E2', '<a>', '2015-01-01')]
+    assert index.get_sessions_in_range('S1', '2015-01-01', '2015-01-02', inclusive_end=False) \
+        == [('E1', '<a>', '2015-01-01'), ('E2', '<a>', '2015-01-01')]
+    assert index.get_sessions_in_range('S3', '2015-01-01', '2015-01-02') == []
+    assert index.get_session('E4') == ('S2', '<a>', '2015-01-01')
+    assert index.get_session('E5') is None
+
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+##
+##  See COPYING file distributed along with the ncanda-data-integration package
+##  for the copyright and license terms
+##
+
+from __future__ import print_function
+import os
+import sys
+import random
+import datetime
+import numpy as np
+import pandas as pd
+
+current_dir = os.path.dirname(__file__)
+sys.path.append(os.path.join(current_dir, '../../../scripts/redcap'))
+from record_keys import parse_record_ids, fill_from_record_ids
+
+
+def make_imported_records(rng, number_of_records):
+    record_ids = []
+    for idx in range(number_of_records):
+        date = datetime.date(2013, 1, 1) + datetime.timedelta(days=rng.randint(0, 3650))
+        record_ids.append('%s-%05d-%s-%d-%s' % (rng.choice('ABCDEX'), rng.randint(0, 99999),
+                                                rng.choice('MF'), rng.randint(0, 9), date))
+    # some record IDs were mistyped
+    record_ids[::10] = [record_id.replace('-', '_', 1) for record_id in record_ids[::10]]
+    # about a third of the records have the fields filled in by hand
+    subject_ids = [record_id[:11] if rng.random() < 0.3 else '' for record_id in record_ids]
+    dates = [record_id[-10:] if rng.random() < 0.3 else '' for record_id in record_ids]
+    return pd.DataFrame({'stroop_subject_id': subject_ids, 'stroop_date': dates},
+                        index=pd.Index(record_ids, name='record_id'))
+
+
+def fill_row_by_row(imported_records):
+    # As update_visit_data used to
+    imported_records['stroop_subject_id'] = imported_records.apply(
+        lambda row: row['stroop_subject_id'].upper()
+        if row['stroop_subject_id'] != ""
+        else row.name[0:-11].upper(),
+        axis=1,
+    )
+    imported_records['stroop_date'] = imported_records.apply(
+        lambda row: row['stroop_date'] if row['stroop_date'] != "" else row.name[-10:],
+        axis=1,
+    )
+
+
+def test_parse_record_ids():
+    keys = parse_record_ids(['C-70109-F-0-2015-12-07', 'c-70109-f-0-2015-12-07-22345',
+                             'C-70109-F-0-2015-02-30', 'C-70109-F-0', 'C-7010-F-0-2015-12-07'])
+
+    assert keys['subject_id'].tolist() == ['C-70109-F-0', 'C-70109-F-0', '', '', '']
+    assert keys['date'].tolist() == ['2015-12-07', '2015-12-07', '', '', '']
+    assert keys['valid'].tolist() == [True, True, False, False, False]
+    assert keys.index[1] == 'c-70109-f-0-2015-12-07-22345'
+
+
+def test_fill_keeps_entered_values():
+    imported_records = pd.DataFrame({'subid': ['', 'B-00002-M-1', np.nan, ''],
+                                     'dotest': ['', '', '2016-01-01', '']},
+                                    index=['A-00001-F-1-2015-12-07-22345', 'A-00001-F-1-2015-12-07-22346',
+                                           'C-00003-F-1-2015-12-08-22347', 'bad-record'])
+
+    invalid = fill_from_record_ids(imported_records, 'subid', 'dotest')
+
+    assert invalid == ['bad-record']
+    assert imported_records['subid'].tolist() == ['A-00001-F-1', 'B-00002-M-1', 'C-00003-F-1', 'bad-record']
+    assert imported_records['dotest'].tolist() == ['2015-12-07', '2015-12-07', '2016-01-01', '']
+    assert fill_from_record_ids(imported_records.iloc[0:0], 'subid', 'dotest') == []
+
+
+def test_fill_falls_back_to_slicing():
+    imported_records = pd.DataFrame({'subid': ['', ''], 'dotest': ['', '']},
+                                    index=['A_00001-F-1-2015-12-07-22345', 'C-00003-F-1-2015-02-30-22347'])
+
+    invalid = fill_from_record_ids(imported_records, 'subid', 'dotest')
+
+    assert invalid == ['A_00001-F-1-2015-12-07-22345', 'C-00003-F-1-2015-02-30-22347']
+    assert imported_records['subid'].tolist() == ['A_00001-F-1', 'C-00003-F-1']
+    assert imported_records['dotest'].tolist() == ['2015-12-07', '2015-02-30']
+
+
+def test_fill_matches_row_by_row():
+    rng = random.Random(24)
+    imported_records = make_imported_records(rng, 200)
+    row_by_row = imported_records.copy()
+    vectorized = imported_records.copy()
+
+    fill_row_by_row(row_by_row)
+    invalid = fill_from_record_ids(vectorized, 'stroop_subject_id', 'stroop_date',
+                                   subject_slice=slice(0, -11), date_slice=slice(-10, None))
+    vectorized['stroop_subject_id'] = vectorized['stroop_subject_id'].str.upper()
+
+    assert len(invalid) > 0
+    assert row_by_row['stroop_subject_id'].tolist() == vectorized['stroop_subject_id'].tolist()
+    assert row_by_row['stroop_date'].tolist() == vectorized['stroop_date'].tolist()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+
+##
+##  See COPYING file distributed along with the ncanda-data-integration package
+##  for the copyright and license terms
+##
+
+from __future__ import print_function
+import io
+import os
+import sys
+import datetime
+import pytest
+import pandas as pd
+
+pytest.importorskip('pyarrow')
+
+current_dir = os.path.dirname(__file__)
+sys.path.append(os.path.join(current_dir, '../../../scripts/redcap'))
+from redcap_snapshot import RedcapSnapshot
+
+METADATA = [
+    {'field_name': 'study_id', 'form_name': 'demographics'},
+    {'field_name': 'age', 'form_name': 'demographics'},
+    {'field_name': 'sex', 'form_name': 'demographics'},
+    {'field_name': 'visit_date', 'form_name': 'visit_date'},
+    {'field_name': 'visit_notes', 'form_name': 'visit_date'},
+]
+
+
+class FakeProject(object):
+    '''
+    Mimics PyCap's export_records on a longitudinal project, including dateRangeBegin.
+    '''
+    def __init__(self):
+        self.def_field = 'study_id'
+        self.modified = dict()
+        self.rows = []
+        self.exported_records = []
+
+    def set_row(self, study_id, event, dag, modified, **values):
+        row = {'study_id': study_id, 'redcap_event_name': event, 'redcap_data_access_group': dag}
+        row.update(values)
+        self.rows = [r for r in self.rows if (r['study_id'], r['redcap_event_name']) != (study_id, event)] + [row]
+        self.rows.sort(key=lambda r: r['study_id'])
+        self.modified[study_id] = modified
+
+    def delete_record(self, study_id):
+        self.rows = [r for r in self.rows if r['study_id'] != study_id]
+        del self.modified[study_id]
+
+    def export_metadata(self):
+        return METADATA
+
+    def export_records(self, records=None, fields=None, forms=None, events=None, event_name='label',
+                       export_data_access_groups=False, format_type='json', df_kwargs=None,
+                       date_begin=None):
+        rows = [r for r in self.rows
+                if (records is None or r['study_id'] in records)
+                and (events is None or r['redcap_event_name'] in events)
+                and (date_begin is None or self.modified[r['study_id']] >= date_begin)]
+
+        columns = ['study_id', 'redcap_event_name']
+        if export_data_access_groups:
+            columns.append('redcap_data_access_group')
+        for field in METADATA:
+            if field['field_name'] in columns:
+                continue
+            if (fields and field['field_name'] in fields) or (forms and field['form_name'] in forms):
+                columns.append(field['field_name'])
+        for form in (forms or []):
+            columns.append(form + '_complete')
+
+        # rows that have no data in the exported forms are not exported
+        if forms:
+            rows = [r for r in rows if any(r.get(col, '') != '' for col in columns[2:]
+                                           if col != 'redcap_data_access_group')]
+        data = pd.DataFrame([dict((col, r.get(col, '')) for col in columns) for r in rows], columns=columns)
+
+        if format_type == 'json':
+            return data.to_dict('records')
+        self.exported_records += list(data['study_id'].unique())
+        if not df_kwargs:
+            df_kwargs = {'index_col': ['study_id', 'redcap_event_name']}
+        return pd.read_csv(io.StringIO(data.to_csv(index=False)), **df_kwargs)
+
+
+def make_project():
+    day0 = datetime.datetime(2020, 1, 1)
+    project = FakeProject()
+    project.set_row('A-00001-F-1', 'baseline_visit_arm_1', 'sri', day0, age='15.5', sex='F', demographics_complete='2',
+                    visit_date='2020-01-01', visit_date_complete='2')
+    project.set_row('A-00001-F-1', '1y_visit_arm_1', 'sri', day0, visit_date='2021-01-01', visit_date_complete='1')
+    project.set_row('B-00002-M-2', 'baseline_visit_arm_1', 'ucsd', day0, age='16', sex='M', demographics_complete='2',
+                    visit_date='2020-01-02', visit_notes='rescheduled, twice', visit_date_complete='2')
+    project.set_row('C-00003-F-3', 'baseline_visit_arm_1', 'duke', day0, age='17', sex='F', demographics_complete='0')
+    return project
+
+
+def test_incremental_refresh(tmpdir):
+    project = make_project()
+    snapshot = RedcapSnapshot(project, str(tmpdir))
+    assert snapshot.refresh() == {'demographics': 3, 'visit_date': 2}
+    assert sorted(snapshot.get_forms()) == ['demographics', 'visit_date']
+
+    # modify one record, delete another
+    modified = datetime.datetime.now() + datetime.timedelta(minutes=1)
+    project.set_row('B-00002-M-2', 'baseline_visit_arm_1', 'ucsd', modified, age='16', sex='M', demographics_complete='2',
+                    visit_date='2020-02-02', visit_notes='', visit_date_complete='2')
+    project.delete_record('C-00003-F-3')
+    project.exported_records = []
+
+    snapshot = RedcapSnapshot(project, str(tmpdir))
+    assert snapshot.refresh() == {'demographics': 1, 'visit_date': 1}
+    assert project.exported_records == ['B-00002-M-2', 'B-00002-M-2']
+
+    data = snapshot.export_records(forms=['visit_date'])
+    assert list(data.index.get_level_values(0)) == ['A-00001-F-1', 'A-00001-F-1', 'B-00002-M-2']
+    assert data.loc[('B-00002-M-2', 'baseline_visit_arm_1'), 'visit_date'] == '2020-02-02'
+
+
+def test_export_records_matches_redcap(tmpdir):
+    project = make_project()
+    snapshot = RedcapSnapshot(project, str(tmpdir))
+    snapshot.refresh()
+
+    kwargs_list = [dict(forms=['demographics']),
+                   dict(forms=['visit_date'], events=None, export_data_access_groups=True),
+                   dict(fields=['study_id', 'visit_notes'], forms=['demographics'],
+                        df_kwargs={'index_col': ['study_id', 'redcap_event_name'], 'dtype': str}),
+                   dict(records=['B-00002-M-2'], forms=['visit_date'])]
+    for kwargs in kwargs_list:
+        expected = project.export_records(format_type='df', event_name='unique', **kwargs)
+        actual = snapshot.export_records(format_type='df', event_name='unique', **kwargs)
+        pd.testing.assert_frame_equal(actual.sort_index(), expected.sort_index(), check_like=True)
+
+
+def test_export_date_fields(tmpdir):
+    # as wrong_date_associations reads them
+    project = make_project()
+    snapshot = RedcapSnapshot(project, str(tmpdir))
+    snapshot.refresh()
+
+    kwargs = dict(fields=['visit_date'], events=['baseline_visit_arm_1'], export_data_access_groups=True,
+                  format_type='df', df_kwargs={'index_col': ['study_id', 'redcap_event_name'],
+                                               'dtype': object, 'parse_dates': ['visit_date']})
+    expected = project.export_records(**kwargs).dropna(subset=['visit_date'])
+    actual = snapshot.export_records(**kwargs)
+    pd.testing.assert_frame_equal(actual, expected)
+
+
+def test_snapshot_files_use_umask(tmpdir):
+    umask = os.umask(0o022)
+    os.umask(umask)
+
+    RedcapSnapshot(make_project(), str(tmpdir)).refresh()
+    for name in os.listdir(str(tmpdir)):
+        assert os.stat(str(tmpdir.join(name))).st_mode & 0o777 == 0o666 & ~umask, name
+
+
+def test_stale_snapshot_is_refused(tmpdir):
+    RedcapSnapshot(make_project(), str(tmpdir)).refresh()
+
+    snapshot = RedcapSnapshot(make_project(), str(tmpdir), max_age=datetime.timedelta(hours=24))
+    assert len(snapshot.export_records(forms=['visit_date'])) == 3
+
+    # the nightly refresh failed - the snapshot is two days old
+    refreshed = (datetime.datetime.now() - datetime.timedelta(days=2)).strftime('%Y-%m-%d %H:%M:%S')
+    snapshot._state['forms']['visit_date']['refreshed'] = refreshed
+    snapshot._write_state()
+
+    snapshot = RedcapSnapshot(make_project(), str(tmpdir), max_age=datetime.timedelta(hours=24))
+    with pytest.raises(ValueError):
+        snapshot.export_records(forms=['visit_date'])
+    assert len(snapshot.export_records(forms=['demographics'])) == 3
+
+    # without a limit the snapshot is used whatever its age
+    assert len(RedcapSnapshot(make_project(), str(tmpdir)).export_records(forms=['visit_date'])) == 3
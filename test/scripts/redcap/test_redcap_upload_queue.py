@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+##
+##  See COPYING file distributed along with the ncanda-data-integration package
+##  for the copyright and license terms
+##
+
+from __future__ import print_function
+import os
+import sys
+import json
+from unittest.mock import patch
+
+current_dir = os.path.dirname(__file__)
+sys.path.append(os.path.join(current_dir, '../../../scripts/redcap'))
+import redcap_upload_queue
+from redcap_upload_queue import RedcapUploadQueue
+
+
+class FakeProject(object):
+    '''
+    Mimics PyCap's import_records - rejects the whole import if one record has a bad value.
+    '''
+    def __init__(self, named_errors=True):
+        self.named_errors = named_errors
+        self.requests = []
+        self.imported = []
+
+    def import_records(self, records, overwrite='normal'):
+        self.requests.append(len(records))
+        bad = [r for r in records if r.get('mri_t1_age') == 'bad']
+        if bad:
+            if self.named_errors:
+                lines = ['"%s (%s)","mri_t1_age","bad","not a number"' % (r['study_id'], r['redcap_event_name']) for r in bad]
+            else:
+                lines = ['Something went wrong']
+            raise Exception(json.dumps({'error': '\n'.join(lines)}))
+
+        self.imported += records
+        return {'count': len(records)}
+
+
+class FakeSession(object):
+    '''
+    Mimics sibispy's redcap_import_record - reports a failed import and returns None.
+    '''
+    def __init__(self, project):
+        self.project = project
+        self.imports = []
+        self.failed = []
+
+    def redcap_import_record(self, error_label, subject_label, event, time_label, records, record_id=None,
+                             import_format='json'):
+        self.imports.append((error_label, subject_label, event, time_label, record_id))
+        try:
+            return self.project.import_records(records, overwrite='overwrite')
+        except Exception:
+            self.failed.append(error_label)
+            return None
+
+
+def make_record(idx, bad=False):
+    return {'study_id': 'A-%05d-F-1' % idx,
+            'redcap_event_name': 'baseline_visit_arm_1',
+            'mri_t1_age': 'bad' if bad else float('nan')}
+
+
+def test_batches_and_sanitizes():
+    project = FakeProject()
+    session = FakeSession(project)
+    queue = RedcapUploadQueue(session, project, batch_size=3)
+    for idx in range(7):
+        queue.add('A-%05d-F-1-2015-01-01' % idx, make_record(idx))
+
+    assert queue.flush() == 7
+    assert project.requests == [3, 3, 1]
+    assert all(r['mri_t1_age'] == '' for r in project.imported)
+    # the last record is imported on its own
+    assert session.imports == [('A-00006-F-1-2015-01-01', 'A-00006-F-1', 'baseline_visit_arm_1', None, None)]
+
+
+@patch.object(redcap_upload_queue.slog, 'info')
+def test_single_records_are_imported_through_session(info):
+    project = FakeProject()
+    session = FakeSession(project)
+    queue = RedcapUploadQueue(session, project, batch_size=1, timer_label='mr_session_report')
+    for idx in range(3):
+        queue.add('A-%05d-F-1-2015-01-01' % idx, make_record(idx, bad=idx == 1))
+    queue.add('A-00003-F-1-stroop', make_record(3), time_label='add_to_upload', record_id='A-00003-F-1-2015-01-01-1')
+
+    assert queue.flush() == 3
+    # like the former per-record uploads, only the first is timed
+    assert [entry[3] for entry in session.imports] == ['mr_session_report', None, None, 'add_to_upload']
+    assert session.imports[3][4] == 'A-00003-F-1-2015-01-01-1'
+    assert session.failed == ['A-00001-F-1-2015-01-01']
+    assert not info.called
+
+
+@patch.object(redcap_upload_queue.slog, 'info')
+def test_fields_and_records_responses_are_reported(info):
+    project = FakeProject()
+    project.import_records = lambda records, overwrite='normal': {'count': 0, 'fields': ['mri_t1_age'], 'records': ['A-00000-F-1']}
+    queue = RedcapUploadQueue(FakeSession(project), project, batch_size=1)
+    queue.add('A-00000-F-1-2015-01-01', make_record(0))
+
+    assert queue.flush() == 0
+    assert [call[1] for call in info.call_args_list] == [{'fields': "['mri_t1_age']"}, {'records': "['A-00000-F-1']"}]
+    assert all(call[0][0].startswith('A-00000-F-1-2015-01-01-') for call in info.call_args_list)
+
+
+def test_named_errors_are_mapped_to_visit():
+    project = FakeProject()
+    session = FakeSession(project)
+    queue = RedcapUploadQueue(session, project, batch_size=10)
+    for idx in range(10):
+        queue.add('A-%05d-F-1-2015-01-01' % idx, make_record(idx, bad=idx in (2, 7)))
+
+    assert queue.flush() == 8
+    assert project.requests == [10, 1, 1, 8]
+    assert session.failed == ['A-00002-F-1-2015-01-01', 'A-00007-F-1-2015-01-01']
+
+
+def test_unnamed_errors_bisect():
+    project = FakeProject(named_errors=False)
+    session = FakeSession(project)
+    queue = RedcapUploadQueue(session, project, batch_size=8)
+    for idx in range(8):
+        queue.add('A-%05d-F-1-2015-01-01' % idx, make_record(idx, bad=idx == 5))
+
+    assert queue.flush() == 7
+    assert session.failed == ['A-00005-F-1-2015-01-01']
+
+
+@patch.object(redcap_upload_queue.slog, 'info')
+def test_error_context_is_reported(info):
+    project = FakeProject()
+    # an error in the response rather than an exception
+    project.import_records = lambda records, overwrite='normal': {'error': 'not a number'}
+    queue = RedcapUploadQueue(FakeSession(project), project, batch_size=1)
+    queue.add('A-00001-F-1-stroop', make_record(1), record_id='A-00001-F-1-2015-01-01-1',
+              redcap_url='https://redcap/form/1')
+
+    assert queue.flush() == 0
+    assert len(info.call_args_list) == 1
+    assert info.call_args_list[0][1] == {'redcap_url': 'https://redcap/form/1', 'record_id': 'A-00001-F-1-2015-01-01-1'}
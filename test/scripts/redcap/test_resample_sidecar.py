@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+##
+##  See COPYING file distributed along with the ncanda-data-integration package
+##  for the copyright and license terms
+##
+
+from __future__ import print_function
+import os
+import sys
+import xml.etree.ElementTree as ET
+
+current_dir = os.path.dirname(__file__)
+sys.path.append(os.path.join(current_dir, '../../../scripts/redcap'))
+from resample_sidecar import get_resample_factors, rewrite_sidecar
+
+SIDECAR = '''<?xml version="1.0" encoding="utf-8"?>
+<image>
+  <dicom>
+    <Manufacturer>GE MEDICAL SYSTEMS</Manufacturer>
+    <PixelSpacing>0.9375\\0.9375</PixelSpacing>
+    <SliceThickness>2.5</SliceThickness>
+    <Rows>256</Rows>
+    <Columns>256</Columns>
+  </dicom>
+</image>
+'''
+
+def test_get_resample_factors():
+    assert get_resample_factors([0.9375, 0.9375, 2.5]) == (2, 2, 1)
+    assert get_resample_factors(['0.9375', '0.9375', '2.5']) == (2, 2, 1)
+    assert get_resample_factors([1.875, 1.875, 2.5]) is None
+    assert get_resample_factors([None, None, None]) is None
+
+def test_rewrite_sidecar(tmpdir):
+    from_path = str(tmpdir.join('from.xml'))
+    to_path = str(tmpdir.join('to.xml'))
+    with open(from_path, 'w') as fi:
+        fi.write(SIDECAR)
+
+    rewrite_sidecar(from_path, to_path, [0.9375, 0.9375, 2.5])
+
+    dicom = ET.parse(to_path).getroot().find('dicom')
+    assert dicom.find('PixelSpacing').text == '1.875\\1.875'
+    assert dicom.find('Rows').text == '128'
+    assert dicom.find('Columns').text == '128'
+    assert dicom.find('SliceThickness').text == '2.5'
+    assert dicom.find('Manufacturer').text == 'GE MEDICAL SYSTEMS'
+    assert sorted(os.listdir(str(tmpdir))) == ['from.xml', 'to.xml']
+
+def test_rewrite_sidecar_anisotropic(tmpdir):
+    from_path = str(tmpdir.join('from.xml'))
+    with open(from_path, 'w') as fi:
+        fi.write(SIDECAR.replace('<Rows>256', '<Rows>192'))
+
+    rewrite_sidecar(from_path, from_path, ['0.9375', '0.9375', '2.5'],
+                    transforms={(0.9375, 0.9375, 2.5): (4, 2, 1)},
+                    matrix_sizes={(0.9375, 0.9375, 2.5): (256, 192)})
+
+    dicom = ET.parse(from_path).getroot().find('dicom')
+    assert dicom.find('PixelSpacing').text == '1.875\\3.75'
+    assert dicom.find('Rows').text == '96'
+    assert dicom.find('Columns').text == '64'
+
+def test_rewrite_sidecar_keeps_other_values(tmpdir):
+    from_path = str(tmpdir.join('from.xml'))
+    to_path = str(tmpdir.join('to.xml'))
+    sidecar = SIDECAR.replace('<image>', '<image xmlns:d="http://example.org/dicom">') \
+                     .replace('<Rows>256</Rows>', '<d:Rows>512</d:Rows>') \
+                     .replace('<dicom>', '<dicom>\n    <!-- written by dcm2image -->') \
+                     .replace('</dicom>', '  <Localizer><PixelSpacing>1.2\\1.2</PixelSpacing></Localizer>\n  </dicom>')
+    with open(from_path, 'w') as fi:
+        fi.write(sidecar)
+
+    rewrite_sidecar(from_path, to_path, [0.9375, 0.9375, 2.5])
+
+    expected = sidecar.replace('0.9375\\0.9375', '1.875\\1.875').replace('<Columns>256', '<Columns>128')
+    assert ET.tostring(ET.parse(to_path).getroot()) == ET.tostring(ET.fromstring(expected.split('\n', 1)[1]))
+    with open(to_path) as fi:
+        written = fi.read()
+    assert '<!-- written by dcm2image -->' in written
+    assert '<d:Rows>512</d:Rows>' in written
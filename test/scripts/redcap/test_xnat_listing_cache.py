@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+##
+##  See COPYING file distributed along with the ncanda-data-integration package
+##  for the copyright and license terms
+##
+
+from __future__ import print_function
+import os
+import sys
+import threading
+
+current_dir = os.path.dirname(__file__)
+sys.path.append(os.path.join(current_dir, '../../../scripts/redcap'))
+from xnat_listing_cache import XnatListingCache, get_listing_cache
+
+
+class FakeXnat(object):
+    def __init__(self):
+        self.requests = []
+
+    def _get_json(self, uri):
+        self.requests.append(uri)
+        return [{'uri': uri}]
+
+
+def test_listing_fetched_once_per_run():
+    xnat = FakeXnat()
+    cache = XnatListingCache(xnat)
+    for _ in range(5):
+        cache.get_resources('NCANDA_E00001')
+        cache.get_files('NCANDA_E00001', '123')
+
+    assert len(xnat.requests) == 2
+    assert (cache.hits, cache.misses) == (8, 2)
+
+    # a changed experiment is listed again
+    cache.set_last_modified('NCANDA_E00001', '2020-01-02 10:00:00.0')
+    cache.get_resources('NCANDA_E00001')
+    assert len(xnat.requests) == 3
+
+
+def test_persisted_listing_depends_on_last_modified(tmpdir):
+    cache_file = str(tmpdir.join('listing.sqlite'))
+
+    xnat = FakeXnat()
+    cache = XnatListingCache(xnat, cache_file=cache_file)
+    cache.set_last_modified('NCANDA_E00001', '2020-01-01 10:00:00.0')
+    cache.get_resources('NCANDA_E00001')
+    cache.get_resources('NCANDA_E00002')
+    cache.close()
+    assert len(xnat.requests) == 2
+
+    # unchanged experiment comes from the file, unknown last-modified is refetched
+    xnat = FakeXnat()
+    cache = XnatListingCache(xnat, cache_file=cache_file)
+    cache.set_last_modified('NCANDA_E00001', '2020-01-01 10:00:00.0')
+    assert cache.get_resources('NCANDA_E00001') == [{'uri': '/data/experiments/NCANDA_E00001/resources/'}]
+    cache.get_resources('NCANDA_E00002')
+    assert xnat.requests == ['/data/experiments/NCANDA_E00002/resources/']
+
+    # modified experiment is refetched
+    cache.set_last_modified('NCANDA_E00001', '2020-03-01 10:00:00.0')
+    cache.get_resources('NCANDA_E00001')
+    assert xnat.requests[-1] == '/data/experiments/NCANDA_E00001/resources/'
+    cache.close()
+
+
+def test_threads_fetch_through_their_own_connection():
+    xnat = FakeXnat()
+    cache = get_listing_cache(xnat)
+    worker_xnat = FakeXnat()
+
+    def worker():
+        cache.use_in_thread(worker_xnat)
+        assert get_listing_cache(worker_xnat) is cache
+        cache.get_resources('NCANDA_E00001')
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    thread.join()
+
+    # the listing fetched by the worker is shared with the main thread
+    cache.get_resources('NCANDA_E00001')
+    cache.get_scans('NCANDA_E00001')
+    assert worker_xnat.requests == ['/data/experiments/NCANDA_E00001/resources/']
+    assert xnat.requests == ['/data/experiments/NCANDA_E00001/scans']
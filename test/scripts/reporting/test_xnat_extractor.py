@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+##
+##  See COPYING file distributed along with the ncanda-data-integration package
+##  for the copyright and license terms
+##
+
+from __future__ import print_function
+import os
+import sys
+import json
+import threading
+from unittest import mock
+
+current_dir = os.path.dirname(__file__)
+sys.path.append(os.path.join(current_dir, '../../../scripts/reporting'))
+import xnat_extractor
+
+
+class FakeResponse(object):
+    def __init__(self, text, ok=True):
+        self.text = text
+        self.ok = ok
+
+
+class FakeSession(object):
+    '''
+    Mimics the XNAT calls of sibispy.Session used by the extractor
+    '''
+    def __init__(self, last_modified, failing=()):
+        self.last_modified = last_modified
+        self.failing = set(failing)
+        self.failing_with = None
+        self.downloaded = []
+        self.lock = threading.Lock()
+
+    def xnat_http_get_all_experiments(self):
+        return FakeResponse('ID,project,label\n' + ''.join('%s,SRI,label\n' % eid for eid in sorted(self.last_modified)))
+
+    def xnat_export_general(self, form, fields, conditions, name):
+        return [(eid, last_modified) for (eid, last_modified) in self.last_modified.items() if last_modified]
+
+    def xnat_http_get_experiment_xml(self, experiment_id):
+        with self.lock:
+            self.downloaded.append(experiment_id)
+        if experiment_id in self.failing:
+            if self.failing_with:
+                raise self.failing_with
+            return FakeResponse('Internal Server Error', ok=False)
+        return FakeResponse('<xnat:MRSession ID="%s" modified="%s"/>'
+                            % (experiment_id, self.last_modified[experiment_id]))
+
+
+def read_xml(tmpdir, experiment_id):
+    return tmpdir.join('experiments', '%s.xml' % experiment_id).read()
+
+
+def test_sync_downloads_only_changed_experiments(tmpdir):
+    experiment_dir = str(tmpdir.join('experiments'))
+    session = FakeSession({'E1': '2020-01-01 10:00:00', 'E2': '2020-01-01 10:00:00',
+                           'E3': '2020-01-01 10:00:00', 'E4': ''})
+
+    files = xnat_extractor.sync_experiment_xml(session, experiment_dir)
+    assert sorted(session.downloaded) == ['E1', 'E2', 'E3', 'E4']
+    assert files == [os.path.join(experiment_dir, '%s.xml' % eid) for eid in ['E1', 'E2', 'E3', 'E4']]
+
+    # E2 modified, E3 removed, E5 added - E4 has no LAST_MODIFIED and is always fetched
+    session.last_modified.update(E2='2020-02-01 10:00:00', E5='2020-02-01 10:00:00')
+    del session.last_modified['E3']
+    session.downloaded = []
+    files = xnat_extractor.sync_experiment_xml(session, experiment_dir)
+
+    assert sorted(session.downloaded) == ['E2', 'E4', 'E5']
+    assert sorted(os.listdir(experiment_dir)) == ['.manifest.json', 'E1.xml', 'E2.xml', 'E4.xml', 'E5.xml']
+    assert '2020-02-01' in read_xml(tmpdir, 'E2')
+    assert len(files) == 4
+
+
+def test_sync_keeps_previous_file_if_download_fails(tmpdir):
+    experiment_dir = str(tmpdir.join('experiments'))
+    session = FakeSession({'E1': '2020-01-01 10:00:00', 'E2': '2020-01-01 10:00:00'})
+    xnat_extractor.sync_experiment_xml(session, experiment_dir)
+
+    session.last_modified['E1'] = '2020-02-01 10:00:00'
+    session.failing = {'E1'}
+    xnat_extractor.sync_experiment_xml(session, experiment_dir)
+    assert '2020-01-01' in read_xml(tmpdir, 'E1')
+    with open(os.path.join(experiment_dir, '.manifest.json')) as fi:
+        assert json.load(fi)['E1'] == '2020-01-01 10:00:00'
+
+    # same for connection errors
+    session.failing_with = IOError('Connection reset by peer')
+    xnat_extractor.sync_experiment_xml(session, experiment_dir)
+    assert '2020-01-01' in read_xml(tmpdir, 'E1')
+
+    # tried again on the next run
+    session.failing = set()
+    session.downloaded = []
+    xnat_extractor.sync_experiment_xml(session, experiment_dir)
+    assert session.downloaded == ['E1']
+    assert '2020-02-01' in read_xml(tmpdir, 'E1')
+
+
+def test_sync_downloads_with_session_pool(tmpdir):
+    session = FakeSession(dict(('E%d' % idx, '2020-01-01 10:00:00') for idx in range(20)))
+    other_sessions = [FakeSession(session.last_modified) for idx in range(3)]
+
+    with mock.patch.object(xnat_extractor, 'connect_http_session', side_effect=other_sessions):
+        files = xnat_extractor.sync_experiment_xml(session, str(tmpdir.join('experiments')), jobs=4)
+
+    downloaded = session.downloaded + [eid for other in other_sessions for eid in other.downloaded]
+    assert sorted(downloaded) == sorted(session.last_modified)
+    assert len(files) == 20
+    assert not [name for name in os.listdir(str(tmpdir.join('experiments'))) if name.endswith('.tmp')]
+
+
+def test_files_are_readable_by_others(tmpdir):
+    umask = os.umask(0o022)
+    os.umask(umask)
+    session = FakeSession(dict(('E%d' % idx, '2020-01-01 10:00:00') for idx in range(20)))
+    other_sessions = [FakeSession(session.last_modified) for idx in range(3)]
+
+    with mock.patch.object(xnat_extractor, 'connect_http_session', side_effect=other_sessions):
+        files = xnat_extractor.sync_experiment_xml(session, str(tmpdir.join('experiments')), jobs=4)
+
+    for filename in files:
+        assert os.stat(filename).st_mode & 0o777 == 0o666 & ~umask
+    # the download threads leave the umask of the process alone
+    assert os.umask(umask) == umask
+
+    filename = str(tmpdir.join('E1.xml'))
+    xnat_extractor.write_file_atomic(filename, '<xnat:MRSession/>', mode=0o640)
+    assert os.stat(filename).st_mode & 0o777 == 0o640
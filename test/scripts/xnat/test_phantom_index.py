@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+
+##
+##  See COPYING file distributed along with the ncanda-data-integration package
+##  for the copyright and license terms
+##
+
+from __future__ import print_function
+import os
+import sys
+
+current_dir = os.path.dirname(__file__)
+sys.path.append(os.path.join(current_dir, '../../../scripts/xnat'))
+from phantom_index import PhantomIndex
+
+PHANTOM_SESSIONS = [
+    ('NCANDA_S00001', 'NCANDA_E00010', '2020-01-03', '09:00:00'),
+    ('NCANDA_S00001', 'NCANDA_E00011', '2020-01-03', '11:00:00'),
+    ('NCANDA_S00001', 'NCANDA_E00012', '2020-01-14', '09:00:00'),
+    ('NCANDA_S00001', 'NCANDA_E00013', '2020-01-17', '11:00:00'),
+    ('NCANDA_S00002', 'NCANDA_E00020', '2020-01-10', '10:00:00'),
+]
+
+def test_window_matches_xnat_constraints():
+    index = PhantomIndex(PHANTOM_SESSIONS)
+
+    # lower bound day counts from the time of the session on, upper bound day up to it
+    assert index.find_sessions('NCANDA_S00001', '2020-01-10', '10:00:00', 7) == ['NCANDA_E00011', 'NCANDA_E00012']
+    assert index.find_sessions('NCANDA_S00001', '2020-01-10', '11:00:00', 7) == ['NCANDA_E00011', 'NCANDA_E00012', 'NCANDA_E00013']
+    assert index.find_sessions('NCANDA_S00002', '2020-01-17', '10:00:01', 7) == []
+    assert index.find_sessions('NCANDA_S00002', '2020-01-17', '10:00:00', 7) == ['NCANDA_E00020']
+    assert index.find_sessions('NCANDA_S00003', '2020-01-10', '10:00:00', 7) == []
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+
+##
+##  See COPYING file distributed along with the ncanda-data-integration package
+##  for the copyright and license terms
+##
+
+from __future__ import print_function
+import os
+import sys
+
+current_dir = os.path.dirname(__file__)
+sys.path.append(os.path.join(current_dir, '../../../scripts/xnat'))
+from scan_metadata import SessionScanMetadata
+
+SCAN_XML = '''<?xml version="1.0" encoding="UTF-8"?>
+<xnat:MRScan ID="5" type="ncanda-dti60b1000-v1" xmlns:xnat="http://nrg.wustl.edu/xnat" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">
+<xnat:quality>usable</xnat:quality>
+<xnat:frames>3968</xnat:frames>
+<xnat:parameters>
+<xnat:voxelRes x="1.875" y="1.875" z="2.5"/><!--hidden-->
+<xnat:fov x="240" y="240"/>
+<xnat:te>82.4</xnat:te>
+</xnat:parameters>
+</xnat:MRScan>
+'''
+
+def test_scan_xml_fetched_once():
+    fetched = []
+    def get_scan_xml(scan):
+        fetched.append(scan)
+        return SCAN_XML
+
+    metadata = SessionScanMetadata(get_scan_xml)
+    assert metadata.mget('5', ['type', 'quality']) == ['ncanda-dti60b1000-v1', 'usable']
+    assert metadata.mget('5', ['frames']) == ['3968']
+    assert metadata.mget('5', ['xnat:mrScanData/parameters/te',
+                               'xnat:mrScanData/parameters/fov/x',
+                               'xnat:mrScanData/parameters/fov/y',
+                               'xnat:mrScanData/parameters/voxelRes/x',
+                               'xnat:mrScanData/parameters/voxelRes/y']) == ['82.4', '240', '240', '1.875', '1.875']
+
+    scan = metadata.get('5')
+    assert scan.voxel_res_string() == 'x="1.875" y="1.875" z="2.5"'
+    assert scan.voxel_res == ('1.875', '1.875', '2.5')
+    assert scan.get('parameters/missing') is None
+    assert fetched == ['5']
+    assert metadata.requests == 1